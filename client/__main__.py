@@ -35,7 +35,7 @@ import cv2
 
 from arguments import parse_args
 from grpc_client import GrpcClient
-from http_client import HttpClient
+from http_client import HttpClient, HttpStreamClient
 from results_processor import ResultsProcessor
 from common.exception_handler import log_exception
 from common import constants
@@ -102,7 +102,9 @@ def _log_fps(start_time, frames_received, prev_fps_delta, fps_interval):
 def _get_client(args, image):
     if args.protocol == constants.GRPC_PROTOCOL:
         height, width, _ = image.shape
-        return GrpcClient(args, width, height, image.size)
+        return GrpcClient(args, width, height)
+    if args.http_stream:
+        return HttpStreamClient(args)
     return HttpClient(args)
 
 def main():
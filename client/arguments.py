@@ -34,6 +34,7 @@ import json
 import argparse
 from common.util import validate_extension_config
 from common import constants
+from common.shared_memory import MEMORY_OPTIONS
 
 def parse_args(args=None, program_name="DL Streamer Edge AI Extension Client"):
     parser = argparse.ArgumentParser(
@@ -54,7 +55,7 @@ def parse_args(args=None, program_name="DL Streamer Edge AI Extension Client"):
         "-s",
         metavar=("grpc_server_address"),
         dest="grpc_server_address",
-        help="gRPC server address.",
+        help="gRPC server address, host:port or unix:path for a server on the same host.",
         default=None,
     )
     parser.add_argument(
@@ -77,13 +78,44 @@ def parse_args(args=None, program_name="DL Streamer Edge AI Extension Client"):
         type=str,
     )
 
+    parser.add_argument(
+        "--http-response-format",
+        help="Format of HTTP results, streams always return JSON lines",
+        default="json",
+        type=str.lower,
+        choices=["json", "protobuf"],
+    )
+
+    parser.add_argument(
+        "--http-stream",
+        action="store_true",
+        help="Send frames as one streaming HTTP upload with frames in flight",
+    )
+
     parser.add_argument(
         "--http-image-encoding",
         dest="encoding",
         help=" HTTP image encoding",
         default="jpeg",
         type=str,
-        choices=["jpeg", "png", "bmp"],
+        choices=["jpeg", "png", "bmp", "raw"],
+    )
+
+    parser.add_argument(
+        "--pixel-format",
+        help="Pixel format of raw frames sent over gRPC or HTTP",
+        default="bgr24",
+        type=str.lower,
+        choices=["bgr24", "rgb24", "bgra", "rgba", "yuv420p"],
+    )
+
+    parser.add_argument(
+        "--grpc-image-encoding",
+        dest="grpc_encoding",
+        help="Encoding of frames sent over gRPC",
+        default="raw",
+        type=str.lower,
+        choices=["raw", "jpeg", "png", "bmp"],
     )
 
     parser.add_argument(
@@ -150,6 +182,30 @@ def parse_args(args=None, program_name="DL Streamer Edge AI Extension Client"):
         default=False,
         help="set to use shared memory",
     )
+    parser.add_argument(
+        "--shared-memory-segments",
+        action="store_true",
+        help="Use shared memory with each frame in its own segment",
+    )
+    parser.add_argument(
+        "--shared-memory-options",
+        help="Options applied when mapping shared memory",
+        nargs="*",
+        choices=MEMORY_OPTIONS,
+        default=[],
+    )
+    parser.add_argument(
+        "--memfd-socket",
+        help="Pass shared memory to the server as a memfd over this Unix socket",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--shared-memory-timeout",
+        help="Seconds to wait for free shared memory before failing (0 waits indefinitely)",
+        type=float,
+        default=0,
+    )
     # nosec skips pybandit hits
     parser.add_argument(
         "-o",
@@ -197,6 +253,34 @@ def parse_args(args=None, program_name="DL Streamer Edge AI Extension Client"):
         default="",
     )
 
+    parser.add_argument(
+        "--frames-in-flight",
+        action="store",
+        help="Number of frames the server may process concurrently for this stream",
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--no-share-model-instances",
+        action="store_true",
+        help="Do not share model instances with other streams",
+    )
+
+    parser.add_argument(
+        "--response-shared-memory",
+        action="store_true",
+        help="Ask the server to send large responses through shared memory",
+    )
+
+    parser.add_argument(
+        "--ack-coalescing-interval",
+        action="store",
+        help="Milliseconds the server may hold acks of frames without results to send them as one",
+        type=int,
+        default=0,
+    )
+
     parser.add_argument(
         "--scale-factor",
         action="store",
@@ -220,6 +304,8 @@ def parse_args(args=None, program_name="DL Streamer Edge AI Extension Client"):
         result.grpc_server_address = "{}:{}".format(
             result.server_ip, result.grpc_port
         )
+    if result.memfd_socket and result.shared_memory_segments:
+        parser.error("--memfd-socket cannot be used with --shared-memory-segments")
     return result
 
 
@@ -252,6 +338,18 @@ def _create_extension_config(args):
             raise Exception("Issue loading pipeline extensions: {}".format(
                 args.pipeline_extensions)) from err
 
+    if args.frames_in_flight > 0:
+        pipeline_config[constants.FRAMES_IN_FLIGHT] = args.frames_in_flight
+
+    if args.no_share_model_instances:
+        pipeline_config[constants.SHARE_MODEL_INSTANCES] = False
+
+    if args.response_shared_memory:
+        pipeline_config[constants.RESPONSE_SHARED_MEMORY] = True
+
+    if args.ack_coalescing_interval > 0:
+        pipeline_config[constants.ACK_COALESCING_INTERVAL] = args.ack_coalescing_interval
+
     if len(pipeline_config) > 0:
         extension_config.setdefault("pipeline", pipeline_config)
 
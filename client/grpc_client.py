@@ -30,18 +30,59 @@
 import logging
 import queue
 import json
+import cv2
+import numpy
 
 from google.protobuf.json_format import MessageToDict
 from media_stream_processor import MediaStreamProcessor
 
 from protocol_client import Client
 from arguments import get_extension_config
+from common import constants
+
+
+# Client pixel format -> (MediaStreamDescriptor pixel format, conversion from decoded BGR, bytes per pixel)
+PIXEL_FORMATS = {
+    "bgr24": ("BGR24", None, 3),
+    "rgb24": ("RGB24", cv2.COLOR_BGR2RGB, 3),
+    "bgra": ("BGRA", cv2.COLOR_BGR2BGRA, 4),
+    "rgba": ("RGBA", cv2.COLOR_BGR2RGBA, 4),
+    "yuv420p": ("YUV420P", cv2.COLOR_BGR2YUV_I420, 1.5),
+}
+
+# Client image encoding -> MediaStreamDescriptor encoding
+ENCODINGS = {
+    "raw": "RAW",
+    "jpeg": "JPG",
+    "png": "PNG",
+    "bmp": "BMP",
+}
 
 
 class GrpcClient(Client):
-    def __init__(self, args, width, height, frame_size):
+    def __init__(self, args, width, height):
         super().__init__()
         self._frame_queue = queue.Queue(args.frame_queue_size)
+        encoding = ENCODINGS[args.grpc_encoding]
+        self._image_extension = None
+        if encoding == "RAW":
+            pixel_format, self._color_conversion, bytes_per_pixel = PIXEL_FORMATS[args.pixel_format]
+        else:
+            # Shared memory is sized as for BGR frames, encoded frames are typically much smaller
+            self._image_extension = ".{}".format(args.grpc_encoding)
+            pixel_format, self._color_conversion, bytes_per_pixel = ("NONE", None, 3)
+        frame_size = int(width * height * bytes_per_pixel)
+        # Raw frames are converted straight into their shared memory slot
+        self._frame_shape = None
+        use_shared_memory = args.use_shared_memory or args.shared_memory_segments
+        if use_shared_memory and encoding == "RAW":
+            if args.pixel_format == "yuv420p":
+                self._frame_shape = (height * 3 // 2, width)
+            else:
+                self._frame_shape = (height, width, bytes_per_pixel)
+            self._frame_size = frame_size
+        self._bytes_sent = 0
+        self._frames_sent = 0
 
         extension_config = get_extension_config(args)
 
@@ -49,19 +90,43 @@ class GrpcClient(Client):
 
         self._msp = MediaStreamProcessor(
             args.grpc_server_address,
-            args.use_shared_memory,
+            use_shared_memory,
             args.frame_queue_size,
             frame_size,
+            encoding == "RAW",
+            args.shared_memory_timeout or None,
+            args.shared_memory_segments,
+            args.shared_memory_options,
+            args.memfd_socket,
+            bool(extension_config.get("pipeline", {}).get(constants.ACK_COALESCING_INTERVAL)),
         )
 
         self._msp.start(width, height, self._frame_queue,
-                       self._result_queue, json.dumps(extension_config))
+                       self._result_queue, json.dumps(extension_config), pixel_format, encoding)
 
     def put_frame(self, image):
         if image is None:
             frame = None
+        elif self._frame_shape:
+            view, frame = self._msp.reserve_frame(self._frame_size)
+            destination = numpy.frombuffer(view, dtype=numpy.uint8).reshape(self._frame_shape)
+            if self._color_conversion is not None:
+                cv2.cvtColor(image, self._color_conversion, dst=destination)
+            else:
+                numpy.copyto(destination, image)
+            # Slot view must not outlive the frame, shared memory is unmapped on exit
+            del destination
+            view.release()
+            self._bytes_sent += self._frame_size
+            self._frames_sent += 1
         else:
+            if self._color_conversion is not None:
+                image = cv2.cvtColor(image, self._color_conversion)
+            if self._image_extension:
+                _, image = cv2.imencode(self._image_extension, image)
             frame = image.tobytes()
+            self._bytes_sent += len(frame)
+            self._frames_sent += 1
         self._frame_queue.put(frame)
 
     def get_result(self):
@@ -72,3 +137,6 @@ class GrpcClient(Client):
 
     def stop(self):
         self._msp.stop()
+        if self._frames_sent:
+            logging.info("Frame Bytes Sent: {} Average Per Frame: {}".format(
+                self._bytes_sent, self._bytes_sent // self._frames_sent))
@@ -29,12 +29,18 @@
 """
 
 import json
+import socket
 import logging
+import urllib.parse
+from threading import Thread
 import requests
 import cv2
+from google.protobuf.json_format import MessageToDict
 from protocol_client import Client
+from grpc_client import PIXEL_FORMATS
 from arguments import get_extension_config
 from common import constants
+from common.grpc_autogen import extension_pb2
 from common.util import get_pipeline_config_value
 
 
@@ -50,10 +56,19 @@ class HttpClient(Client):
 
         self._encoding = '.{}'.format(args.encoding)
         content_type = "image/{}".format(args.encoding)
+        self._raw = args.encoding == "raw"
+        if self._raw:
+            # Frames are sent as is with their layout in headers
+            content_type = constants.HTTP_RAW_CONTENT_TYPE
+            self._pixel_format, self._color_conversion, _ = PIXEL_FORMATS[args.pixel_format]
         self._headers = {
             "Content-Type": content_type,
             "Accept": "application/json"
         }
+        if args.http_response_format == "protobuf":
+            # Serialized MediaSample, converted back for result processing
+            self._headers["Accept"] = "{}, application/json".format(
+                constants.HTTP_PROTOBUF_CONTENT_TYPE)
 
         self._index = 1
 
@@ -70,6 +85,8 @@ class HttpClient(Client):
             extension_config, constants.FRAME_DESTINATION)
         extensions = get_pipeline_config_value(
             extension_config, constants.EXTENSIONS)
+        frames_in_flight = get_pipeline_config_value(
+            extension_config, constants.FRAMES_IN_FLIGHT)
         if parameters:
             self._params = parameters
         if frame_destination:
@@ -80,6 +97,8 @@ class HttpClient(Client):
             for key in extensions:
                 new_key = "{}-{}".format(constants.EXTENSIONS, key)
                 self._params[new_key] = extensions[key]
+        if frames_in_flight:
+            self._params[constants.FRAMES_IN_FLIGHT] = frames_in_flight
 
         if self._params:
             if not stream_id:
@@ -90,22 +109,35 @@ class HttpClient(Client):
         self._url = "http://{}:{}/{}/{}".format(
             args.server_ip, args.http_port, pipeline_name, pipeline_version)
 
+    def _encode(self, image):
+        if self._raw:
+            self._headers[constants.HTTP_FRAME_WIDTH_HEADER] = str(image.shape[1])
+            self._headers[constants.HTTP_FRAME_HEIGHT_HEADER] = str(image.shape[0])
+            self._headers[constants.HTTP_PIXEL_FORMAT_HEADER] = self._pixel_format
+            if self._color_conversion is not None:
+                image = cv2.cvtColor(image, self._color_conversion)
+            return image.tobytes()
+        _, encoded_image = cv2.imencode(self._encoding, image)
+        return encoded_image.tostring()
+
     def put_frame(self, image):
         data = None
         result_json = None
-        encoded_image_size = 0
         if image is not None:
-            _, encoded_image = cv2.imencode(self._encoding, image)
-            encoded_image_size = encoded_image.size
-            data = encoded_image.tostring()
-        self._headers["Content-Length"] = str(encoded_image_size)
+            data = self._encode(image)
+        self._headers["Content-Length"] = str(len(data) if data else 0)
         response = requests.post(
             self._url, data=data, headers=self._headers, params=self._params)
 
         result_json = {"ackSequenceNumber": self._index}
         self._index += 1
 
-        if response.status_code == 200:
+        if response.status_code == 200 and response.headers.get("Content-Type", "").startswith(
+                constants.HTTP_PROTOBUF_CONTENT_TYPE):
+            result_json["mediaSample"] = MessageToDict(
+                extension_pb2.MediaSample.FromString(response.content),
+                including_default_value_fields=True)
+        elif response.status_code == 200:
             result_json["mediaSample"] = json.loads(response.text)
         elif response.status_code == 204 and data is None:
             result_json = None
@@ -124,3 +156,74 @@ class HttpClient(Client):
 
     def stop(self):
         pass
+
+
+class HttpStreamClient(HttpClient):
+    # Sends the frames of the stream as one chunked upload and reads results
+    # as JSON lines while frames are still being sent, so that several
+    # frames can be in flight
+    def __init__(self, args):
+        super().__init__(args)
+        if not args.http_url:
+            self._url = "{}/stream".format(self._url)
+        self._socket = None
+        self._reader = None
+
+    def _connect(self):
+        url = urllib.parse.urlsplit(self._url)
+        query = "&".join(filter(None, [url.query, urllib.parse.urlencode(self._params)]))
+        path = "{}?{}".format(url.path, query) if query else url.path
+        headers = dict(self._headers)
+        headers.pop("Content-Length", None)
+        headers["Host"] = url.netloc
+        headers["Accept"] = constants.HTTP_JSON_LINES_CONTENT_TYPE
+        headers["Transfer-Encoding"] = "chunked"
+        request = "POST {} HTTP/1.1\r\n".format(path)
+        request += "".join("{}: {}\r\n".format(key, value) for key, value in headers.items())
+        self._socket = socket.create_connection((url.hostname, url.port or 80))
+        self._socket.sendall("{}\r\n".format(request).encode())
+        self._reader = Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+    def put_frame(self, image):
+        if image is None:
+            if self._socket is None:
+                self._result_queue.put(None)
+            else:
+                # Last chunk ends the upload and with it the stream
+                self._socket.sendall(b"0\r\n\r\n")
+            return
+        data = self._encode(image)
+        if self._socket is None:
+            # Headers of raw frames are known once the first frame is encoded
+            self._connect()
+        frame = len(data).to_bytes(constants.HTTP_FRAME_LENGTH_BYTES, "big") + data
+        self._socket.sendall(b"%x\r\n" % len(frame) + frame + b"\r\n")
+
+    def _read_results(self):
+        with self._socket.makefile("rb") as response:
+            status = response.readline().split(maxsplit=2)
+            while response.readline().strip():
+                pass
+            if len(status) < 2 or status[1] != b"200":
+                error_text = " Response code: {}, Message: {}".format(
+                    b" ".join(status[1:]).decode().strip(), response.read().decode())
+                logging.error(error_text)
+                self._result_queue.put(Exception(error_text))
+                return
+            for line in response:
+                result = json.loads(line)
+                if result and "Error" in result:
+                    logging.error(result["Error"])
+                    self._result_queue.put(Exception(result["Error"]))
+                    return
+                result_json = {"ackSequenceNumber": self._index}
+                self._index += 1
+                if result:
+                    result_json["mediaSample"] = result
+                self._result_queue.put(result_json)
+        self._result_queue.put(None)
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
@@ -29,23 +29,28 @@
 '''
 import logging
 import os
-import time
 import threading
 import grpc
 from common.exception_handler import log_exception
-from common.shared_memory import SharedMemoryManager
+from common.shared_memory import SharedMemoryManager, SharedMemoryRing, SharedMemorySegments
+from common.memfd import create_memfd, share_memfd
+from common.util import parse_response_shared_memory_content_type
 from common.grpc_autogen import media_pb2
 from common.grpc_autogen import extension_pb2
 from common.grpc_autogen import extension_pb2_grpc
 
 class MediaStreamProcessor:
     class RequestGenerator:
-        def __init__(self, descriptor, shared_memory_manager, queue):
+        def __init__(self, descriptor, shared_memory_manager, queue, shared_memory_timeout=None):
             try:
                 self._request_seq_num = 1
                 self._descriptor = descriptor
                 self._shared_memory_manager = shared_memory_manager
+                self._shared_memory_timeout = shared_memory_timeout
                 self._queue = queue
+                # Last response read from response shared memory, acknowledged
+                # to the server in the next request
+                self.response_ack_sequence_number = 0
             except:
                 log_exception()
                 raise
@@ -68,14 +73,20 @@ class MediaStreamProcessor:
                 image = self._queue.get()
                 if image is None:
                     raise StopIteration
-                media_sample = extension_pb2.MediaSample(
-                    timestamp=0, content_bytes=media_pb2.ContentBytes(bytes=image)
-                )
-                if self._shared_memory_manager:
-                    media_sample = self.get_shared_memory_request(media_sample)
+                if isinstance(image, media_pb2.ContentReference):
+                    # Frame already written to its reserved shared memory slot
+                    media_sample = extension_pb2.MediaSample(
+                        timestamp=0, content_reference=image
+                    )
+                elif self._shared_memory_manager:
+                    media_sample = self.get_shared_memory_request(image)
+                else:
+                    media_sample = extension_pb2.MediaSample(
+                        timestamp=0, content_bytes=media_pb2.ContentBytes(bytes=image)
+                    )
                 request = extension_pb2.MediaStreamMessage(
                     sequence_number=self._request_seq_num,
-                    ack_sequence_number=0,
+                    ack_sequence_number=self.response_ack_sequence_number,
                     media_sample=media_sample,
                 )
 
@@ -84,8 +95,9 @@ class MediaStreamProcessor:
 
         def get_memory_slot(self, sequence_number, content_bytes):
             try:
-                memory_slot = self._shared_memory_manager.get_empty_slot(
-                    sequence_number, len(content_bytes)
+                # Blocks while shared memory is full until an acknowledgement frees a slot
+                memory_slot = self._shared_memory_manager.wait_for_empty_slot(
+                    sequence_number, len(content_bytes), self._shared_memory_timeout
                 )
                 if memory_slot is None:
                     return None
@@ -97,16 +109,11 @@ class MediaStreamProcessor:
                 raise
             return memory_slot
 
-        def get_shared_memory_request(self, media_sample):
-            memory_slot = self.get_memory_slot(
-                self._request_seq_num, media_sample.content_bytes.bytes
-            )
-            while memory_slot is None:
-                logging.info("***************** Shared Memory Full *****************")
-                time.sleep(1)
-                memory_slot = self.get_memory_slot(
-                    self._request_seq_num, media_sample.content_bytes.bytes
-                )
+        def get_shared_memory_request(self, image):
+            memory_slot = self.get_memory_slot(self._request_seq_num, image)
+            if memory_slot is None:
+                raise Exception("No shared memory slot available for {} bytes".format(
+                    len(image)))
 
             memory_slot_offset = memory_slot[0]
             memory_slot_length = (memory_slot[1] - memory_slot[0]) + 1
@@ -120,35 +127,76 @@ class MediaStreamProcessor:
             return media_sample
 
     def __init__(
-            self, grpc_server_address, use_shared_memory, frame_queue_size, frame_size
+            self, grpc_server_address, use_shared_memory, frame_queue_size, frame_size,
+            fixed_frame_size=False, shared_memory_timeout=None, shared_memory_segments=False,
+            memory_options=None, memfd_socket=None, coalesced_acks=False
     ):
         try:
             # Full address including port number i.e. "localhost:44001"
             self._grpc_server_address = grpc_server_address
             self._shared_memory_manager = None
+            self._shared_memory_timeout = shared_memory_timeout
+            self._memory_options = memory_options
+            # Acks from the server also cover earlier frames without results
+            self._coalesced_acks = coalesced_acks
+            self._last_ack_seq_no = 1
             if use_shared_memory:
                 shared_memory_size = (
                     frame_queue_size * frame_size
                     if frame_queue_size
                     else 100 * frame_size
                 )
-                self._shared_memory_manager = SharedMemoryManager(
-                    os.O_RDWR | os.O_SYNC | os.O_CREAT,
-                    name=None,
-                    size=shared_memory_size,
-                )
+                if shared_memory_segments:
+                    # Each frame in its own segment, at most one per queued frame
+                    self._shared_memory_manager = SharedMemorySegments(
+                        frame_queue_size if frame_queue_size else 100,
+                        memory_options=memory_options,
+                    )
+                else:
+                    name, fd = None, None
+                    if memfd_socket:
+                        # Server receives the memory itself rather than a name to open
+                        fd = create_memfd("edge-ai-extension-client")
+                        try:
+                            name = share_memfd(memfd_socket, fd)
+                        except:
+                            os.close(fd)
+                            raise
+                    if fixed_frame_size:
+                        # Frames of the descriptor's size fit one ring slot each
+                        self._shared_memory_manager = SharedMemoryRing(
+                            os.O_RDWR | os.O_SYNC | os.O_CREAT,
+                            name=name,
+                            size=shared_memory_size,
+                            slot_size=frame_size,
+                            memory_options=memory_options,
+                            fd=fd,
+                        )
+                    else:
+                        self._shared_memory_manager = SharedMemoryManager(
+                            os.O_RDWR | os.O_SYNC | os.O_CREAT,
+                            name=name,
+                            size=shared_memory_size,
+                            memory_options=memory_options,
+                            fd=fd,
+                        )
             self._grpc_channel = grpc.insecure_channel(self._grpc_server_address)
             self._grpc_stub = extension_pb2_grpc.MediaGraphExtensionStub(
                 self._grpc_channel
             )
             self._stop = False
             self._thread = None
+            # Sequence number of the next reserved frame, after the descriptor
+            self._reserved_seq_num = 2
+            # Declared by the server when large responses are sent through shared memory
+            self._response_shared_memory_manager = None
 
         except Exception:
             log_exception()
             raise
 
-    def get_media_stream_descriptor(self, width, height, extension_config):
+    def get_media_stream_descriptor(self, width, height, extension_config, pixel_format="BGR24",
+                                    encoding="RAW"):
         try:
             smbtp = None
             if self._shared_memory_manager:
@@ -166,9 +214,9 @@ class MediaStreamProcessor:
                 media_descriptor=media_pb2.MediaDescriptor(
                     timescale=90000,
                     video_frame_sample_format=media_pb2.VideoFrameSampleFormat(
-                        encoding=media_pb2.VideoFrameSampleFormat.Encoding.Value("RAW"),
+                        encoding=media_pb2.VideoFrameSampleFormat.Encoding.Value(encoding),
                         pixel_format=media_pb2.VideoFrameSampleFormat.PixelFormat.Value(
-                            "BGR24"
+                            pixel_format
                         ),
                         dimensions=media_pb2.Dimensions(
                             width=width,
@@ -184,10 +232,29 @@ class MediaStreamProcessor:
 
         return media_stream_descriptor
 
-    def start(self, width, height, frame_queue, result_queue, extension_config):
-        descriptor = self.get_media_stream_descriptor(width, height, extension_config)
+    # Reserves the shared memory slot of the next frame so that it can be
+    # written in place. Returns a writable view of the slot and the
+    # ContentReference to queue in place of the frame bytes. Frames of a
+    # stream are either all reserved or all queued as bytes
+    def reserve_frame(self, size):
+        memory_slot = self._shared_memory_manager.wait_for_empty_slot(
+            self._reserved_seq_num, size, self._shared_memory_timeout
+        )
+        if memory_slot is None:
+            raise Exception("No shared memory slot available for {} bytes".format(size))
+        self._reserved_seq_num += 1
+        view = self._shared_memory_manager.read_bytes(memory_slot[0], size)
+        content_reference = media_pb2.ContentReference(
+            address_offset=memory_slot[0], length_bytes=size
+        )
+        return view, content_reference
+
+    def start(self, width, height, frame_queue, result_queue, extension_config,
+              pixel_format="BGR24", encoding="RAW"):
+        descriptor = self.get_media_stream_descriptor(
+            width, height, extension_config, pixel_format, encoding)
         request_generator = self.RequestGenerator(
-            descriptor, self._shared_memory_manager, frame_queue
+            descriptor, self._shared_memory_manager, frame_queue, self._shared_memory_timeout
         )
         # Use "wait_for_ready" (still in grpc preview...)
         # to handle failure in case server not ready yet
@@ -197,23 +264,63 @@ class MediaStreamProcessor:
         response = next(sequence_iterator)
         ack_seq_no = response.ack_sequence_number
         logging.info("[Received] AckNum: {0}".format(ack_seq_no))
+        if response.media_stream_descriptor.HasField("shared_memory_buffer_transfer_properties"):
+            properties = response.media_stream_descriptor.shared_memory_buffer_transfer_properties
+            logging.info("Response shared memory: {}".format(properties.handle_name))
+            self._response_shared_memory_manager = SharedMemoryManager(
+                name=properties.handle_name, size=properties.length_bytes,
+                memory_options=self._memory_options
+            )
         self._thread = threading.Thread(
-            target=self.run, args=(sequence_iterator, result_queue)
+            target=self.run, args=(sequence_iterator, result_queue, request_generator)
         )
         self._thread.start()
 
+    # Replaces a reference to a media sample in response shared memory with
+    # the media sample. Returns True if the response was read from shared memory
+    def read_response_shared_memory(self, response):
+        inferences = response.media_sample.inferences
+        if not self._response_shared_memory_manager or len(inferences) != 1 or \
+                inferences[0].WhichOneof("value") != "other":
+            return False
+        reference = parse_response_shared_memory_content_type(inferences[0].other.content_type)
+        if not reference:
+            return False
+        offset, length = reference
+        view = self._response_shared_memory_manager.read_bytes(offset, length)
+        media_sample = extension_pb2.MediaSample()
+        media_sample.ParseFromString(bytes(view))
+        view.release()
+        response.media_sample.CopyFrom(media_sample)
+        return True
+
     def stop(self):
         self._stop = True
         if self._thread:
             self._thread.join()
+        if self._shared_memory_manager and self._shared_memory_manager.wait_count:
+            logging.info("Shared Memory Full Waits: {} Total Wait Time: {:.3f}s".format(
+                self._shared_memory_manager.wait_count, self._shared_memory_manager.wait_time))
+
+    # Frames between the last ack and this one completed without results
+    def _acknowledge_earlier_frames(self, ack_seq_no, result_queue):
+        for seq_no in range(self._last_ack_seq_no + 1, ack_seq_no):
+            result_queue.put(extension_pb2.MediaStreamMessage(ack_sequence_number=seq_no))
+            if self._shared_memory_manager:
+                self._shared_memory_manager.delete_slot(seq_no)
+        self._last_ack_seq_no = max(self._last_ack_seq_no, ack_seq_no)
 
-    def run(self, sequence_iterator, result_queue):
+    def run(self, sequence_iterator, result_queue, request_generator):
         try:
             for response in sequence_iterator:
                 if self._stop:
                     break
                 ack_seq_no = response.ack_sequence_number
                 logging.debug("[Received] AckNum: {0}".format(ack_seq_no))
+                if self.read_response_shared_memory(response):
+                    request_generator.response_ack_sequence_number = ack_seq_no
+                if self._coalesced_acks:
+                    self._acknowledge_earlier_frames(ack_seq_no, result_queue)
                 result_queue.put(response)
                 if self._shared_memory_manager:
                     self._shared_memory_manager.delete_slot(ack_seq_no)
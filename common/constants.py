@@ -15,4 +15,26 @@ PARAMETERS = "parameters"
 NAME = "name"
 VERSION = "version"
 PIPELINE = "pipeline"
-HTTP_SUPPORTED_CONTENT_TYPES = ("image/jpeg", "image/png", "image/bmp")
+HTTP_RAW_CONTENT_TYPE = "application/octet-stream"
+HTTP_SUPPORTED_CONTENT_TYPES = ("image/jpeg", "image/png", "image/bmp", HTTP_RAW_CONTENT_TYPE)
+# Layout of raw frames sent over HTTP, pixel format names are those of
+# VideoFrameSampleFormat.PixelFormat and stride defaults to packed rows
+HTTP_FRAME_WIDTH_HEADER = "X-Frame-Width"
+HTTP_FRAME_HEIGHT_HEADER = "X-Frame-Height"
+HTTP_PIXEL_FORMAT_HEADER = "X-Pixel-Format"
+HTTP_STRIDE_BYTES_HEADER = "X-Stride-Bytes"
+# Frames of batch and stream requests are each preceded by their length in
+# this many bytes, unsigned big endian
+HTTP_FRAME_LENGTH_BYTES = 4
+# Stream requests return one JSON document per line
+HTTP_JSON_LINES_CONTENT_TYPE = "application/x-ndjson"
+# Accepted response types besides JSON with default valued fields: the
+# serialized MediaSample and JSON without default valued fields
+HTTP_PROTOBUF_CONTENT_TYPE = "application/x-protobuf"
+HTTP_COMPACT_JSON_ACCEPT = "application/json; defaults=omit"
+FRAMES_IN_FLIGHT = "frames-in-flight"
+SHARE_MODEL_INSTANCES = "share-model-instances"
+RESPONSE_SHARED_MEMORY = "response-shared-memory"
+ACK_COALESCING_INTERVAL = "ack-coalescing-interval"
+# Content type of an InferenceOther referencing a MediaSample in response shared memory
+RESPONSE_SHARED_MEMORY_CONTENT_TYPE = "application/x-protobuf; message=MediaSample"
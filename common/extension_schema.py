@@ -28,6 +28,20 @@ extension_config = {
                     "additionalProperties": {
                         "type": "string"
                     }
+                },
+                "frames-in-flight":{
+                    "type":"integer",
+                    "minimum":1
+                },
+                "share-model-instances":{
+                    "type":"boolean"
+                },
+                "response-shared-memory":{
+                    "type":"boolean"
+                },
+                "ack-coalescing-interval":{
+                    "type":"integer",
+                    "minimum":0
                 }
             },
             "required":[
@@ -39,3 +53,34 @@ extension_config = {
     },
     "additionalProperties":False
 }
+
+pipeline_pool = {
+    "$schema":"https://json-schema.org/draft/2019-09/schema",
+    "type":"array",
+    "items":{
+        "type":"object",
+        "properties":{
+            "name":{
+                "type":"string"
+            },
+            "version":{
+                "type":"string"
+            },
+            "parameters":{
+                "type":"object"
+            },
+            "frame-destination":{
+                "type":"object"
+            },
+            "size":{
+                "type":"integer",
+                "minimum":1
+            }
+        },
+        "required":[
+            "name",
+            "version"
+        ],
+        "additionalProperties":False
+    }
+}
@@ -0,0 +1,145 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import os
+import time
+import uuid
+import array
+import fcntl
+import socket
+from threading import Lock, Thread
+
+from .logging import get_logger
+
+# Shared memory created with memfd_create has no name under /dev/shm. The
+# client hands the file descriptor to the server over a Unix socket and gets
+# back a token, which it sends as handle_name with this prefix in the
+# SharedMemoryBufferTransferProperties of the MediaStreamDescriptor
+MEMFD_PREFIX = "memfd:"
+TOKEN_LENGTH = 32
+
+# Not defined by fcntl before Python 3.9, Linux 5.1 and later
+F_SEAL_FUTURE_WRITE = getattr(fcntl, "F_SEAL_FUTURE_WRITE", 0x0010)
+
+
+def create_memfd(name):
+    return os.memfd_create(name, os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+
+
+def seal_memfd(fd):
+    # Called once the creator has mapped the memory writable. Later mappings,
+    # such as the server's, can only be read only and the size is fixed so
+    # readers never fault past the end
+    try:
+        fcntl.fcntl(fd, fcntl.F_ADD_SEALS, F_SEAL_FUTURE_WRITE)
+    except OSError:
+        get_logger("memfd").warning("Kernel does not support sealing memfd against writes")
+    fcntl.fcntl(fd, fcntl.F_ADD_SEALS,
+                fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW | fcntl.F_SEAL_SEAL)
+
+
+def share_memfd(socket_path, fd, timeout=10):
+    # Returns the handle name the server knows the memory by
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendmsg([b"memfd"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                         array.array("i", [fd]))])
+        token = connection.recv(TOKEN_LENGTH)
+    if len(token) != TOKEN_LENGTH:
+        raise Exception("Server at {} did not accept shared memory".format(socket_path))
+    return MEMFD_PREFIX + token.decode()
+
+
+def _receive_fds(connection):
+    fds = array.array("i")
+    _, ancillary_data, _, _ = connection.recvmsg(
+        16, socket.CMSG_SPACE(4 * fds.itemsize))
+    for level, message_type, data in ancillary_data:
+        if level == socket.SOL_SOCKET and message_type == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return list(fds)
+
+
+class MemfdListener:
+    # Receives memfd file descriptors from clients on the same host and
+    # holds them until the stream sending the matching token claims them
+
+    _logger = get_logger("MemfdListener")
+    _lock = Lock()
+    _fds = {}
+    _socket = None
+    _thread = None
+    # Unclaimed descriptors are closed after this many seconds
+    _claim_timeout = 60
+
+    @classmethod
+    def start(cls, socket_path):
+        if os.path.exists(socket_path):
+            # Left behind by a previous run
+            os.unlink(socket_path)
+        cls._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        cls._socket.bind(socket_path)
+        cls._socket.listen()
+        cls._thread = Thread(target=cls._serve, daemon=True)
+        cls._thread.start()
+        cls._logger.info("Accepting shared memory file descriptors on {}".format(socket_path))
+
+    @classmethod
+    def stop(cls):
+        if cls._socket:
+            cls._socket.close()
+            cls._socket = None
+        with cls._lock:
+            for fd, _ in cls._fds.values():
+                os.close(fd)
+            cls._fds.clear()
+
+    @classmethod
+    def running(cls):
+        return cls._socket is not None
+
+    @classmethod
+    def claim(cls, handle_name):
+        # Returns the file descriptor for the handle name, the caller closes it
+        token = handle_name[len(MEMFD_PREFIX):]
+        with cls._lock:
+            fd, _ = cls._fds.pop(token, (None, None))
+        return fd
+
+    @classmethod
+    def _serve(cls):
+        while True:
+            try:
+                connection, _ = cls._socket.accept()
+            except (OSError, AttributeError):
+                # Socket closed by stop
+                return
+            with connection:
+                try:
+                    connection.settimeout(10)
+                    fds = _receive_fds(connection)
+                    if len(fds) != 1:
+                        for fd in fds:
+                            os.close(fd)
+                        cls._logger.error("Expected one file descriptor, received {}".format(
+                            len(fds)))
+                        continue
+                    token = uuid.uuid4().hex
+                    cls._add(token, fds[0])
+                    connection.sendall(token.encode())
+                except OSError as error:
+                    cls._logger.error("Failed to receive shared memory: {}".format(error))
+
+    @classmethod
+    def _add(cls, token, fd):
+        now = time.time()
+        with cls._lock:
+            for expired in [key for key, (_, received) in cls._fds.items()
+                            if now - received > cls._claim_timeout]:
+                os.close(cls._fds.pop(expired)[0])
+                cls._logger.info("Closed unclaimed shared memory {}".format(expired))
+            cls._fds[token] = (fd, now)
@@ -22,18 +22,186 @@
 * SOFTWARE
 '''
 
-from threading import Lock
+from threading import Lock, Condition
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from abc import ABC, abstractmethod
 import tempfile
+import ctypes
 import mmap
 import os
+import time
 import logging
+import numpy
 from .exception_handler import log_exception
+from .memfd import seal_memfd
 
 # ***********************************************************************************
-# Shared memory management
+# Zero-copy view of a frame held in shared memory
+#
+# The view must be released before the frame is acknowledged,
+# as the acknowledgement allows the client to reuse the memory slot
+#
+class SharedMemoryFrame:
+    def __init__(self, view):
+        self.data = view
+
+    # Returns False while a consumer such as a pipeline buffer still exports
+    # the view, the frame must then not be acknowledged yet
+    def release(self):
+        try:
+            self.data.release()
+            return True
+        except BufferError:
+            return False
+
+
+# ***********************************************************************************
+# Free space of the shared memory file
+#
+# Free blocks are indexed by start and end offset so that a freed block is
+# coalesced with its neighbors in constant time, and kept in a list sorted by
+# (size, offset) so that the best fitting block is found with a binary search
+#
+class FreeBlocks:
+    def __init__(self, size):
+        self._by_start = {}     # start -> end    (half open interval)
+        self._by_end = {}       # end -> start
+        self._by_size = []      # sorted (size, start)
+        if size > 0:
+            self._insert(0, size)
+
+    def allocate(self, size):
+        index = bisect_left(self._by_size, (size, -1))
+        if index == len(self._by_size):
+            return None
+        block_size, start = self._by_size[index]
+        self._remove(start, start + block_size, index)
+        if block_size > size:
+            self._insert(start + size, start + block_size)
+        return start
+
+    def free(self, start, size):
+        end = start + size
+        # Coalesce with the free blocks on either side
+        if end in self._by_start:
+            next_end = self._by_start[end]
+            self._remove(end, next_end)
+            end = next_end
+        if start in self._by_end:
+            previous_start = self._by_end[start]
+            self._remove(previous_start, start)
+            start = previous_start
+        self._insert(start, end)
+
+    def blocks(self):
+        return sorted(self._by_start.items())
+
+    def _insert(self, start, end):
+        self._by_start[start] = end
+        self._by_end[end] = start
+        insort(self._by_size, (end - start, start))
+
+    def _remove(self, start, end, index=None):
+        del self._by_start[start]
+        del self._by_end[end]
+        if index is None:
+            index = bisect_left(self._by_size, (end - start, start))
+        del self._by_size[index]
+
+
+# ***********************************************************************************
+# Waiting for a free slot
+#
+# Allocators call _notify_slot_freed when a slot is freed
+#
+class SlotWaiter(ABC):
+    def __init__(self):
+        # Signalled when a slot is freed while an allocation is waiting
+        self._slot_freed = Condition(Lock())
+        self._waiters = 0
+        # Time spent waiting for slots (seconds) and number of waits
+        self.wait_time = 0
+        self.wait_count = 0
+
+    # Blocks until a slot is available, timeout in seconds (None waits forever)
+    # Returns None on timeout or if the size can never fit
+    # Returns closed interval [Begin, End] address with available slot
+    def wait_for_empty_slot(self, seq_no, size_needed, timeout=None):
+        address = self.get_empty_slot(seq_no, size_needed)
+        if address is not None or not self._can_fit(size_needed):
+            return address
+        start = time.monotonic()
+        with self._slot_freed:
+            # Waiter is registered before trying again, so a slot freed
+            # from here on is always signalled
+            self._waiters += 1
+            try:
+                while address is None:
+                    address = self.get_empty_slot(seq_no, size_needed)
+                    if address is None:
+                        remaining = None
+                        if timeout is not None:
+                            remaining = timeout - (time.monotonic() - start)
+                            if remaining <= 0:
+                                break
+                        self._slot_freed.wait(remaining)
+            finally:
+                self._waiters -= 1
+        self.wait_time += time.monotonic() - start
+        self.wait_count += 1
+        return address
+
+    def _notify_slot_freed(self):
+        if self._waiters:
+            with self._slot_freed:
+                self._slot_freed.notify_all()
+
+    @abstractmethod
+    def get_empty_slot(self, seq_no, size_needed):
+        pass
+
+    @abstractmethod
+    def _can_fit(self, size_needed):
+        pass
+
+
+# ***********************************************************************************
+# Memory options, applied to a region when it is mapped so that the first
+# frames do not pay for page faults
 #
-class SharedMemoryManager:
-    def __init__(self, shm_flags=None, name=None, size=None):
+# prefault: fault in every page (MAP_POPULATE where available)
+# huge-pages: ask for transparent huge pages, needs shmem_enabled set to advise
+# lock: pin the region in memory, needs a large enough memlock limit
+#
+PREFAULT = "prefault"
+HUGE_PAGES = "huge-pages"
+LOCK = "lock"
+MEMORY_OPTIONS = [PREFAULT, HUGE_PAGES, LOCK]
+
+
+def _lock_memory(shm):
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mlock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    # Address taken through numpy, as ctypes only maps writable buffers
+    # and sealed memfd regions are mapped read only
+    region = numpy.frombuffer(shm, dtype=numpy.uint8)
+    try:
+        if libc.mlock(region.ctypes.data, len(shm)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    finally:
+        del region
+
+
+# ***********************************************************************************
+# Shared memory file
+#
+# Maps the file and reads or writes it, slots are handed out by the allocators below
+#
+class SharedMemoryFile:
+    def __init__(self, shm_flags=None, name=None, size=None, memory_options=None, fd=None):
+        super().__init__()
         try:
             #nosec skips pybandit hits
             self.shm_file_path = '/dev/shm'     # nosec
@@ -48,33 +216,70 @@ class SharedMemoryManager:
             self._shm_file_full_path = os.path.join(self.shm_file_path,
                                                     self.shm_file_name)
             self._shm_flags = shm_flags
+            self._memfd = fd is not None
+            # Set once the lock memory option has pinned the region
+            self.locked = False
 
             # See the NOTE section here: https://docs.python.org/2/library/os.html#os.open
             # for details on shmFlags
 
-            # SharedMemoryManager handles the lifetime of resources such as _shm_file
+            # SharedMemoryFile handles the lifetime of resources such as _shm_file
             # pylint: disable=consider-using-with
-            if self._shm_flags is None:
+            memory_options = memory_options or []
+            map_flags = mmap.MAP_SHARED
+            # Huge pages must be requested before pages are faulted in
+            populate = getattr(mmap, "MAP_POPULATE", 0)
+            if PREFAULT in memory_options and HUGE_PAGES not in memory_options and populate:
+                map_flags |= populate
+            if self._memfd:
+                # Anonymous memory shared as a file descriptor, see common/memfd.py
+                self._shm_file = fd
+                self._shm_file_full_path = self.shm_file_name
+                if self._shm_flags is None:
+                    # Sealed by the creator, so a read only mapping is all that is needed
+                    self._shm = mmap.mmap(fd, self.shm_file_size, map_flags, mmap.PROT_READ)
+                else:
+                    os.ftruncate(fd, self.shm_file_size)
+                    self._shm = mmap.mmap(fd, self.shm_file_size, map_flags,
+                                          mmap.PROT_WRITE | mmap.PROT_READ)
+                    seal_memfd(fd)
+            elif self._shm_flags is None:
                 self._shm_file = open(self._shm_file_full_path, 'r+b')
-                self._shm = mmap.mmap(self._shm_file.fileno(), self.shm_file_size)
+                self._shm = mmap.mmap(self._shm_file.fileno(), self.shm_file_size, map_flags)
             else:
                 self._shm_file = os.open(self._shm_file_full_path, self._shm_flags)
                 os.ftruncate(self._shm_file, self.shm_file_size)
                 self._shm = mmap.mmap(self._shm_file,
                                       self.shm_file_size,
-                                      mmap.MAP_SHARED,
+                                      map_flags,
                                       mmap.PROT_WRITE | mmap.PROT_READ)
-
-            # Dictionary to host reserved mem blocks
-            # self._mem_slots[sequenceNo] = [Begin, End]        (closed interval)
-            self._mem_slots = dict()
-            self._create_delete_lock = Lock()
+            self._apply_memory_options(memory_options, map_flags & populate)
 
             logging.info('Shared memory name: {0}'.format(self._shm_file_full_path))
         except:
             log_exception()
             raise
 
+    def _apply_memory_options(self, memory_options, populated):
+        if HUGE_PAGES in memory_options:
+            try:
+                self._shm.madvise(mmap.MADV_HUGEPAGE)
+            except (AttributeError, OSError) as error:
+                logging.warning('Huge pages not available for {}: {}'.format(
+                    self._shm_file_full_path, error))
+        if PREFAULT in memory_options and not populated:
+            # Reading one byte per page faults in the whole region
+            view = memoryview(self._shm)
+            view[::mmap.PAGESIZE].tobytes()
+            view.release()
+        if LOCK in memory_options:
+            try:
+                _lock_memory(self._shm)
+                self.locked = True
+            except OSError as error:
+                logging.warning('Unable to lock {} in memory, check the memlock limit: {}'.format(
+                    self._shm_file_full_path, error))
+
     def read_bytes(self, memory_slot_offset, memory_slot_length):
         try:
             # This is Non-Zero Copy operation
@@ -89,6 +294,9 @@ class SharedMemoryManager:
             log_exception()
             raise
 
+    def read_frame(self, memory_slot_offset, memory_slot_length):
+        return SharedMemoryFrame(self.read_bytes(memory_slot_offset, memory_slot_length))
+
     def write_bytes(self, memory_slot_offset, bytes_to_write):
         try:
             #Zero-copy version
@@ -100,57 +308,245 @@ class SharedMemoryManager:
             log_exception()
             raise
 
+    def __del__(self):
+        try:
+            if self._memfd:
+                # Memory is freed once every process has closed it
+                os.close(self._shm_file)
+            elif self._shm_flags is None:
+                self._shm_file.close()
+            else:
+                os.close(self._shm_file)
+                os.remove(self._shm_file_full_path)
+        except:
+            log_exception()
+            raise
+
+
+# ***********************************************************************************
+# Shared memory management
+#
+class SharedMemoryManager(SharedMemoryFile, SlotWaiter):
+    def __init__(self, shm_flags=None, name=None, size=None, memory_options=None, fd=None):
+        super().__init__(shm_flags, name, size, memory_options, fd)
+        # Dictionary to host reserved mem blocks
+        # self._mem_slots[sequenceNo] = [Begin, End]        (closed interval)
+        self._mem_slots = dict()
+        self._create_delete_lock = Lock()
+        self._free_blocks = FreeBlocks(self.shm_file_size)
+
+    def _can_fit(self, size_needed):
+        return 0 < size_needed <= self.shm_file_size
+
     # Returns None if no availability
     # Returns closed interval [Begin, End] address with available slot
     def get_empty_slot(self, seq_no, size_needed):
-        address = None
-
         if size_needed < 1:
-            return address
+            return None
         with self._create_delete_lock:
-            # Empty memory
-            if len(self._mem_slots) < 1:
-                if self.shm_file_size >= size_needed:
-                    self._mem_slots[seq_no] = (0, size_needed - 1)
-                    address = (0, size_needed - 1)
-                else:
-                    address = None
-            else:
-                self._mem_slots = dict(sorted(self._mem_slots.items(), key=lambda item: item[1]))
-
-                # find an available memory gap = sizeNeeded
-                prev_slot_end = 0
-                for _, memory_slot in self._mem_slots.items():
-                    if (memory_slot[0] - prev_slot_end - 1) >= size_needed:
-                        address = (prev_slot_end + 1, prev_slot_end + size_needed)
-                        self._mem_slots[seq_no] = (address[0], address[1])
-                        break
-                    prev_slot_end = memory_slot[1]
-
-                # no gap in between, check last possible gap
-                if address is None:
-                    if (self.shm_file_size - prev_slot_end + 1) >= size_needed:
-                        address = (prev_slot_end, prev_slot_end + size_needed)
-                        self._mem_slots[seq_no] = (address[0], address[1])
-
+            # A sequence number owns a single slot
+            if seq_no in self._mem_slots:
+                self._free_slot(seq_no)
+            begin = self._free_blocks.allocate(size_needed)
+            if begin is None:
+                return None
             # interval [Begin, End]
+            address = (begin, begin + size_needed - 1)
+            self._mem_slots[seq_no] = address
             return address
 
     def delete_slot(self, seq_no):
         with self._create_delete_lock:
-            try:
-                del self._mem_slots[seq_no]
-                return True
-            except KeyError:
+            if seq_no not in self._mem_slots:
                 return False
+            self._free_slot(seq_no)
+        self._notify_slot_freed()
+        return True
 
-    def __del__(self):
-        try:
-            if self._shm_flags is None:
-                self._shm_file.close()
-            else:
-                os.close(self._shm_file)
-                os.remove(self._shm_file_full_path)
-        except:
-            log_exception()
-            raise
+    def _free_slot(self, seq_no):
+        begin, end = self._mem_slots.pop(seq_no)
+        self._free_blocks.free(begin, end - begin + 1)
+
+
+# ***********************************************************************************
+# Shared memory ring of fixed size slots
+#
+# For streams of same sized frames acknowledged in order. The request generator
+# thread only moves the head and the acknowledgement thread only moves the tail,
+# so slots are handed out and returned without a lock or any fragmentation
+#
+class SharedMemoryRing(SharedMemoryFile, SlotWaiter):
+    def __init__(self, shm_flags=None, name=None, size=None, slot_size=None,
+                 memory_options=None, fd=None):
+        if not slot_size or slot_size < 1:
+            raise ValueError("SharedMemoryRing needs a positive slot_size, got {}".format(
+                slot_size))
+        super().__init__(shm_flags, name, size, memory_options, fd)
+        if slot_size > self.shm_file_size:
+            raise ValueError("Slot size {} does not fit in shared memory of {} bytes".format(
+                slot_size, self.shm_file_size))
+        self.slot_size = slot_size
+        self._slot_count = self.shm_file_size // slot_size
+        self._slot_seq_nos = [None] * self._slot_count
+        self._head = 0
+        self._tail = 0
+
+    # Returns None if no availability
+    # Returns closed interval [Begin, End] address with available slot
+    def get_empty_slot(self, seq_no, size_needed):
+        if size_needed < 1 or size_needed > self.slot_size:
+            return None
+        if self._head - self._tail >= self._slot_count:
+            return None
+        index = self._head % self._slot_count
+        self._slot_seq_nos[index] = seq_no
+        self._head += 1
+        begin = index * self.slot_size
+        return (begin, begin + size_needed - 1)
+
+    def delete_slot(self, seq_no):
+        # An acknowledgement also returns the slots of earlier
+        # frames that were not acknowledged
+        released = False
+        while self._tail < self._head and \
+                self._slot_seq_nos[self._tail % self._slot_count] <= seq_no:
+            self._tail += 1
+            released = True
+        if released:
+            self._notify_slot_freed()
+        return released
+
+    def _can_fit(self, size_needed):
+        return 0 < size_needed <= self.slot_size
+
+
+# ***********************************************************************************
+# Shared memory segment per frame
+#
+# Each frame is written to its own shared memory file named <name>-<index>
+# and referenced by the virtual address index << SEGMENT_SHIFT, so a
+# ContentReference carries the segment along with the offset within it.
+# Segments are announced with the name and a length of 0 in the
+# SharedMemoryBufferTransferProperties
+#
+SEGMENT_SHIFT = 40
+SEGMENT_OFFSET_MASK = (1 << SEGMENT_SHIFT) - 1
+SEGMENT_ALIGNMENT = mmap.PAGESIZE
+
+
+def segment_name(name, index):
+    return "{}-{}".format(name, index)
+
+
+# Client side. Freed segments are reused by later frames that fit, so memory
+# follows the frames in flight instead of a worst case sized buffer. A new
+# segment replaces the smallest free one once max_segments exist
+class SharedMemorySegments(SlotWaiter):
+    def __init__(self, max_segments, name=None, memory_options=None):
+        super().__init__()
+        self.shm_file_name = name
+        if self.shm_file_name is None:
+            self.shm_file_name = next(tempfile._get_candidate_names())
+        self.shm_file_size = 0
+        self._max_segments = max_segments
+        self._segments = {}     # index -> SharedMemoryManager
+        self._free = []         # indices of segments not holding a frame
+        self._in_use = {}       # seq_no -> index
+        self._next_index = 0
+        self._memory_options = memory_options
+        self._lock = Lock()
+
+    # Returns None if no availability
+    # Returns closed interval [Begin, End] virtual address with available slot
+    def get_empty_slot(self, seq_no, size_needed):
+        if size_needed < 1:
+            return None
+        with self._lock:
+            # A sequence number owns a single segment
+            if seq_no in self._in_use:
+                self._free.append(self._in_use.pop(seq_no))
+            index = self._take_segment(size_needed)
+            if index is None:
+                return None
+            self._in_use[seq_no] = index
+            begin = index << SEGMENT_SHIFT
+            return (begin, begin + size_needed - 1)
+
+    def delete_slot(self, seq_no):
+        with self._lock:
+            if seq_no not in self._in_use:
+                return False
+            self._free.append(self._in_use.pop(seq_no))
+        self._notify_slot_freed()
+        return True
+
+    def read_bytes(self, memory_slot_offset, memory_slot_length):
+        segment = self._segments[memory_slot_offset >> SEGMENT_SHIFT]
+        return segment.read_bytes(memory_slot_offset & SEGMENT_OFFSET_MASK, memory_slot_length)
+
+    def write_bytes(self, memory_slot_offset, bytes_to_write):
+        segment = self._segments[memory_slot_offset >> SEGMENT_SHIFT]
+        segment.write_bytes(memory_slot_offset & SEGMENT_OFFSET_MASK, bytes_to_write)
+
+    def _can_fit(self, size_needed):
+        return size_needed > 0
+
+    def _take_segment(self, size_needed):
+        fits = [index for index in self._free
+                if self._segments[index].shm_file_size >= size_needed]
+        if fits:
+            index = min(fits, key=lambda index: self._segments[index].shm_file_size)
+            self._free.remove(index)
+            return index
+        if len(self._segments) >= self._max_segments:
+            if not self._free:
+                return None
+            # Segment names are never reused, so a reader cannot
+            # confuse a replaced segment with its replacement
+            smallest = min(self._free, key=lambda index: self._segments[index].shm_file_size)
+            self._free.remove(smallest)
+            del self._segments[smallest]
+        index = self._next_index
+        self._next_index += 1
+        size = -(-size_needed // SEGMENT_ALIGNMENT) * SEGMENT_ALIGNMENT
+        self._segments[index] = SharedMemoryManager(
+            os.O_RDWR | os.O_SYNC | os.O_CREAT,
+            name=segment_name(self.shm_file_name, index), size=size,
+            memory_options=self._memory_options)
+        return index
+
+
+# Server side. Segments are mapped on first use and the most recently
+# used ones are kept mapped for later frames. The client unlinks a segment
+# before creating the one replacing it, so unlinked segments are unmapped
+# whenever a new segment is mapped
+class SharedMemorySegmentCache:
+    def __init__(self, name, capacity=64, memory_options=None):
+        self.shm_file_name = name
+        self._capacity = capacity
+        self._memory_options = memory_options
+        self._segments = OrderedDict()
+
+    def read_frame(self, memory_slot_offset, memory_slot_length):
+        index = memory_slot_offset >> SEGMENT_SHIFT
+        segment = self._segments.pop(index, None)
+        if segment is None:
+            self._evict_unlinked()
+            # Size 0 maps the whole segment
+            segment = SharedMemoryManager(name=segment_name(self.shm_file_name, index), size=0,
+                                          memory_options=self._memory_options)
+            if len(self._segments) >= self._capacity:
+                self._segments.popitem(last=False)
+        self._segments[index] = segment
+        return segment.read_frame(memory_slot_offset & SEGMENT_OFFSET_MASK, memory_slot_length)
+
+    def clear(self):
+        # Frames still referencing a segment keep its memory mapped
+        self._segments.clear()
+
+    def _evict_unlinked(self):
+        unlinked = [index for index, segment in self._segments.items()
+                    if not os.path.exists(os.path.join(segment.shm_file_path,
+                                                       segment.shm_file_name))]
+        for index in unlinked:
+            del self._segments[index]
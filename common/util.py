@@ -23,8 +23,31 @@ def validate_extension_config(extension_config):
             extension_config, err.message)) from err
 
 
+def validate_pipeline_pool_config(pipeline_pool_config):
+    try:
+        validator = jsonschema.Draft4Validator(schema=extension_schema.pipeline_pool,
+                                               format_checker=jsonschema.draft4_format_checker)
+        validator.validate(pipeline_pool_config)
+    except jsonschema.exceptions.ValidationError as err:
+        raise Exception("Error validating pipeline pool: {},: error: {}".format(
+            pipeline_pool_config, err.message)) from err
+
+
 def get_typed_value(value):
     try:
         return json.loads(value)
     except ValueError:
         return value
+
+
+def get_response_shared_memory_content_type(offset, length):
+    return "{}; offset={}; length={}".format(
+        constants.RESPONSE_SHARED_MEMORY_CONTENT_TYPE, offset, length)
+
+
+# Returns (offset, length) of a response held in shared memory, None otherwise
+def parse_response_shared_memory_content_type(content_type):
+    if not content_type.startswith(constants.RESPONSE_SHARED_MEMORY_CONTENT_TYPE):
+        return None
+    params = dict(param.strip().split("=", 1) for param in content_type.split(";")[1:])
+    return int(params["offset"]), int(params["length"])
@@ -33,8 +33,12 @@ import os
 import sys
 from vaserving.vaserving import VAServing
 from grpc_server import GrpcServer
+from grpc_async_server import AsyncGrpcServer
 from http_server import HttpServer
+from pipeline_pool import PipelinePool
 from common import logging, constants
+from common.shared_memory import MEMORY_OPTIONS
+from common.memfd import MemfdListener
 from common.exception_handler import log_exception
 
 
@@ -66,6 +70,21 @@ def parse_args(args=None, program_name=PROGRAM_NAME):
         default=int(os.getenv("GRPC_PORT", constants.GRPC_PORT)),
     )
 
+    parser.add_argument(
+        "--grpc-unix-socket",
+        action="store",
+        help="Unix socket path to also serve gRPC on for clients on the same host",
+        type=str,
+        default=os.getenv("GRPC_UNIX_SOCKET", ""),
+    )
+
+    parser.add_argument(
+        "--grpc-async",
+        action="store_true",
+        help="Serve all gRPC streams as coroutines on a single event loop",
+        default=os.getenv("GRPC_ASYNC", "false").lower() == "true",
+    )
+
     parser.add_argument(
         "--http-port",
         action="store",
@@ -80,6 +99,64 @@ def parse_args(args=None, program_name=PROGRAM_NAME):
         type=int,
         default=int(os.getenv("MAX_RUNNING_PIPELINES", "10")),
     )
+
+    parser.add_argument(
+        "--max-frames-in-flight",
+        action="store",
+        help="Upper limit on frames in flight per stream",
+        type=int,
+        default=int(os.getenv("MAX_FRAMES_IN_FLIGHT", "8")),
+    )
+
+    parser.add_argument(
+        "--response-shared-memory-size",
+        action="store",
+        help="Size in MB of shared memory for large responses to streams requesting it (0 disables)",
+        type=int,
+        default=int(os.getenv("RESPONSE_SHARED_MEMORY_SIZE", "64")),
+    )
+
+    parser.add_argument(
+        "--response-shared-memory-threshold",
+        action="store",
+        help="Responses of at least this many bytes are sent through response shared memory",
+        type=int,
+        default=int(os.getenv("RESPONSE_SHARED_MEMORY_THRESHOLD", "65536")),
+    )
+
+    parser.add_argument(
+        "--shared-memory-options",
+        action="store",
+        help="Options applied when mapping shared memory, see common/shared_memory.py",
+        nargs="*",
+        choices=MEMORY_OPTIONS,
+        default=os.getenv("SHARED_MEMORY_OPTIONS", "").split(),
+    )
+
+    parser.add_argument(
+        "--memfd-socket",
+        action="store",
+        help="Unix socket path on which clients pass memfd shared memory (empty disables)",
+        type=str,
+        default=os.getenv("MEMFD_SOCKET", ""),
+    )
+
+    parser.add_argument(
+        "--pipeline-pool",
+        action="store",
+        help="JSON string or .json file listing pipelines to keep pre-started",
+        type=str,
+        default=os.getenv("PIPELINE_POOL", ""),
+    )
+
+    parser.add_argument(
+        "--pipeline-pool-idle-timeout",
+        action="store",
+        help="Seconds before an idle pooled pipeline is stopped (0 keeps them)",
+        type=int,
+        default=int(os.getenv("PIPELINE_POOL_IDLE_TIMEOUT", "0")),
+    )
+
     parser.add_argument(
         "--log-level",
         action="store",
@@ -116,7 +193,15 @@ if __name__ == "__main__":
             logger.error("Exception encountered during VAServing start")
             raise
 
-        if args.protocol == constants.GRPC_PROTOCOL:
+        PipelinePool.start(PipelinePool.load_config(args.pipeline_pool),
+                           args.pipeline_pool_idle_timeout)
+
+        if args.memfd_socket:
+            MemfdListener.start(args.memfd_socket)
+
+        if args.protocol == constants.GRPC_PROTOCOL and args.grpc_async:
+            server = AsyncGrpcServer(args)
+        elif args.protocol == constants.GRPC_PROTOCOL:
             server = GrpcServer(args)
         else:
             server = HttpServer(args)
@@ -128,4 +213,6 @@ if __name__ == "__main__":
     finally:
         if server:
             server.stop()
+        PipelinePool.stop()
+        MemfdListener.stop()
         VAServing.stop()
@@ -0,0 +1,58 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import time
+
+
+class AckCoalescer:
+    # Holds back responses without inferences and sends only the latest of
+    # them once flush_interval seconds have passed since the first one held.
+    # Samples leave the pipeline in order, so its ack_sequence_number is the
+    # highest contiguous frame completed and acknowledges every frame before
+    # it. Responses with inferences are sent right away and likewise
+    # acknowledge the frames held before them.
+    # Clients sending frames over shared memory only reuse a slot once its
+    # frame is acknowledged, so holding acks can leave them waiting for
+    # memory with nothing left in the pipeline. The held response is then
+    # sent right away, add is told so with idle
+
+    def __init__(self, flush_interval):
+        self._flush_interval = flush_interval
+        self._held = None
+        self._flush_time = None
+        self.responses = 0
+        self.messages = 0
+
+    def add(self, responses, idle=False):
+        # Returns the messages to send now
+        messages = []
+        for response in responses:
+            self.responses += 1
+            if response.media_sample.inferences:
+                self._held = None
+                messages.append(response)
+            else:
+                if self._held is None:
+                    self._flush_time = time.monotonic() + self._flush_interval
+                self._held = response
+        if self._held is not None and (idle or time.monotonic() >= self._flush_time):
+            messages.append(self._held)
+            self._held = None
+        self.messages += len(messages)
+        return messages
+
+    def flush(self):
+        if self._held is None:
+            return []
+        held, self._held = self._held, None
+        self.messages += 1
+        return [held]
+
+    def timeout(self, default):
+        # Seconds to wait for responses before the held one is due
+        if self._held is None:
+            return default
+        return max(0, self._flush_time - time.monotonic())
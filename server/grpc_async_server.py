@@ -0,0 +1,215 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: MIT License
+*
+*****
+*
+* MIT License
+*
+* Copyright (c) Microsoft Corporation.
+*
+* Permission is hereby granted, free of charge, to any person obtaining a copy
+* of this software and associated documentation files (the "Software"), to deal
+* in the Software without restriction, including without limitation the rights
+* to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+* copies of the Software, and to permit persons to whom the Software is
+* furnished to do so, subject to the following conditions:
+*
+* The above copyright notice and this permission notice shall be included in all
+* copies or substantial portions of the Software.
+*
+* THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+* IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+* FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+* AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+* LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+* OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+* SOFTWARE
+'''
+
+import asyncio
+import grpc
+
+from protocol_server import Server
+from grpc_server import MediaStreamHelper
+from pipeline_processor import PipelineProcessor
+from common.logging import get_logger
+from common.grpc_autogen import extension_pb2_grpc
+from common.exception_handler import log_exception
+
+
+class OutputQueueBridge: # pylint: disable=too-few-public-methods
+    # Receives pipeline output on GStreamer threads and hands it to
+    # an asyncio queue on the server event loop
+    def __init__(self, loop):
+        self._loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item, block=True, timeout=None): # pylint: disable=unused-argument
+        self._loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class AsyncGrpcServer(Server):
+    # Runs every stream as a coroutine on a single event loop so idle
+    # streams do not hold OS threads and are not limited by a thread pool.
+    # The generated servicer only declares a synchronous ProcessMediaStream,
+    # the aio server just needs the coroutine of that name
+
+    def __init__(self, args):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = grpc.aio.server()
+        extension_pb2_grpc.add_MediaGraphExtensionServicer_to_server(
+            self,
+            self._server,
+        )
+        self._logger = get_logger("gRPC Server")
+        self._port = args.grpc_port
+        self._stream_helper = MediaStreamHelper(args, self._logger)
+        self._stopped = True
+
+    def start(self):
+        self._stopped = False
+        self._logger.info(
+            "Starting asynchronous GRPC DL Streamer Edge AI Extension on port: %d", self._port)
+        self._stream_helper.add_ports(self._server)
+        self._loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        await self._server.start()
+        await self._server.wait_for_termination()
+
+    def stop(self):
+        self._stopped = True
+        if not self._loop.is_running():
+            self._loop.run_until_complete(self._server.stop(None))
+
+    # gRPC stubbed function
+    # client/gRPC will call this function to send frames/descriptions
+
+    # Context is not checked as in GrpcServer, streams of clients
+    # that went away are cancelled instead
+    async def ProcessMediaStream( # pylint: disable=invalid-name,unused-argument
+            self, request_iterator, context):
+        # First message from the client is (must be) MediaStreamDescriptor
+        request = await self._first_request(request_iterator)
+        if request is None:
+            return
+        client_state, extension_configuration, media_stream_message = \
+            self._stream_helper.start_stream(request)
+
+        yield media_stream_message
+
+        loop = asyncio.get_event_loop()
+        output = OutputQueueBridge(loop)
+        try:
+            # Pipeline construction blocks so keep it off the event loop
+            pipeline_processor = await loop.run_in_executor(
+                None, PipelineProcessor,
+                extension_configuration, self._stream_helper.max_frames_in_flight, output)
+        except:
+            log_exception(self._logger)
+            raise
+
+        # Mirrors the pipeline processor credits so waiting for one
+        # suspends the coroutine instead of blocking the event loop
+        frame_credits = asyncio.Semaphore(pipeline_processor.frames_in_flight())
+        incoming_request_task = asyncio.ensure_future(self._process_input_request(
+            request_iterator, pipeline_processor, client_state, frame_credits))
+
+        # A client disconnect cancels this coroutine, make sure
+        # the input task does not outlive it
+        ack_coalescer = self._stream_helper.create_ack_coalescer(extension_configuration)
+        try:
+            async for media_stream_message in self._process_responses(
+                    pipeline_processor, client_state, ack_coalescer, output, frame_credits):
+                yield media_stream_message
+
+            # Waiting for the pipeline to let go of frames blocks
+            for media_stream_message in await loop.run_in_executor(
+                    None, self._stream_helper.remaining_messages, client_state, ack_coalescer):
+                yield client_state.offload_response(media_stream_message)
+
+            self._stream_helper.check_pipeline(pipeline_processor)
+            await loop.run_in_executor(None, pipeline_processor.wait_for_completion)
+            await incoming_request_task
+        finally:
+            if not incoming_request_task.done():
+                incoming_request_task.cancel()
+            client_state.close()
+
+        self._logger.debug("MediaStreamDescriptor:\n{0}".format(
+            client_state.media_stream_descriptor))
+
+    @staticmethod
+    async def _first_request(request_iterator):
+        async for request in request_iterator:
+            return request
+        return None
+
+    async def _process_responses(self, pipeline_processor, client_state, ack_coalescer, output,
+                                 frame_credits):
+        while not self._stopped and not pipeline_processor.aborted_or_error():
+            messages = []
+            try:
+                sample = await asyncio.wait_for(
+                    output.queue.get(),
+                    timeout=self._stream_helper.response_timeout(client_state, ack_coalescer))
+                media_stream_message = pipeline_processor.generate_response(sample)
+                if not media_stream_message:
+                    break
+                frame_credits.release()
+                messages.append(media_stream_message)
+            except asyncio.TimeoutError:
+                self._logger.debug("Timeout occured on getting responses")
+                if pipeline_processor.stopped():
+                    break
+            for media_stream_message in self._stream_helper.ready_messages(
+                    client_state, pipeline_processor, ack_coalescer, messages):
+                self._logger.debug("[Sent] AckSeqNum: {0:07d}".format(
+                    media_stream_message.ack_sequence_number)
+                )
+                yield client_state.offload_response(media_stream_message)
+
+    async def _process_input_request(self, request_iterator, pipeline_processor, client_state,
+                                     frame_credits):
+        async for request in request_iterator:
+            # Read request id, sent by client
+            request_seq_num = request.sequence_number
+            self._logger.debug(
+                "[Received] SeqNum: {0:07d}".format(request_seq_num))
+            client_state.release_responses(request.ack_sequence_number)
+            input_sample = self._stream_helper.generate_gva_sample(client_state, request)
+            if input_sample and not await self._acquire_credit(frame_credits, pipeline_processor):
+                break
+            # A credit is free on the pipeline processor as well, so this does not block
+            pipeline_processor.submit_frame(input_sample)
+            if self._stopped or pipeline_processor.stopped():
+                break
+
+        if not pipeline_processor.stopped() and \
+                await self._wait_for_frames_in_flight(frame_credits, pipeline_processor):
+            # Push a None object into the input queue to mark end of stream
+            pipeline_processor.submit_frame(None)
+        else:
+            pipeline_processor.set_as_error()
+
+    async def _wait_for_frames_in_flight(self, frame_credits, pipeline_processor):
+        # Waits for every credit so ending the stream does not block the loop
+        for _ in range(pipeline_processor.frames_in_flight()):
+            if not await self._acquire_credit(frame_credits, pipeline_processor):
+                return False
+        return True
+
+    @staticmethod
+    async def _acquire_credit(frame_credits, pipeline_processor, timeout=1):
+        # As PipelineProcessor._acquire_credit, bails out if the pipeline
+        # stops while waiting as no more samples will be returned
+        while True:
+            try:
+                await asyncio.wait_for(frame_credits.acquire(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                if pipeline_processor.stopped():
+                    return False
@@ -29,36 +29,50 @@
 '''
 
 
+import os
 import json
-from threading import Thread
+import time
+from collections import deque
+from threading import Thread, Lock
 from enum import Enum
 from concurrent import futures
 from queue import Empty
 import grpc
 
-from vaserving.gstreamer_app_source import GvaFrameData
-
 from protocol_server import Server
 from pipeline_processor import PipelineProcessor
+from sample_factory import SampleFactory
+from ack_coalescer import AckCoalescer
+from common import constants
 from common.logging import get_logger
+from common.util import get_response_shared_memory_content_type
 from common.grpc_autogen import media_pb2
+from common.grpc_autogen import inferencing_pb2
 from common.grpc_autogen import extension_pb2
 from common.grpc_autogen import extension_pb2_grpc
-from common.shared_memory import SharedMemoryManager
+from common.shared_memory import SharedMemoryManager, SharedMemorySegmentCache
+from common.memfd import MemfdListener, MEMFD_PREFIX
 from common.exception_handler import log_exception
 
 
+# Seconds between checks for shared memory frames the pipeline still references
+FRAME_RELEASE_INTERVAL = 0.01
+# Seconds frames are waited for at end of stream
+FRAME_RELEASE_TIMEOUT = 1
+
+
 class TransferType(Enum):
     BYTES = 1  # Embedded Content
     REFERENCE = 2  # Shared Memory
-    HANDLE = 3  # Reserved
+    HANDLE = 3  # Shared Memory segment per frame
 
 
 class State: # pylint: disable=too-few-public-methods
-    def __init__(self, media_stream_descriptor):
+    def __init__(self, media_stream_descriptor, memory_options=None):
         try:
             # media descriptor holding input data format
             self.media_stream_descriptor = media_stream_descriptor
+            self._memory_options = memory_options
 
             # Get how data will be transferred
             if (
@@ -67,29 +81,328 @@ class State: # pylint: disable=too-few-public-methods
                     is None
             ):
                 self.content_transfer_type = TransferType.BYTES
-            elif self.media_stream_descriptor.HasField(
-                    "shared_memory_buffer_transfer_properties"
-            ):
+            elif self.media_stream_descriptor.shared_memory_buffer_transfer_properties.length_bytes:
                 self.content_transfer_type = TransferType.REFERENCE
-            elif self.media_stream_descriptor.HasField(
-                    "shared_memory_segments_transfer_properties"
-            ):
+            else:
+                # The contract has no segments transfer properties, a buffer
+                # without length names the segments instead
                 self.content_transfer_type = TransferType.HANDLE
 
             # Setup if shared mem used
             if self.content_transfer_type == TransferType.REFERENCE:
+                handle_name = \
+                    self.media_stream_descriptor.shared_memory_buffer_transfer_properties.handle_name
+                fd = None
+                if handle_name.startswith(MEMFD_PREFIX):
+                    # Memory passed by file descriptor over the memfd socket
+                    fd = MemfdListener.claim(handle_name)
+                    if fd is None:
+                        raise Exception("No shared memory received for {}".format(handle_name))
                 # Create shared memory accessor specific to the client
                 self.shared_memory_manager = SharedMemoryManager(
-                    name=self.media_stream_descriptor.shared_memory_buffer_transfer_properties.handle_name,
+                    name=handle_name,
                     size=self.media_stream_descriptor.shared_memory_buffer_transfer_properties.length_bytes,
+                    memory_options=memory_options,
+                    fd=fd,
+                )
+            elif self.content_transfer_type == TransferType.HANDLE:
+                # Segments are mapped as frames reference them
+                self.shared_memory_manager = SharedMemorySegmentCache(
+                    name=self.media_stream_descriptor.shared_memory_buffer_transfer_properties.handle_name,
+                    memory_options=memory_options,
                 )
             else:
                 self.shared_memory_manager = None
 
+            # Caps and layout of incoming samples, resolved once per stream
+            self.sample_factory = SampleFactory(
+                self.media_stream_descriptor.media_descriptor.video_frame_sample_format)
+
+            # Shared memory frames handed to the pipeline, by sequence number
+            self._frames_in_use = {}
+            # Responses waiting for the pipeline to let go of their frames
+            self._held_responses = deque()
+
+            # Optional shared memory for large responses, see create_response_shared_memory
+            self.response_shared_memory_manager = None
+            self._response_threshold = 0
+            self._responses_in_shared_memory = deque()
+            self._response_lock = Lock()
+
         except:
             log_exception(get_logger("State"))
             raise
 
+    def hold_frame(self, sequence_number, frame):
+        self._frames_in_use[sequence_number] = frame
+
+    # Returns False while the pipeline still references the frame, it is then
+    # kept held and must not be acknowledged
+    def release_frame(self, sequence_number):
+        frame = self._frames_in_use.pop(sequence_number, None)
+        if frame and not frame.release():
+            self._frames_in_use[sequence_number] = frame
+            return False
+        return True
+
+    # Returns the responses whose frames are released, in order. A frame the
+    # pipeline still references holds back its response and the ones after it,
+    # as acknowledging a later frame lets the client reuse earlier slots too
+    def released_responses(self, media_stream_messages=()):
+        self._held_responses.extend(media_stream_messages)
+        released = []
+        while self._held_responses and \
+                self.release_frame(self._held_responses[0].ack_sequence_number):
+            released.append(self._held_responses.popleft())
+        return released
+
+    def responses_held(self):
+        return bool(self._held_responses)
+
+    # At end of stream frames are waited for up to FRAME_RELEASE_TIMEOUT, after
+    # that the remaining responses are returned anyway as the client sends no
+    # more frames. Frames still in use are logged when the stream is closed
+    def release_held_responses(self):
+        deadline = time.monotonic() + FRAME_RELEASE_TIMEOUT
+        released = self.released_responses()
+        while self._held_responses and time.monotonic() < deadline:
+            time.sleep(FRAME_RELEASE_INTERVAL)
+            released.extend(self.released_responses())
+        released.extend(self._held_responses)
+        self._held_responses.clear()
+        return released
+
+    def release_all_frames(self):
+        for sequence_number in list(self._frames_in_use):
+            if not self.release_frame(sequence_number):
+                get_logger("State").warning(
+                    "Frame {} still in use at end of stream".format(sequence_number))
+
+    def close(self):
+        # Unmaps the client's segments once its frames are released
+        self.release_all_frames()
+        if isinstance(self.shared_memory_manager, SharedMemorySegmentCache):
+            self.shared_memory_manager.clear()
+
+    def create_response_shared_memory(self, size, threshold):
+        self.response_shared_memory_manager = SharedMemoryManager(
+            os.O_RDWR | os.O_CREAT, size=size, memory_options=self._memory_options)
+        self._response_threshold = threshold
+
+    # Responses with a media sample of at least threshold bytes are written to the
+    # response shared memory and replaced by a reference. The client acknowledges
+    # them in the ack_sequence_number of its requests.
+    # Responses are sent inline when the shared memory is full
+    def offload_response(self, media_stream_message):
+        sequence_number = media_stream_message.ack_sequence_number
+        if not self.response_shared_memory_manager or not sequence_number:
+            return media_stream_message
+        media_sample = media_stream_message.media_sample
+        length = media_sample.ByteSize()
+        if length < self._response_threshold:
+            return media_stream_message
+        memory_slot = self.response_shared_memory_manager.get_empty_slot(sequence_number, length)
+        if memory_slot is None:
+            return media_stream_message
+        self.response_shared_memory_manager.write_bytes(
+            memory_slot[0], media_sample.SerializeToString())
+        with self._response_lock:
+            self._responses_in_shared_memory.append(sequence_number)
+        response = extension_pb2.MediaStreamMessage(
+            sequence_number=media_stream_message.sequence_number,
+            ack_sequence_number=sequence_number,
+        )
+        response.media_sample.timestamp = media_sample.timestamp
+        inference = response.media_sample.inferences.add()
+        # pylint: disable=no-member
+        inference.type = inferencing_pb2.Inference.InferenceType.OTHER
+        inference.other.content_type = get_response_shared_memory_content_type(
+            memory_slot[0], length)
+        return response
+
+    def release_responses(self, ack_sequence_number):
+        if not self.response_shared_memory_manager or not ack_sequence_number:
+            return
+        with self._response_lock:
+            while self._responses_in_shared_memory and \
+                    self._responses_in_shared_memory[0] <= ack_sequence_number:
+                self.response_shared_memory_manager.delete_slot(
+                    self._responses_in_shared_memory.popleft())
+
+
+class MediaStreamHelper:
+    # Server settings and the steps of a media stream shared by
+    # GrpcServer and AsyncGrpcServer
+    def __init__(self, args, logger):
+        self._logger = logger
+        self._port = args.grpc_port
+        self._unix_socket = args.grpc_unix_socket
+        self.max_frames_in_flight = args.max_frames_in_flight
+        self._response_shared_memory_size = args.response_shared_memory_size * 1024 * 1024
+        self._response_shared_memory_threshold = args.response_shared_memory_threshold
+        self._shared_memory_options = args.shared_memory_options
+
+    def add_ports(self, server):
+        server.add_insecure_port(f"[::]:{self._port}")
+        if self._unix_socket:
+            # Clients on the same host can skip TCP loopback
+            address = self._unix_socket
+            if not address.startswith("unix:"):
+                address = "unix:{}".format(address)
+            server.add_insecure_port(address)
+            self._logger.info("Serving gRPC on {}".format(address))
+
+    # First message from the client is (must be) MediaStreamDescriptor
+    # Returns the client state, extension configuration and first response
+    def start_stream(self, request):
+        # Extract message IDs
+        request_seq_num = request.sequence_number
+        request_ack_seq_num = request.ack_sequence_number
+        # State object per client
+        client_state = State(request.media_stream_descriptor, self._shared_memory_options)
+        self._logger.info(
+            "[Received] SeqNum: {0:07d} | "
+            "AckNum: {1}\nMediaStreamDescriptor:\n{2}".format(
+                request_seq_num,
+                request_ack_seq_num,
+                client_state.media_stream_descriptor,
+            )
+        )
+        extension_configuration = self._get_extension_configuration(request)
+
+        # First message response ...
+        media_stream_message = self._create_descriptor_response(
+            request_seq_num, client_state, extension_configuration)
+        return client_state, extension_configuration, media_stream_message
+
+    def _get_extension_configuration(self, request):
+        extension_configuration = None
+        if request.media_stream_descriptor.extension_configuration:
+            # Load the extension_config
+            try:
+                extension_configuration = json.loads(
+                    request.media_stream_descriptor.extension_configuration)
+            except ValueError:
+                self._logger.error("Decoding extension_configuration field has failed: {}".format(
+                    request.media_stream_descriptor.extension_configuration))
+                raise
+        return extension_configuration
+
+    def _create_descriptor_response(self, request_seq_num, client_state, extension_configuration):
+        media_stream_descriptor = extension_pb2.MediaStreamDescriptor(
+            media_descriptor=media_pb2.MediaDescriptor(
+                timescale=client_state.media_stream_descriptor.media_descriptor.timescale
+            )
+        )
+        pipeline_config = (extension_configuration or {}).get(constants.PIPELINE, {})
+        if pipeline_config.get(constants.RESPONSE_SHARED_MEMORY) and \
+                self._response_shared_memory_size:
+            # Declare the shared memory large responses are written to
+            client_state.create_response_shared_memory(
+                self._response_shared_memory_size, self._response_shared_memory_threshold)
+            media_stream_descriptor.shared_memory_buffer_transfer_properties.CopyFrom(
+                extension_pb2.SharedMemoryBufferTransferProperties(
+                    handle_name=client_state.response_shared_memory_manager.shm_file_name,
+                    length_bytes=client_state.response_shared_memory_manager.shm_file_size,
+                )
+            )
+        return extension_pb2.MediaStreamMessage(
+            sequence_number=1,
+            ack_sequence_number=request_seq_num,
+            media_stream_descriptor=media_stream_descriptor,
+        )
+
+    def create_ack_coalescer(self, extension_configuration):
+        pipeline_config = (extension_configuration or {}).get(constants.PIPELINE, {})
+        interval = pipeline_config.get(constants.ACK_COALESCING_INTERVAL, 0)
+        if not interval:
+            return None
+        self._logger.info("Ack Coalescing Interval : {} ms".format(interval))
+        return AckCoalescer(interval / 1000)
+
+    @staticmethod
+    def response_timeout(client_state, ack_coalescer):
+        if client_state.responses_held():
+            # Check again soon for frames the pipeline still references
+            return FRAME_RELEASE_INTERVAL
+        return ack_coalescer.timeout(40) if ack_coalescer else 40
+
+    # Returns the messages to send for responses that left the pipeline
+    def ready_messages(self, client_state, pipeline_processor, ack_coalescer, messages):
+        # Acknowledging lets the client reuse the frame's memory
+        messages = client_state.released_responses(messages)
+        if ack_coalescer:
+            messages = ack_coalescer.add(
+                messages, self._waiting_for_acks(client_state, pipeline_processor))
+        return messages
+
+    # Returns the messages left to send at end of stream, blocks while
+    # the pipeline still references frames
+    def remaining_messages(self, client_state, ack_coalescer):
+        messages = client_state.release_held_responses()
+        if ack_coalescer:
+            messages = ack_coalescer.add(messages) + ack_coalescer.flush()
+            self._logger.info("Coalesced {} responses into {} messages".format(
+                ack_coalescer.responses, ack_coalescer.messages))
+        return messages
+
+    @staticmethod
+    def _waiting_for_acks(client_state, pipeline_processor):
+        # Shared memory clients may be out of free slots until acknowledged
+        return client_state.content_transfer_type in (TransferType.REFERENCE,
+                                                      TransferType.HANDLE) \
+            and pipeline_processor.idle()
+
+    def check_pipeline(self, pipeline_processor):
+        if pipeline_processor.aborted_or_error():
+            try:
+                raise Exception("Pipeline encountered an issue, pipeline state: {}".format(
+                    pipeline_processor.get_pipeline().status().state))
+            except:
+                log_exception(self._logger)
+                raise
+
+    def generate_gva_sample(self, client_state, request):
+
+        new_sample = None
+        frame = None
+
+        try:
+            # Get reference to raw bytes
+            if client_state.content_transfer_type == TransferType.BYTES:
+                raw_bytes = request.media_sample.content_bytes.bytes
+            elif client_state.content_transfer_type in (TransferType.REFERENCE,
+                                                        TransferType.HANDLE):
+                # Data sent over shared memory buffer or segment
+                address_offset = request.media_sample.content_reference.address_offset
+                length_bytes = request.media_sample.content_reference.length_bytes
+
+                # Get memory reference to (in readonly mode) data sent over shared memory
+                # The frame is held until acknowledged so the client cannot reuse the slot
+                frame = client_state.shared_memory_manager.read_frame(
+                    address_offset, length_bytes
+                )
+                raw_bytes = frame.data
+
+            if client_state.sample_factory.supported():
+                if frame:
+                    client_state.hold_frame(request.sequence_number, frame)
+                new_sample = client_state.sample_factory.create_sample(
+                    raw_bytes,
+                    message={
+                        "sequence_number": request.sequence_number,
+                        "timestamp": request.media_sample.timestamp,
+                    },
+                )
+            else:
+                if frame:
+                    frame.release()
+                self._logger.info("Sample format is not supported")
+        except:
+            log_exception(self._logger)
+            raise
+        return new_sample
+
 
 class GrpcServer(extension_pb2_grpc.MediaGraphExtensionServicer, Server):
     def __init__(self, args):
@@ -102,13 +415,14 @@ class GrpcServer(extension_pb2_grpc.MediaGraphExtensionServicer, Server):
         )
         self._logger = get_logger("gRPC Server")
         self._port = args.grpc_port
+        self._stream_helper = MediaStreamHelper(args, self._logger)
         self._stopped = True
 
     def start(self):
         self._stopped = False
         self._logger.info(
             "Starting GRPC DL Streamer Edge AI Extension on port: %d", self._port)
-        self._server.add_insecure_port(f"[::]:{self._port}")
+        self._stream_helper.add_ports(self._server)
         self._server.start()
         self._server.wait_for_termination()
 
@@ -116,125 +430,20 @@ class GrpcServer(extension_pb2_grpc.MediaGraphExtensionServicer, Server):
         self._server.stop(None)
         self._stopped = True
 
-    def _generate_gva_sample(self, client_state, request):
-
-        new_sample = None
-
-        try:
-            # Get reference to raw bytes
-            if client_state.content_transfer_type == TransferType.BYTES:
-                raw_bytes = memoryview(
-                    request.media_sample.content_bytes.bytes)
-            elif client_state.content_transfer_type == TransferType.REFERENCE:
-                # Data sent over shared memory buffer
-                address_offset = request.media_sample.content_reference.address_offset
-                length_bytes = request.media_sample.content_reference.length_bytes
-
-                # Get memory reference to (in readonly mode) data sent over shared memory
-                raw_bytes = client_state.shared_memory_manager.read_bytes(
-                    address_offset, length_bytes
-                )
-
-            # Get encoding details of the media sent by client
-            encoding = (
-                client_state.media_stream_descriptor.media_descriptor.video_frame_sample_format.encoding
-            )
-
-            # Handle RAW content (Just place holder for the user to handle each variation...)
-            if (
-                    encoding
-                    == client_state.media_stream_descriptor.media_descriptor.video_frame_sample_format.Encoding.RAW
-            ):
-                pixel_format = (
-                    client_state.media_stream_descriptor.media_descriptor.video_frame_sample_format.pixel_format
-                )
-                caps_format = None
-
-                caps_formats = {
-                    media_pb2.VideoFrameSampleFormat.PixelFormat.RGBA: "RGBA",
-                    media_pb2.VideoFrameSampleFormat.PixelFormat.RGB24: "RGB",
-                    media_pb2.VideoFrameSampleFormat.PixelFormat.BGR24: "BGR"
-                }
-                if pixel_format in caps_formats:
-                    caps_format = caps_formats.get(pixel_format, None)
-
-                if caps_format is not None:
-                    caps = "".join(
-                        (
-                            "video/x-raw,format=",
-                            caps_format,
-                            ",width=",
-                            str(
-                                client_state.media_stream_descriptor.
-                                media_descriptor.video_frame_sample_format.dimensions.width
-                            ),
-                            ",height=",
-                            str(
-                                client_state.media_stream_descriptor.
-                                media_descriptor.video_frame_sample_format.dimensions.height
-                            ),
-                        )
-                    )
-                    new_sample = GvaFrameData(
-                        bytes(raw_bytes),
-                        caps,
-                        message={
-                            "sequence_number": request.sequence_number,
-                            "timestamp": request.media_sample.timestamp,
-                        },
-                    )
-            else:
-                self._logger.info("Sample format is not RAW")
-        except:
-            log_exception(self._logger)
-            raise
-        return new_sample
-
     # gRPC stubbed function
     # client/gRPC will call this function to send frames/descriptions
 
     def ProcessMediaStream(self, request_iterator, context):
         # First message from the client is (must be) MediaStreamDescriptor
         request = next(request_iterator) # pylint: disable=stop-iteration-return
-        # Extract message IDs
-        request_seq_num = request.sequence_number
-        request_ack_seq_num = request.ack_sequence_number
-        # State object per client
-        client_state = State(request.media_stream_descriptor)
-        self._logger.info(
-            "[Received] SeqNum: {0:07d} | "
-            "AckNum: {1}\nMediaStreamDescriptor:\n{2}".format(
-                request_seq_num,
-                request_ack_seq_num,
-                client_state.media_stream_descriptor,
-            )
-        )
-        # First message response ...
-        media_stream_message = extension_pb2.MediaStreamMessage(
-            sequence_number=1,
-            ack_sequence_number=request_seq_num,
-            media_stream_descriptor=extension_pb2.MediaStreamDescriptor(
-                media_descriptor=media_pb2.MediaDescriptor(
-                    timescale=client_state.media_stream_descriptor.media_descriptor.timescale
-                )
-            ),
-        )
+        client_state, extension_configuration, media_stream_message = \
+            self._stream_helper.start_stream(request)
 
         yield media_stream_message
 
-        extension_configuration = None
-        if request.media_stream_descriptor.extension_configuration:
-            # Load the extension_config
-            try:
-                extension_configuration = json.loads(
-                    request.media_stream_descriptor.extension_configuration)
-            except ValueError:
-                self._logger.error("Decoding extension_configuration field has failed: {}".format(
-                    request.media_stream_descriptor.extension_configuration))
-                raise
-
         try:
-            pipeline_processor = PipelineProcessor(extension_configuration)
+            pipeline_processor = PipelineProcessor(
+                extension_configuration, self._stream_helper.max_frames_in_flight)
         except:
             log_exception(self._logger)
             raise
@@ -243,38 +452,48 @@ class GrpcServer(extension_pb2_grpc.MediaGraphExtensionServicer, Server):
             request_iterator, pipeline_processor, client_state, context))
 
         incoming_request_thread.start()
+        ack_coalescer = self._stream_helper.create_ack_coalescer(extension_configuration)
+        yield from self._process_responses(pipeline_processor, client_state, ack_coalescer,
+                                           context)
+
+        for media_stream_message in self._stream_helper.remaining_messages(
+                client_state, ack_coalescer):
+            if context.is_active():
+                yield client_state.offload_response(media_stream_message)
+
+        self._stream_helper.check_pipeline(pipeline_processor)
+        pipeline_processor.wait_for_completion()
+        incoming_request_thread.join()
+        client_state.close()
+
+        self._logger.debug("MediaStreamDescriptor:\n{0}".format(
+            client_state.media_stream_descriptor))
+
+    def _process_responses(self, pipeline_processor, client_state, ack_coalescer, context):
         last_frame = False
         while not self._stopped and not pipeline_processor.aborted_or_error() and not last_frame:
             responses = []
             try:
-                responses = pipeline_processor.get_responses()
+                responses = pipeline_processor.get_responses(
+                    self._stream_helper.response_timeout(client_state, ack_coalescer))
             except Empty:
                 self._logger.debug("Timeout occured on getting responses")
                 if pipeline_processor.stopped():
                     break
+            messages = []
             for media_stream_message in responses:
                 if media_stream_message:
-                    self._logger.debug("[Sent] AckSeqNum: {0:07d}".format(
-                        media_stream_message.ack_sequence_number)
-                    )
-                    if context.is_active():
-                        yield media_stream_message
+                    messages.append(media_stream_message)
                 else:
                     last_frame = True
                     break
-
-        if pipeline_processor.aborted_or_error():
-            try:
-                raise Exception("Pipeline encountered an issue, pipeline state: {}".format(
-                    pipeline_processor.get_pipeline().status().state))
-            except:
-                log_exception(self._logger)
-                raise
-        pipeline_processor.wait_for_completion()
-        incoming_request_thread.join()
-
-        self._logger.debug("MediaStreamDescriptor:\n{0}".format(
-            client_state.media_stream_descriptor))
+            for media_stream_message in self._stream_helper.ready_messages(
+                    client_state, pipeline_processor, ack_coalescer, messages):
+                self._logger.debug("[Sent] AckSeqNum: {0:07d}".format(
+                    media_stream_message.ack_sequence_number)
+                )
+                if context.is_active():
+                    yield client_state.offload_response(media_stream_message)
 
     def _process_input_request(self, request_iterator, pipeline_processor, client_state, context):
         for request in request_iterator:
@@ -282,7 +501,8 @@ class GrpcServer(extension_pb2_grpc.MediaGraphExtensionServicer, Server):
             request_seq_num = request.sequence_number
             self._logger.debug(
                 "[Received] SeqNum: {0:07d}".format(request_seq_num))
-            input_sample = self._generate_gva_sample(client_state, request)
+            client_state.release_responses(request.ack_sequence_number)
+            input_sample = self._stream_helper.generate_gva_sample(client_state, request)
             pipeline_processor.submit_frame(input_sample)
             if self._stopped or not context.is_active() or pipeline_processor.stopped():
                 break
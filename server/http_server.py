@@ -4,13 +4,20 @@
 * SPDX-License-Identifier: BSD-3-Clause
 '''
 
-from wsgiref.simple_server import WSGIRequestHandler, make_server
+import io
+import json
+import queue
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
 import falcon
 from google.protobuf.json_format import MessageToDict
 from vaserving.gstreamer_app_source import GvaFrameData
 from protocol_server import Server
 from pipeline_processor import PipelineProcessor
+from sample_factory import SampleFactory, PixelFormat, Encoding
 from common import constants, util
+from common.grpc_autogen import media_pb2
 from common.logging import get_logger
 
 
@@ -24,11 +31,75 @@ class LoggingWSGIRequestHandler(WSGIRequestHandler):
             format % args))
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    # Each request is handled on its own thread so that streams are
+    # processed in parallel, requests of one stream are serialized by
+    # the stream lock
+    daemon_threads = True
+
+
+class ChunkedInput:
+    # wsgiref passes request bodies through as sent, so chunked uploads
+    # are decoded here
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._remaining = 0
+        self._done = False
+
+    def read(self, size):
+        data = b""
+        while len(data) < size and not self._done:
+            if not self._remaining:
+                line = self._stream.readline()
+                try:
+                    self._remaining = int(line.split(b";")[0], 16)
+                except ValueError as error:
+                    raise ValueError("Invalid chunk size in request body") from error
+                if not self._remaining:
+                    # Skip trailers up to the final empty line
+                    while self._stream.readline().strip():
+                        pass
+                    self._done = True
+                    break
+            chunk = self._stream.read(min(size - len(data), self._remaining))
+            if not chunk:
+                raise ValueError("Request body ended within a chunk")
+            data += chunk
+            self._remaining -= len(chunk)
+            if not self._remaining:
+                self._stream.readline()
+        return data
+
+
+class StreamResponse:
+    # Iterated by the server after the responder returns, which calls
+    # close() once the response is done or the client went away
+
+    def __init__(self, results, on_close):
+        self._results = results
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self._results
+
+    def close(self):
+        if self._on_close:
+            on_close, self._on_close = self._on_close, None
+            self._results.close()
+            on_close()
+
+
 _HTTP_500 = falcon.HTTP_500  # pylint: disable=no-member
 _HTTP_200 = falcon.HTTP_200  # pylint: disable=no-member
 _HTTP_204 = falcon.HTTP_204  # pylint: disable=no-member
 _HTTP_400 = falcon.HTTP_400  # pylint: disable=no-member
 
+# Response formats negotiated with the Accept header
+_JSON = "json"
+_COMPACT_JSON = "compact-json"
+_PROTOBUF = "protobuf"
+
 
 class HttpServer(Server):
 
@@ -37,34 +108,81 @@ class HttpServer(Server):
         self._app = falcon.App()
         self._app.add_route(
             '/{pipeline_name}/{pipeline_version}', self, suffix='name_version')
+        self._app.add_route(
+            '/{pipeline_name}/{pipeline_version}/batch', self, suffix='batch')
+        self._app.add_route(
+            '/{pipeline_name}/{pipeline_version}/stream', self, suffix='stream')
         self._logger = get_logger("HTTP Server")
+        self._max_frames_in_flight = args.max_frames_in_flight
+        # Guards _pipelines and _stream_locks, held only for lookups and updates
+        self._pipelines_lock = Lock()
         self._pipelines = {}
+        # Held while a request of the stream is processed, along with the
+        # number of requests using it so that it is removed after the last
+        self._stream_locks = {}
+        # Raw frame layout and sample factory of each stream
+        self._sample_factories = {}
 
     def start(self):
         self._logger.info(
             "Starting HTTP DL Streamer Edge AI Extension on port: %d", self._port)
-        with make_server('', self._port, self._app, handler_class=LoggingWSGIRequestHandler) as server:
+        with make_server('', self._port, self._app, server_class=ThreadingWSGIServer,
+                         handler_class=LoggingWSGIRequestHandler) as server:
             server.serve_forever()
 
     def stop(self):
         pass
 
+    def _acquire_stream_lock(self, stream_id):
+        with self._pipelines_lock:
+            stream_lock = self._stream_locks.setdefault(stream_id, [Lock(), 0])
+            stream_lock[1] += 1
+        stream_lock[0].acquire()
+
+    def _release_stream_lock(self, stream_id):
+        with self._pipelines_lock:
+            stream_lock = self._stream_locks[stream_id]
+            stream_lock[1] -= 1
+            if not stream_lock[1]:
+                del self._stream_locks[stream_id]
+        stream_lock[0].release()
+
+    def _get_pipeline(self, stream_id):
+        with self._pipelines_lock:
+            return self._pipelines.get(stream_id)
+
+    def _remove_pipeline(self, stream_id):
+        with self._pipelines_lock:
+            self._sample_factories.pop(stream_id, None)
+            return self._pipelines.pop(stream_id, None)
+
     def _stop_pipeline(self, stream_id):
-        if stream_id in self._pipelines:
-            pipeline_processor = self._pipelines[stream_id]
-            if not pipeline_processor.stopped():
-                pipeline_processor.stop()
-            del self._pipelines[stream_id]
+        # After errors, the stream is ended without waiting for its frames
+        pipeline_processor = self._remove_pipeline(stream_id)
+        if pipeline_processor and not pipeline_processor.stopped():
+            pipeline_processor.stop()
+
+    def _end_stream(self, stream_id, pipeline_processor):
+        # Called once the end of stream has left the pipeline. Pooled
+        # pipelines keep running and are checked back in to the pool
+        if not pipeline_processor.pooled() and not pipeline_processor.stopped():
+            self._logger.error("Failed to gracefully stop pipeline")
+        self._remove_pipeline(stream_id)
+        pipeline_processor.wait_for_completion()
 
     def _start_pipeline(self, stream_id, extension_config):
         self._logger.info(
             "Starting  pipeline with stream identifier: {}".format(stream_id))
-        self._pipelines[stream_id] = PipelineProcessor(extension_config)
+        # Pipeline start can take a while, other streams are not held up
+        pipeline_processor = PipelineProcessor(
+            extension_config, self._max_frames_in_flight)
+        with self._pipelines_lock:
+            self._pipelines[stream_id] = pipeline_processor
 
     def _get_params(self, req_params):
         params = {}
         for key in req_params:
-            if key != constants.STREAM_ID \
+            if key not in (constants.STREAM_ID, constants.FRAMES_IN_FLIGHT) \
                     and not key.startswith(constants.FRAME_DESTINATION) \
                     and not key.startswith(constants.EXTENSIONS):
                 params[key] = util.get_typed_value(req_params[key])
@@ -82,9 +200,16 @@ class HttpServer(Server):
 
     def _create_extension_config(self, name, version, params):
         extension_config = {}
+        # Batches and streams may fill the pipeline up to the server limit,
+        # single frame requests use the same value so that all request
+        # types can be mixed on a stream
+        frames_in_flight = self._max_frames_in_flight
+        if constants.FRAMES_IN_FLIGHT in params:
+            frames_in_flight = util.get_typed_value(params[constants.FRAMES_IN_FLIGHT])
         pipeline_config = {
             constants.NAME: name,
-            constants.VERSION: version
+            constants.VERSION: version,
+            constants.FRAMES_IN_FLIGHT: frames_in_flight
         }
         parameters = self._get_params(params)
         if parameters:
@@ -103,7 +228,7 @@ class HttpServer(Server):
         return extension_config
 
     def _compare_params(self, extension_config, stream_id):
-        return self._pipelines[stream_id].compare_extension_config(extension_config)
+        return self._get_pipeline(stream_id).compare_extension_config(extension_config)
 
     def _set_response(self, resp, status, content=None, error=False):
         resp.status = status
@@ -113,13 +238,63 @@ class HttpServer(Server):
                 self._logger.error(content)
             resp.media = content
 
+    def _get_response_format(self, req, protobuf=True):
+        # First supported media range listed wins, full JSON is the default
+        for media_range in req.get_header("Accept", default="").split(","):
+            media_type, _, parameters = media_range.partition(";")
+            media_type = media_type.strip().lower()
+            if media_type == constants.HTTP_PROTOBUF_CONTENT_TYPE and protobuf:
+                return _PROTOBUF
+            if media_type in (falcon.MEDIA_JSON, constants.HTTP_JSON_LINES_CONTENT_TYPE):
+                compact_parameter = constants.HTTP_COMPACT_JSON_ACCEPT.partition(";")[2]
+                if compact_parameter.strip() in parameters.replace(" ", "").lower().split(";"):
+                    return _COMPACT_JSON
+                return _JSON
+        return _JSON
+
+    def _serialize(self, media_sample, response_format):
+        if response_format == _PROTOBUF:
+            return media_sample.SerializeToString()
+        if response_format == _COMPACT_JSON:
+            return MessageToDict(media_sample)
+        return MessageToDict(media_sample, including_default_value_fields=True)
+
+    def _set_result_response(self, resp, result, response_format, batch=False):
+        if response_format == _PROTOBUF:
+            if batch:
+                # Length prefixed as the frames of the request, frames
+                # without inferences have length 0
+                length_bytes = constants.HTTP_FRAME_LENGTH_BYTES
+                result = b"".join(len(sample or b"").to_bytes(length_bytes, "big") + (sample or b"")
+                                  for sample in result)
+            resp.status = _HTTP_200
+            resp.content_type = constants.HTTP_PROTOBUF_CONTENT_TYPE
+            resp.data = result
+        elif response_format == _COMPACT_JSON:
+            resp.status = _HTTP_200
+            resp.content_type = falcon.MEDIA_JSON
+            resp.text = json.dumps(result, separators=(",", ":"))
+        else:
+            self._set_response(resp, _HTTP_200, result)
+
     def _verify_content_type(self, content_type):
         if not content_type or content_type not in constants.HTTP_SUPPORTED_CONTENT_TYPES:
             return False
         return True
 
     def on_post_name_version(self, req, resp, pipeline_name, pipeline_version):
+        self._on_post(req, resp, pipeline_name, pipeline_version)
 
+    def on_post_batch(self, req, resp, pipeline_name, pipeline_version):
+        # Frames of a batch are submitted back to back
+        self._on_post(req, resp, pipeline_name, pipeline_version, batch=True)
+
+    def on_post_stream(self, req, resp, pipeline_name, pipeline_version):
+        # One long lived upload per stream, results are returned while
+        # frames are still being sent
+        self._on_post(req, resp, pipeline_name, pipeline_version, stream=True)
+
+    def _on_post(self, req, resp, pipeline_name, pipeline_version, batch=False, stream=False):
         if not self._verify_content_type(req.content_type):
             response_message = " Only {} content-types supported ".format(
                 constants.HTTP_SUPPORTED_CONTENT_TYPES)
@@ -137,48 +312,264 @@ class HttpServer(Server):
         if stream_id is None:
             stream_id = "{}_{}".format(pipeline_name, pipeline_version)
 
-        if stream_id not in self._pipelines:
+        self._acquire_stream_lock(stream_id)
+        try:
+            if stream:
+                # Streamed responses hold the stream lock until they are closed
+                resp.stream = self._open_stream(
+                    req, resp, stream_id, extension_config,
+                    lambda: self._release_stream_lock(stream_id))
+            else:
+                self._process_request(req, resp, stream_id, extension_config, batch)
+        finally:
+            if resp.stream is None:
+                self._release_stream_lock(stream_id)
+
+    def _process_request(self, req, resp, stream_id, extension_config, batch=False):
+        response_format = self._get_response_format(req)
+        sample_factory = None
+        if req.content_type == constants.HTTP_RAW_CONTENT_TYPE and req.content_length:
+            try:
+                sample_factory = self._get_sample_factory(req, stream_id)
+            except ValueError as error:
+                self._set_response(resp, _HTTP_400, str(error), error=True)
+                return
+
+        data = req.bounded_stream.read()
+        process_data = self._process_data
+        if batch:
+            process_data = self._process_batch
+            try:
+                data = list(self._read_frames(io.BytesIO(data)))
+                if not data:
+                    raise ValueError("Batch request has no frames, "
+                                     "send an empty single frame request to end the stream")
+            except ValueError as error:
+                self._set_response(resp, _HTTP_400, str(error), error=True)
+                return
+
+        if not self._check_pipeline(resp, stream_id, extension_config):
+            return
+
+        try:
+            process_data(data, stream_id, req.content_type, resp, sample_factory,
+                         response_format)
+        except Exception as error:
+            self._stop_pipeline(stream_id)
+            response_message = "Pipeline Error: {} Pipeline with stream-id {} stopped".format(
+                str(error), stream_id)
+            self._set_response(resp, _HTTP_500, response_message, error=True)
+
+    def _check_pipeline(self, resp, stream_id, extension_config):
+        if self._get_pipeline(stream_id) is None:
             try:
                 self._start_pipeline(stream_id, extension_config)
             except Exception as error:
                 self._set_response(resp, _HTTP_400, str(error), error=True)
-                return
+                return False
         else:
             if not self._compare_params(extension_config, stream_id):
                 response_message = "Pipeline with stream id {} and different params already running".format(
                     stream_id)
                 self._set_response(
                     resp, _HTTP_400, response_message, error=True)
+                return False
+        return True
+
+    def _open_stream(self, req, resp, stream_id, extension_config, on_close):
+        # Raw frame layout headers hold for every frame of the stream
+        sample_factory = None
+        if req.content_type == constants.HTTP_RAW_CONTENT_TYPE:
+            try:
+                sample_factory = self._get_sample_factory(req, stream_id)
+            except ValueError as error:
+                self._set_response(resp, _HTTP_400, str(error), error=True)
+                return None
+        if not self._check_pipeline(resp, stream_id, extension_config):
+            return None
+        body = req.bounded_stream
+        if "chunked" in req.get_header("Transfer-Encoding", default="").lower():
+            body = ChunkedInput(req.stream)
+        resp.content_type = constants.HTTP_JSON_LINES_CONTENT_TYPE
+        # Results are always JSON lines so that errors can be reported in the stream
+        return StreamResponse(self._stream_results(self._read_frames(body),
+                                                   stream_id, req.content_type, sample_factory,
+                                                   self._get_response_format(req, protobuf=False)),
+                              on_close)
+
+    def _get_video_frame_sample_format(self, req):
+        try:
+            width = int(req.get_header(constants.HTTP_FRAME_WIDTH_HEADER))
+            height = int(req.get_header(constants.HTTP_FRAME_HEIGHT_HEADER))
+            stride = int(req.get_header(constants.HTTP_STRIDE_BYTES_HEADER, default=0))
+            pixel_format = PixelFormat.Value(
+                req.get_header(constants.HTTP_PIXEL_FORMAT_HEADER, default="BGR24").upper())
+        except (TypeError, ValueError) as error:
+            raise ValueError("Raw frames need integer {} and {} headers, optional {} and "
+                             "a {} header naming a VideoFrameSampleFormat pixel format".format(
+                                 constants.HTTP_FRAME_WIDTH_HEADER,
+                                 constants.HTTP_FRAME_HEIGHT_HEADER,
+                                 constants.HTTP_STRIDE_BYTES_HEADER,
+                                 constants.HTTP_PIXEL_FORMAT_HEADER)) from error
+        return media_pb2.VideoFrameSampleFormat(
+            encoding=Encoding.RAW,
+            pixel_format=pixel_format,
+            dimensions=media_pb2.Dimensions(width=width, height=height),
+            stride_bytes=stride)
+
+    def _get_sample_factory(self, req, stream_id):
+        # Resolved once per stream while the frame layout stays the same
+        video_frame_sample_format = self._get_video_frame_sample_format(req)
+        key = video_frame_sample_format.SerializeToString()
+        cached = self._sample_factories.get(stream_id)
+        if cached and cached[0] == key:
+            return cached[1]
+        sample_factory = SampleFactory(video_frame_sample_format)
+        if not sample_factory.supported():
+            raise ValueError("Pixel format {} is not supported".format(
+                req.get_header(constants.HTTP_PIXEL_FORMAT_HEADER)))
+        self._sample_factories[stream_id] = (key, sample_factory)
+        return sample_factory
+
+    def _create_frame(self, data, content_type, sample_factory):
+        if not data:
+            return None
+        if sample_factory:
+            return sample_factory.create_sample(data)
+        return GvaFrameData(data, content_type)
+
+    def _read_frames(self, body):
+        index = 0
+        length_bytes = constants.HTTP_FRAME_LENGTH_BYTES
+        while True:
+            header = body.read(length_bytes)
+            if not header:
                 return
+            length = int.from_bytes(header, "big")
+            data = body.read(length) if len(header) == length_bytes else b""
+            if not length or len(data) < length:
+                raise ValueError("Frame {} of request is empty or truncated".format(index))
+            index += 1
+            yield data
+
+    def _process_batch(self, frames, stream_id, content_type, resp, sample_factory=None,
+                       response_format=_JSON):
+        pipeline_processor = self._get_pipeline(stream_id)
+        frames_in_flight = pipeline_processor.frames_in_flight()
+        results = []
+        submitted = 0
+        for data in frames:
+            # Only wait for results when the pipeline is full
+            while submitted - len(results) >= frames_in_flight:
+                self._collect_results(pipeline_processor, results, response_format)
+            pipeline_processor.submit_frame(self._create_frame(data, content_type, sample_factory))
+            if pipeline_processor.stopped():
+                raise Exception("Pipeline not running")
+            submitted += 1
+        while len(results) < submitted:
+            self._collect_results(pipeline_processor, results, response_format)
+        self._set_result_response(resp, results, response_format, batch=True)
 
+    def _stream_results(self, frames, stream_id, content_type, sample_factory, response_format):
+        pipeline_processor = self._get_pipeline(stream_id)
+        # Frames are read and submitted on their own thread so that each
+        # result is sent as soon as it leaves the pipeline
+        input_errors = []
+        submitter = Thread(target=self._submit_frames,
+                           args=(frames, pipeline_processor, content_type, sample_factory,
+                                 input_errors),
+                           daemon=True)
+        submitter.start()
         try:
-            self._process_data(req.bounded_stream.read(),
-                               stream_id, req.content_type, resp)
+            yield from self._stream_outputs(pipeline_processor, submitter, input_errors,
+                                            response_format)
+            self._end_stream(stream_id, pipeline_processor)
+        except GeneratorExit:
+            # Client went away before all results were sent
+            self._stop_pipeline(stream_id)
+            raise
         except Exception as error:
             self._stop_pipeline(stream_id)
             response_message = "Pipeline Error: {} Pipeline with stream-id {} stopped".format(
                 str(error), stream_id)
-            self._set_response(resp, _HTTP_500, response_message, error=True)
+            self._logger.error(response_message)
+            yield self._json_lines([{"Error": response_message}])
+
+    def _submit_frames(self, frames, pipeline_processor, content_type, sample_factory, errors):
+        try:
+            for data in frames:
+                # Blocks while the pipeline has no room for more frames
+                pipeline_processor.submit_frame(
+                    self._create_frame(data, content_type, sample_factory))
+                if pipeline_processor.stopped():
+                    raise Exception("Pipeline not running")
+        except Exception as error:
+            errors.append(error)
+            return
+        # End of the upload ends the stream
+        pipeline_processor.submit_frame(None)
 
-    def _process_data(self, data, stream_id, content_type, resp):
-        frame = None
-        if data:
-            frame = GvaFrameData(data, content_type)
-        pipeline_processor = self._pipelines[stream_id]
+    def _stream_outputs(self, pipeline_processor, submitter, input_errors, response_format,
+                        timeout=40):
+        waited = 0
+        while True:
+            try:
+                outputs = pipeline_processor.get_responses(timeout=1)
+                waited = 0
+            except queue.Empty:
+                outputs = []
+                # Clients may pause between frames, once the upload has
+                # ended the remaining results are waited for as usual
+                if not submitter.is_alive():
+                    waited += 1
+            if waited >= timeout:
+                raise Exception("Timed out waiting for results")
+            results = []
+            ended = False
+            for output in outputs:
+                if output is None:
+                    ended = True
+                    break
+                if output.media_sample.inferences:
+                    results.append(self._serialize(output.media_sample, response_format))
+                else:
+                    results.append(None)
+            if results:
+                yield self._json_lines(results, response_format)
+            if ended:
+                return
+            if input_errors:
+                raise input_errors[0]
+
+    def _json_lines(self, results, response_format=_JSON):
+        separators = (",", ":") if response_format == _COMPACT_JSON else None
+        return "".join(json.dumps(result, separators=separators) + "\n"
+                       for result in results).encode()
+
+    def _collect_results(self, pipeline_processor, results, response_format=_JSON, timeout=40):
+        # Results are in frame order, frames without inferences have null
+        for output in pipeline_processor.get_responses(timeout):
+            if output is None:
+                raise Exception("Pipeline ended before all frames of the request were processed")
+            if output.media_sample.inferences:
+                results.append(self._serialize(output.media_sample, response_format))
+            else:
+                results.append(None)
+
+    def _process_data(self, data, stream_id, content_type, resp, sample_factory=None,
+                      response_format=_JSON):
+        frame = self._create_frame(data, content_type, sample_factory)
+        pipeline_processor = self._get_pipeline(stream_id)
         pipeline_processor.submit_frame(frame)
         if pipeline_processor.stopped():
             raise Exception("Pipeline not running")
         output = pipeline_processor.get_responses()[0]
         if output:
             if output.media_sample.inferences:
-                response_message = MessageToDict(
-                    output.media_sample, including_default_value_fields=True)
-                self._set_response(resp, _HTTP_200, response_message)
+                self._set_result_response(
+                    resp, self._serialize(output.media_sample, response_format), response_format)
             else:
                 self._set_response(resp, _HTTP_204)
         else:
             self._set_response(resp, _HTTP_204)
-            if not pipeline_processor.stopped():
-                self._logger.error("Failed to gracefully stop pipeline")
-            self._stop_pipeline(stream_id)
-            pipeline_processor.wait_for_completion()
+            self._end_stream(stream_id, pipeline_processor)
@@ -0,0 +1,199 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: MIT License
+*
+*****
+*
+* MIT License
+*
+* Copyright (c) Microsoft Corporation.
+*
+* Permission is hereby granted, free of charge, to any person obtaining a copy
+* of this software and associated documentation files (the "Software"), to deal
+* in the Software without restriction, including without limitation the rights
+* to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+* copies of the Software, and to permit persons to whom the Software is
+* furnished to do so, subject to the following conditions:
+*
+* The above copyright notice and this permission notice shall be included in all
+* copies or substantial portions of the Software.
+*
+* THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+* IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+* FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+* AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+* LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+* OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+* SOFTWARE
+'''
+
+import json
+import uuid
+import itertools
+
+from common.logging import get_logger
+from common.grpc_autogen import inferencing_pb2
+from common.grpc_autogen import extension_pb2
+from common.exception_handler import log_exception
+
+
+class FrameMetadata:
+    # Messages and regions of a video frame decoded once so that every
+    # step of building the response reuses them. Frame tensors are only
+    # needed when there are no regions so they are read on first use
+    def __init__(self, video_frame):
+        self._video_frame = video_frame
+        self._tensors = None
+        self.messages = [json.loads(message) for message in video_frame.messages()]
+        self.regions = list(video_frame.regions())
+        self.events = []
+        for message in self.messages:
+            if "events" in message:
+                self.events = message["events"]
+                break
+        # Event related-objects slots indexed by the region they refer to
+        self.related_objects = {}
+        for event in self.events:
+            related_objects = event['related-objects']
+            for i, region_index in enumerate(related_objects):
+                self.related_objects.setdefault(region_index, []).append((related_objects, i))
+
+    @property
+    def tensors(self):
+        if self._tensors is None:
+            self._tensors = list(self._video_frame.tensors())
+        return self._tensors
+
+
+class MediaStreamMessageGenerator:
+    # Converts pipeline output samples of one stream to MediaStreamMessages
+    def __init__(self, extensions):
+        self._logger = get_logger("MediaStreamMessageGenerator")
+        # Fields shared by every inference of the stream are built once
+        # and merged into each new inference with a single call
+        self._entity_template = self._create_template(
+            # pylint: disable=no-member
+            inferencing_pb2.Inference.InferenceType.ENTITY, extensions)
+        self._classification_template = self._create_template(
+            # pylint: disable=no-member
+            inferencing_pb2.Inference.InferenceType.CLASSIFICATION, extensions)
+        # Inference ids are unique per stream prefix and sequence number
+        self._inference_id_prefix = uuid.uuid4().hex
+        self._inference_ids = itertools.count(1)
+
+    @staticmethod
+    def _create_template(inference_type, extensions):
+        template = inferencing_pb2.Inference(type=inference_type)
+        if extensions:
+            template.extensions.update(extensions)
+        return template
+
+    def _next_inference_id(self):
+        return "{}-{}".format(self._inference_id_prefix, next(self._inference_ids))
+
+    def generate(self, gva_sample):
+        metadata = FrameMetadata(gva_sample.video_frame)
+        msg = extension_pb2.MediaStreamMessage()
+        self._add_media_stream_message_meta(metadata, msg)
+        inferences = msg.media_sample.inferences
+        self._add_action_recognition_results(metadata, inferences)
+        self._add_entities(metadata, inferences)
+        self._add_events(metadata.events, inferences)
+        return msg
+
+    @staticmethod
+    def _add_media_stream_message_meta(metadata, msg):
+        if metadata.messages:
+            message = metadata.messages[0]
+            if message.get("sequence_number", None):
+                msg.ack_sequence_number = message["sequence_number"]
+            if message.get("timestamp", None):
+                msg.media_sample.timestamp = message["timestamp"]
+
+    def _add_action_recognition_results(self, metadata, inferences):
+        # gvaactionrecognitionbin element has no video frame regions
+        if metadata.regions:
+            return
+        for tensor in metadata.tensors:
+            if tensor.name() == "action":
+                try:
+                    label = tensor.label()
+                    confidence = tensor.confidence()
+                except:
+                    log_exception(self._logger)
+                    raise
+                inference = inferences.add()
+                inference.MergeFrom(self._classification_template)
+                tag = inference.classification.tag
+                tag.value = label
+                tag.confidence = confidence
+
+    @staticmethod
+    def _get_detection_and_attributes(region):
+        attributes = []
+        detection = False
+        for tensor in region.tensors():
+            if tensor.is_detection():
+                detection = True
+            elif tensor["label"]:  # Classification
+                attributes.append((tensor.name(), tensor["label"]))
+        return detection, attributes
+
+    def _add_entities(self, metadata, inferences):
+        for region_index, region in enumerate(metadata.regions):
+            detection, attributes = self._get_detection_and_attributes(region)
+            if detection:
+                # Entity is filled in place in the repeated field
+                inference = inferences.add()
+                inference.MergeFrom(self._entity_template)
+                entity = inference.entity
+                confidence = region.confidence()
+                entity.tag.value = region.label()
+                entity.tag.confidence = confidence
+                box = entity.box
+                box.l, box.t, box.w, box.h = region.normalized_rect()
+                if region.object_id():  # Tracking
+                    entity.id = str(region.object_id())
+                for name, value in attributes:
+                    entity.attributes.add(name=name, value=value, confidence=confidence)
+                self._update_inference_ids(metadata.related_objects, inference, region_index)
+
+    def _update_inference_ids(self, related_objects, inference, region_index):
+        slots = related_objects.get(region_index)
+        if slots:
+            inference.inference_id = self._next_inference_id()
+            inference.subtype = "objectDetection"
+            for objects, i in slots:
+                objects[i] = inference.inference_id
+
+    def _add_events(self, events, inferences):
+        for event in events:
+            self._add_event(inferences, event)
+
+    def _add_event(self, inferences, event):
+        event_name = ""
+        event_properties = {}
+        inference_event = inferences.add()
+        inference_event.type = (
+            # pylint: disable=no-member
+            inferencing_pb2.Inference.InferenceType.EVENT
+        )
+        inference_event.inference_id = self._next_inference_id()
+        inference_event.subtype = event["event-type"]
+
+        for inference_id in event['related-objects']:
+            inference_event.related_inferences.append(inference_id)
+
+        for key, value in event.items():
+            if key in ('event-type', 'related-objects'):
+                continue
+            if "name" in key:
+                event_name = value
+            else:
+                event_properties[key] = str(value)
+
+        inference_event.event.CopyFrom(inferencing_pb2.Event(
+            name=event_name,
+            properties=event_properties,
+        ))
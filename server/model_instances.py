@@ -0,0 +1,135 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import re
+import json
+import zlib
+from threading import Lock
+
+from vaserving.vaserving import VAServing
+
+from common.logging import get_logger
+
+MODEL_INSTANCE_ID = "model-instance-id"
+DEVICE = "device"
+DEFAULT_DEVICE = "CPU"
+
+_ELEMENT_NAME = re.compile(r"\bname=([\w-]+)")
+_ELEMENT_MODEL = re.compile(r"\bmodel=\{models\[([^\]]+)\]\[([^\]]+)\]")
+
+
+def _targets(element, element_name):
+    # Parameter element definitions are a name, an object or a list of objects
+    if isinstance(element, str):
+        return element == element_name
+    if isinstance(element, dict):
+        return element.get("name") == element_name
+    if isinstance(element, list):
+        return any(_targets(item, element_name) for item in element)
+    return False
+
+
+def _property(element):
+    if isinstance(element, dict):
+        return element.get("property")
+    return None
+
+
+class ModelInstanceRegistry:
+    # Assigns model-instance-ids so that streams running the same model on the
+    # same device with the same inference settings share one loaded instance
+
+    _logger = get_logger("ModelInstanceRegistry")
+    _lock = Lock()
+    _references = {}
+
+    @classmethod
+    def assign(cls, pipeline_name, pipeline_version, parameters):
+        parameters = dict(parameters or {})
+        definition = cls._get_definition(pipeline_name, pipeline_version)
+        if not definition:
+            return parameters, []
+        properties = definition.get("parameters", {}).get("properties", {})
+        models = cls._get_element_models(definition.get("template", ""))
+        instance_ids = []
+        for name, spec in properties.items():
+            element = spec.get("element")
+            if _property(element) != MODEL_INSTANCE_ID or name in parameters:
+                continue
+            element_name = element.get("name")
+            if element_name not in models:
+                continue
+            instance_id = cls._instance_id(
+                models[element_name], element_name, properties, parameters)
+            parameters[name] = instance_id
+            instance_ids.append(instance_id)
+        cls._acquire(instance_ids)
+        return parameters, instance_ids
+
+    @classmethod
+    def release(cls, instance_ids):
+        with cls._lock:
+            for instance_id in instance_ids:
+                cls._references[instance_id] -= 1
+                cls._logger.info("Model Instance {} References: {}".format(
+                    instance_id, cls._references[instance_id]))
+                if not cls._references[instance_id]:
+                    del cls._references[instance_id]
+
+    @classmethod
+    def reference_counts(cls):
+        with cls._lock:
+            return dict(cls._references)
+
+    @classmethod
+    def _acquire(cls, instance_ids):
+        with cls._lock:
+            for instance_id in instance_ids:
+                cls._references[instance_id] = cls._references.get(instance_id, 0) + 1
+                cls._logger.info("Model Instance {} References: {}".format(
+                    instance_id, cls._references[instance_id]))
+
+    @classmethod
+    def _get_definition(cls, pipeline_name, pipeline_version):
+        try:
+            return VAServing.pipeline_manager.pipelines[pipeline_name][pipeline_version]
+        except (AttributeError, KeyError, TypeError):
+            cls._logger.debug("No definition found for pipeline {}/{}".format(
+                pipeline_name, pipeline_version))
+            return None
+
+    @staticmethod
+    def _get_element_models(template):
+        if isinstance(template, list):
+            template = "".join(template)
+        models = {}
+        for element in template.split("!"):
+            name = _ELEMENT_NAME.search(element)
+            model = _ELEMENT_MODEL.search(element)
+            if name and model:
+                models[name.group(1)] = "{}_{}".format(model.group(1), model.group(2))
+        return models
+
+    @staticmethod
+    def _instance_id(model, element_name, properties, parameters):
+        # The precision loaded for a model follows from the device, other
+        # settings of the element only apply to the first stream sharing the
+        # instance so they are made part of the id
+        device = None
+        settings = {}
+        for name, spec in properties.items():
+            element = spec.get("element")
+            if not _targets(element, element_name):
+                continue
+            if _property(element) == DEVICE:
+                device = parameters.get(name, spec.get("default"))
+            elif name in parameters:
+                settings[name] = parameters[name]
+        instance_id = "{}_{}".format(model, device or DEFAULT_DEVICE)
+        if settings:
+            digest = zlib.crc32(json.dumps(settings, sort_keys=True).encode())
+            instance_id = "{}_{:08x}".format(instance_id, digest)
+        return instance_id
@@ -0,0 +1,204 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import json
+import time
+from queue import Queue
+from threading import Lock, Event, Thread
+
+from vaserving.vaserving import VAServing
+from vaserving.pipeline import Pipeline
+
+from model_instances import ModelInstanceRegistry
+from common import constants
+from common.logging import get_logger
+from common.util import validate_pipeline_pool_config
+
+
+def pool_key(name, version, parameters, frame_destination, share_model_instances=True):
+    return json.dumps([name, version, parameters or {}, frame_destination or {},
+                       share_model_instances], sort_keys=True)
+
+
+class PipelineOutput: # pylint: disable=too-few-public-methods
+    # Destination output that forwards samples to the stream
+    # currently using the pipeline
+    def __init__(self):
+        self.target = None
+
+    def put(self, item, block=True, timeout=None):
+        target = self.target
+        if target is not None:
+            target.put(item, block, timeout)
+
+
+class PipelineInstance:
+    # A started VA Serving pipeline fed through an application source,
+    # outliving the stream that uses it when pooled
+
+    def __init__(self, name, version, parameters, frame_destination, share_model_instances=True):
+        self.key = pool_key(name, version, parameters, frame_destination, share_model_instances)
+        self.input = Queue()
+        self.output = PipelineOutput()
+        self.idle_since = None
+        self.model_instance_ids = []
+        if share_model_instances:
+            parameters, self.model_instance_ids = ModelInstanceRegistry.assign(
+                name, version, parameters)
+
+        destination = {
+            "metadata": {
+                "type": "application",
+                "class": "GStreamerAppDestination",
+                "output": self.output,
+                "mode": "frames",
+            }
+        }
+
+        if frame_destination:
+            destination["frame"] = frame_destination
+
+        try:
+            self.pipeline = VAServing.pipeline(name, version)
+            self.pipeline.start(
+                source={
+                    "type": "application",
+                    "class": "GStreamerAppSource",
+                    "input": self.input,
+                    "mode": "push",
+                },
+                destination=destination,
+                parameters=parameters,
+            )
+        except:
+            self.release_model_instances()
+            raise
+
+    def usable(self):
+        state = self.pipeline.status().state
+        return not state.stopped() and state not in (Pipeline.State.ERROR, Pipeline.State.ABORTED)
+
+    def stop(self):
+        # End of stream lets the pipeline complete gracefully
+        self.output.target = None
+        self.input.put(None)
+        self.release_model_instances()
+
+    def release_model_instances(self):
+        ModelInstanceRegistry.release(self.model_instance_ids)
+        self.model_instance_ids = []
+
+
+class PipelinePool:
+    # Pre-started idle pipelines for configured (name, version, parameters)
+    # tuples. Streams check one out on connect and return it on end of stream
+
+    _logger = get_logger("PipelinePool")
+    _lock = Lock()
+    _idle = {}
+    _sizes = {}
+    _entries = {}
+    _idle_timeout = 0
+    _stop_event = Event()
+    _eviction_thread = None
+
+    @staticmethod
+    def load_config(pipeline_pool):
+        if not pipeline_pool:
+            return []
+        if pipeline_pool.endswith(".json"):
+            with open(pipeline_pool, "r", encoding="utf-8") as config:
+                pipeline_pool_config = json.loads(config.read())
+        else:
+            pipeline_pool_config = json.loads(pipeline_pool)
+        validate_pipeline_pool_config(pipeline_pool_config)
+        return pipeline_pool_config
+
+    @classmethod
+    def start(cls, pipeline_pool_config, idle_timeout=0):
+        cls._idle_timeout = idle_timeout
+        for entry in pipeline_pool_config:
+            key = pool_key(entry[constants.NAME], entry[constants.VERSION],
+                           entry.get(constants.PARAMETERS), entry.get(constants.FRAME_DESTINATION))
+            cls._sizes[key] = cls._sizes.get(key, 0) + entry.get("size", 1)
+            cls._entries[key] = entry
+            cls._idle[key] = []
+        for key, size in cls._sizes.items():
+            for _ in range(size):
+                cls._add_idle(cls._create(cls._entries[key]))
+            cls._logger.info("Pre-started {} pipelines for {}".format(size, key))
+        if cls._sizes and idle_timeout > 0:
+            cls._stop_event.clear()
+            cls._eviction_thread = Thread(target=cls._evict_loop, daemon=True)
+            cls._eviction_thread.start()
+
+    @classmethod
+    def stop(cls):
+        cls._stop_event.set()
+        with cls._lock:
+            for instances in cls._idle.values():
+                for instance in instances:
+                    instance.stop()
+                instances.clear()
+
+    @classmethod
+    def pooled(cls, key):
+        return key in cls._sizes
+
+    @classmethod
+    def checkout(cls, key):
+        with cls._lock:
+            instances = cls._idle.get(key, [])
+            while instances:
+                instance = instances.pop()
+                if instance.usable():
+                    instance.idle_since = None
+                    return instance
+                cls._logger.info("Discarding pipeline {} no longer running".format(
+                    instance.pipeline.identifier))
+        return None
+
+    @classmethod
+    def checkin(cls, instance):
+        instance.output.target = None
+        if not instance.usable():
+            return False
+        with cls._lock:
+            instances = cls._idle.get(instance.key)
+            if instances is None or len(instances) >= cls._sizes[instance.key]:
+                return False
+            instance.idle_since = time.time()
+            instances.append(instance)
+        return True
+
+    @classmethod
+    def _create(cls, entry):
+        return PipelineInstance(entry[constants.NAME], entry[constants.VERSION],
+                                entry.get(constants.PARAMETERS), entry.get(constants.FRAME_DESTINATION))
+
+    @classmethod
+    def _add_idle(cls, instance):
+        instance.idle_since = time.time()
+        with cls._lock:
+            cls._idle[instance.key].append(instance)
+
+    @classmethod
+    def _evict_loop(cls):
+        while not cls._stop_event.wait(cls._idle_timeout / 2):
+            cls._evict_idle()
+
+    @classmethod
+    def _evict_idle(cls):
+        now = time.time()
+        with cls._lock:
+            for key, instances in cls._idle.items():
+                expired = [instance for instance in instances
+                           if now - instance.idle_since > cls._idle_timeout]
+                for instance in expired:
+                    cls._logger.info("Evicting idle pipeline {} for {}".format(
+                        instance.pipeline.identifier, key))
+                    instances.remove(instance)
+                    instance.stop()
@@ -28,67 +28,65 @@
 * SOFTWARE
 '''
 
-import json
-import uuid
+import time
 import copy
 from queue import Queue
+from threading import Semaphore
 
-from vaserving.vaserving import VAServing
 from vaserving.pipeline import Pipeline
 
+from pipeline_pool import PipelinePool, PipelineInstance, pool_key
+from media_stream_message import MediaStreamMessageGenerator
+
+from common import constants
 from common.logging import get_logger
-from common.grpc_autogen import inferencing_pb2
-from common.grpc_autogen import extension_pb2
-from common.exception_handler import log_exception
 from common.util import validate_extension_config
 
 
 class PipelineProcessor:
-    def __init__(self, extension_config, input_queue_size=1):
-        self._input_queue_size = input_queue_size
+    def __init__(self, extension_config, max_frames_in_flight=1, output_queue=None):
         self._logger = get_logger("PipelineProcessor")
         self._extension_config = copy.deepcopy(extension_config)
         pipeline_config = self._set_pipeline_properties(extension_config)
         pipeline_name = pipeline_config["name"]
         pipeline_version = pipeline_config["version"]
         pipeline_parameters = pipeline_config.get("parameters")
-        self._extensions = pipeline_config.get("extensions")
+        self._message_generator = MediaStreamMessageGenerator(pipeline_config.get("extensions"))
         frame_destination = pipeline_config.get("frame-destination")
+        # Frames submitted but not yet returned by the pipeline,
+        # as requested by the client and capped by the server
+        self._frames_in_flight = min(
+            pipeline_config[constants.FRAMES_IN_FLIGHT], max_frames_in_flight)
 
         self._logger.info("Pipeline Name : {}".format(pipeline_name))
         self._logger.info("Pipeline Version : {}".format(pipeline_version))
         self._logger.info(
             "Pipeline Parameters : {}".format(pipeline_parameters))
         self._logger.info("Frame Destination : {}".format(frame_destination))
-        self._input_frame = Queue(maxsize=self._input_queue_size)
-        self._output_frame = Queue()
-
-        destination = {
-            "metadata": {
-                "type": "application",
-                "class": "GStreamerAppDestination",
-                "output": self._output_frame,
-                "mode": "frames",
-            }
-        }
-
-        if frame_destination:
-            destination["frame"] = frame_destination
-
-        try:
-            self._pipeline = VAServing.pipeline(pipeline_name, pipeline_version)
-            self._pipeline.start(
-                source={
-                    "type": "application",
-                    "class": "GStreamerAppSource",
-                    "input": self._input_frame,
-                    "mode": "push",
-                },
-                destination=destination,
-                parameters=pipeline_parameters,
-            )
-        except Exception as error:
-            raise error
+        self._logger.info("Frames In Flight : {}".format(self._frames_in_flight))
+        # One credit per in flight frame, taken on submit and returned
+        # when the corresponding sample leaves the pipeline
+        self._credits = Semaphore(self._frames_in_flight)
+        # Any object with a thread safe put() can receive pipeline output
+        self._output_frame = output_queue if output_queue is not None else Queue()
+
+        self._start_time = time.time()
+        self._first_response_time = None
+        share_model_instances = pipeline_config[constants.SHARE_MODEL_INSTANCES]
+        key = pool_key(pipeline_name, pipeline_version, pipeline_parameters, frame_destination,
+                       share_model_instances)
+        # Pooled pipelines are kept running at end of stream so they can be reused
+        self._pooled = PipelinePool.pooled(key)
+        self._instance = PipelinePool.checkout(key)
+        self._warm_start = self._instance is not None
+        if not self._warm_start:
+            self._instance = PipelineInstance(
+                pipeline_name, pipeline_version, pipeline_parameters, frame_destination,
+                share_model_instances)
+        self._logger.info("Pipeline Start : {}".format("warm" if self._warm_start else "cold"))
+        self._instance.output.target = self._output_frame
+        self._input_frame = self._instance.input
+        self._pipeline = self._instance.pipeline
         self._frames_received = 0
         self._responses_sent = 0
         self._error = False
@@ -99,9 +97,26 @@ class PipelineProcessor:
     def compare_extension_config(self, extention_config):
         return self._extension_config == extention_config
 
+    def frames_in_flight(self):
+        return self._frames_in_flight
+
+    def idle(self):
+        # Every frame submitted so far has left the pipeline
+        return self._frames_received == self._responses_sent
+
     def stopped(self):
         return self._pipeline.status().state.stopped()
 
+    def pooled(self):
+        # Pooled pipelines keep running after the end of the stream
+        return self._pooled
+
+    def stop(self):
+        # Ends the stream early, as after an error. Frames may still be in
+        # flight so a pooled pipeline is not returned to the pool, the next
+        # stream started cold takes its place
+        self._instance.stop()
+
     def get_responses(self, timeout=40):
         output_messages = []
         samples = []
@@ -110,17 +125,45 @@ class PipelineProcessor:
             samples.append(self._output_frame.get())
 
         for sample in samples:
-            if sample is None:
-                output_messages.append(None)
-            else:
-                output_messages.append(
-                    self._generate_media_stream_message(sample))
+            output_messages.append(self.generate_response(sample))
         return output_messages
 
-    def submit_frame(self, input_gva_frame):
-        self._input_frame.put(input_gva_frame)
+    def generate_response(self, sample):
+        if sample is None:
+            return None
+        self._credits.release()
+        if self._first_response_time is None:
+            self._first_response_time = time.time()
+            self._logger.info("First Response Latency: {:.3f}s ({} start)".format(
+                self._first_response_time - self._start_time,
+                "warm" if self._warm_start else "cold"))
+        return self._generate_media_stream_message(sample)
+
+    def submit_frame(self, input_gva_frame, timeout=1):
         if input_gva_frame:
+            if not self._acquire_credit(timeout):
+                return
             self._frames_received += 1
+            self._input_frame.put(input_gva_frame)
+        elif self._pooled:
+            # Pooled pipelines keep running, so instead of end of stream wait
+            # for all frames in flight and then signal the end directly
+            acquired = 0
+            while acquired < self._frames_in_flight and self._acquire_credit(timeout):
+                acquired += 1
+            self._output_frame.put(None)
+            for _ in range(acquired):
+                self._credits.release()
+        else:
+            self._input_frame.put(None)
+
+    def _acquire_credit(self, timeout):
+        # Block until a credit is available, bailing out if the pipeline
+        # stops while waiting as no more samples will be returned
+        while not self._credits.acquire(timeout=timeout):
+            if self.stopped():
+                return False
+        return True
 
     def set_as_error(self):
         self._error = True
@@ -130,12 +173,24 @@ class PipelineProcessor:
         return state in (Pipeline.State.ERROR, Pipeline.State.ABORTED) or self._error
 
     def wait_for_completion(self, wait=10):
+        if self._pooled:
+            if not self.aborted_or_error() and PipelinePool.checkin(self._instance):
+                self._logger.info("Pipeline returned to pool")
+                self._log_done()
+                return
+            # Not kept by the pool, so end the stream it was spared
+            self._instance.stop()
+
         # One final check on the pipeline to ensure it worked properly
         status = self._pipeline.wait(wait)
+        self._instance.release_model_instances()
         self._logger.info("Pipeline Ended Status: {}".format(status))
         if (not status) or (status.state == Pipeline.State.ERROR):
             raise Exception("Pipeline did not complete successfully")
 
+        self._log_done()
+
+    def _log_done(self):
         self._logger.info(
             "Done processing messages: Received: {}, Sent: {}".format(
                 self._frames_received, self._responses_sent
@@ -146,140 +201,7 @@ class PipelineProcessor:
         self._responses_sent += 1
         if gva_sample is None:
             return None
-        msg = extension_pb2.MediaStreamMessage()
-        self._add_media_stream_message_meta(gva_sample, msg)
-        inferences = msg.media_sample.inferences
-        self._add_action_recognition_results(gva_sample, inferences)
-        events = self._get_events_from_sample(gva_sample)
-        self._add_entities(gva_sample, inferences, events)
-        self._add_events(events, inferences)
-        return msg
-
-    def _add_media_stream_message_meta(self, gva_sample, msg):
-        messages = list(gva_sample.video_frame.messages())
-        if messages:
-            message = json.loads(messages[0])
-            if message.get("sequence_number", None):
-                msg.ack_sequence_number = message["sequence_number"]
-            if message.get("timestamp", None):
-                msg.media_sample.timestamp = message["timestamp"]
-
-    def _add_action_recognition_results(self, gva_sample, inferences):
-        # gvaactionrecognitionbin element has no video frame regions
-        if list(gva_sample.video_frame.regions()):
-            return
-        for tensor in gva_sample.video_frame.tensors():
-            if tensor.name() == "action":
-                try:
-                    label = tensor.label()
-                    confidence = tensor.confidence()
-                    classification = inferencing_pb2.Classification(
-                        tag=inferencing_pb2.Tag(
-                            value=label, confidence=confidence
-                        )
-                    )
-                except:
-                    log_exception(self._logger)
-                    raise
-                inference = inferences.add()
-                inference.type = (
-                    # pylint: disable=no-member
-                    inferencing_pb2.Inference.InferenceType.CLASSIFICATION
-                )
-                inference.classification.CopyFrom(classification)
-                self._add_extensions(inference)
-
-    def _add_extensions(self, inference):
-        if self._extensions:
-            for key in self._extensions:
-                inference.extensions[key] = self._extensions[key]
-
-    def _get_entity_and_attributes(self, region):
-        attributes = []
-        entity = None
-        for tensor in region.tensors():
-            if tensor.is_detection():
-                obj_left, obj_top, obj_width, obj_height = region.normalized_rect()
-                entity = inferencing_pb2.Entity(
-                    tag=inferencing_pb2.Tag(
-                        value=region.label(), confidence=region.confidence()
-                    ),
-                    box=inferencing_pb2.Rectangle(
-                        l=obj_left, t=obj_top, w=obj_width, h=obj_height
-                    ),
-                )
-                if region.object_id():  # Tracking
-                    entity.id = str(region.object_id())
-            elif tensor["label"]:  # Classification
-                attributes.append([tensor.name(), tensor["label"], region.confidence()])
-        return entity, attributes
-
-    def _add_entities(self, gva_sample, inferences, events):
-        for region_index, region in enumerate(gva_sample.video_frame.regions()):
-            entity, attributes = self._get_entity_and_attributes(region)
-            if entity:
-                for attr in attributes:
-                    attribute = inferencing_pb2.Attribute(
-                        name=attr[0], value=attr[1], confidence=attr[2]
-                    )
-                    entity.attributes.append(attribute)
-                inference = inferences.add()
-                inference.type = (
-                    # pylint: disable=no-member
-                    inferencing_pb2.Inference.InferenceType.ENTITY
-                )
-                self._add_extensions(inference)
-                inference.entity.CopyFrom(entity)
-                self._update_inference_ids(events, inference, region_index)
-
-    def _get_events_from_sample(self, gva_sample):
-        events = []
-        for message in gva_sample.video_frame.messages():
-            message_obj = json.loads(message)
-            if "events" in message_obj.keys():
-                events = message_obj["events"]
-                break
-        return events
-
-    def _update_inference_ids(self, events, inference, region_index):
-        for event in events:
-            for i in range(len(event['related-objects'])):
-                if region_index == event['related-objects'][i]:
-                    if not inference.inference_id:
-                        inference.inference_id = uuid.uuid4().hex
-                        inference.subtype = "objectDetection"
-                    event['related-objects'][i] = inference.inference_id
-
-    def _add_events(self, events, inferences):
-        for event in events:
-            self._add_event(inferences, event)
-
-    def _add_event(self, inferences, event):
-        event_name = ""
-        event_properties = {}
-        inference_event = inferences.add()
-        inference_event.type = (
-            # pylint: disable=no-member
-            inferencing_pb2.Inference.InferenceType.EVENT
-        )
-        inference_event.inference_id = uuid.uuid4().hex
-        inference_event.subtype = event["event-type"]
-
-        for inference_id in event['related-objects']:
-            inference_event.related_inferences.append(inference_id)
-
-        for key, value in event.items():
-            if key in ('event-type', 'related-objects'):
-                continue
-            if "name" in key:
-                event_name = value
-            else:
-                event_properties[key] = str(value)
-
-        inference_event.event.CopyFrom(inferencing_pb2.Event(
-            name=event_name,
-            properties=event_properties,
-        ))
+        return self._message_generator.generate(gva_sample)
 
     def _set_pipeline_properties(self, extension_configuration):
         # Set deployment pipeline name, version, and args if set
@@ -289,7 +211,9 @@ class PipelineProcessor:
             "version": "",
             "parameters": {},
             "frame-destination": {},
-            "extensions": {}
+            "extensions": {},
+            constants.FRAMES_IN_FLIGHT: 1,
+            constants.SHARE_MODEL_INSTANCES: True
         }
 
         # Validate the extension_config against the schema
@@ -0,0 +1,135 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import sys
+from collections import namedtuple
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+from vaserving.gstreamer_app_source import GvaFrameData
+
+from common.grpc_autogen import media_pb2
+
+PixelFormat = media_pb2.VideoFrameSampleFormat.PixelFormat
+Encoding = media_pb2.VideoFrameSampleFormat.Encoding
+
+# Packed formats: PixelFormat -> (GStreamer format, bytes per pixel, byte order)
+# GStreamer 16 bit RGB formats are native endian so the byte order is
+# used to decide if samples need swapping on this host
+PACKED_FORMATS = {
+    PixelFormat.RGB565BE: ("RGB16", 2, "big"),
+    PixelFormat.RGB565LE: ("RGB16", 2, "little"),
+    PixelFormat.RGB555BE: ("RGB15", 2, "big"),
+    PixelFormat.RGB555LE: ("RGB15", 2, "little"),
+    PixelFormat.RGB24: ("RGB", 3, None),
+    PixelFormat.BGR24: ("BGR", 3, None),
+    PixelFormat.ARGB: ("ARGB", 4, None),
+    PixelFormat.RGBA: ("RGBA", 4, None),
+    PixelFormat.ABGR: ("ABGR", 4, None),
+    PixelFormat.BGRA: ("BGRA", 4, None),
+}
+
+# Planar formats: PixelFormat -> GStreamer format
+PLANAR_FORMATS = {
+    PixelFormat.YUV420P: "I420",
+}
+
+# Encoded formats are decoded in the pipeline: Encoding -> caps
+ENCODED_CAPS = {
+    Encoding.BMP: "image/bmp",
+    Encoding.JPG: "image/jpeg",
+    Encoding.PNG: "image/png",
+}
+
+# Layout of one plane: bytes of pixel data per row, number of rows,
+# stride sent by the client and stride GStreamer expects by default
+Plane = namedtuple("Plane", ["row_bytes", "rows", "src_stride", "dst_stride"])
+
+
+def _round_up_4(value):
+    return (value + 3) & ~3
+
+
+def _half(value):
+    return (value + 1) // 2
+
+
+class SampleFactory:
+    # Built once per stream from the VideoFrameSampleFormat so that per frame
+    # work is limited to wrapping the data, or repacking it when the client
+    # layout differs from the one GStreamer expects. Encoded samples are
+    # passed through with image caps for decoding in the pipeline
+
+    def __init__(self, video_frame_sample_format):
+        self.caps = None
+        self._planes = []
+        self._repack = False
+        self._byteswap = False
+        self._size = 0
+        if video_frame_sample_format.encoding == Encoding.RAW:
+            self._init_raw(video_frame_sample_format)
+        else:
+            self.caps = ENCODED_CAPS.get(video_frame_sample_format.encoding)
+
+    def supported(self):
+        return self.caps is not None
+
+    def create_sample(self, data, message=None):
+        if self._repack or self._byteswap:
+            data = self._convert(data)
+        return GvaFrameData(data, self.caps, message=message)
+
+    def _init_raw(self, video_frame_sample_format):
+        pixel_format = video_frame_sample_format.pixel_format
+        width = video_frame_sample_format.dimensions.width
+        height = video_frame_sample_format.dimensions.height
+        stride = video_frame_sample_format.stride_bytes
+
+        if pixel_format in PACKED_FORMATS:
+            caps_format, bytes_per_pixel, byte_order = PACKED_FORMATS[pixel_format]
+            row_bytes = width * bytes_per_pixel
+            self._planes = [
+                Plane(row_bytes, height, stride or row_bytes, _round_up_4(row_bytes))
+            ]
+            self._byteswap = byte_order is not None and byte_order != sys.byteorder
+        elif pixel_format in PLANAR_FORMATS:
+            caps_format = PLANAR_FORMATS[pixel_format]
+            chroma_width = _half(width)
+            chroma_stride = _half(stride) if stride else chroma_width
+            self._planes = [
+                Plane(width, height, stride or width, _round_up_4(width)),
+                Plane(chroma_width, _half(height), chroma_stride, _round_up_4(chroma_width)),
+                Plane(chroma_width, _half(height), chroma_stride, _round_up_4(chroma_width)),
+            ]
+        else:
+            return
+
+        self._repack = any(plane.src_stride != plane.dst_stride for plane in self._planes)
+        # Last row of the last plane need not be padded
+        last_plane = self._planes[-1]
+        self._size = sum(plane.src_stride * plane.rows for plane in self._planes) - \
+            last_plane.src_stride + last_plane.row_bytes
+        self.caps = "video/x-raw,format={},width={},height={}".format(
+            caps_format, width, height)
+
+    def _convert(self, data):
+        source = numpy.frombuffer(data, dtype=numpy.uint8)
+        if source.size < self._size:
+            raise Exception("Sample has {} bytes, expected at least {}".format(
+                source.size, self._size))
+        planes = []
+        offset = 0
+        for plane in self._planes:
+            rows = as_strided(source[offset:], shape=(plane.rows, plane.row_bytes),
+                              strides=(plane.src_stride, 1), writeable=False)
+            converted = numpy.zeros((plane.rows, plane.dst_stride), dtype=numpy.uint8)
+            converted[:, :plane.row_bytes] = rows
+            if self._byteswap:
+                # Swapped formats are 16 bit and strides are multiples of 4
+                converted.view(numpy.uint16).byteswap(inplace=True)
+            planes.append(converted)
+            offset += plane.src_stride * plane.rows
+        return b"".join(plane.tobytes() for plane in planes)
@@ -1,9 +1,14 @@
 
 import os
+import sys
 import json
 import pytest
 from process_helper import ProcessHelper
 
+# Server modules import each other by name as when run with python3 server
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                             "server"))
+
 @pytest.fixture
 def helpers():
     process_helper = ProcessHelper()
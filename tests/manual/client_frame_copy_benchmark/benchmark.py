@@ -0,0 +1,100 @@
+import time
+import queue
+import argparse
+import numpy
+import cv2
+from common.grpc_autogen import media_pb2
+from common.grpc_autogen import extension_pb2
+from media_stream_processor import MediaStreamProcessor
+from grpc_client import PIXEL_FORMATS
+
+SLOTS = 4
+
+
+def convert(image, conversion):
+    if conversion is not None:
+        return cv2.cvtColor(image, conversion)
+    return image
+
+
+def content_bytes_path(msp, generator, image, conversion, _shape):
+    frame = convert(image, conversion).tobytes()
+    media_sample = extension_pb2.MediaSample(
+        timestamp=0, content_bytes=media_pb2.ContentBytes(bytes=frame))
+    seq_no = generator._request_seq_num
+    slot = msp._shared_memory_manager.wait_for_empty_slot(
+        seq_no, len(media_sample.content_bytes.bytes))
+    msp._shared_memory_manager.write_bytes(slot[0], media_sample.content_bytes.bytes)
+    generator._request_seq_num += 1
+    extension_pb2.MediaStreamMessage(
+        sequence_number=seq_no,
+        media_sample=extension_pb2.MediaSample(
+            timestamp=0, content_reference=media_pb2.ContentReference(
+                address_offset=slot[0], length_bytes=len(frame)))).SerializeToString()
+    return seq_no
+
+
+def bytes_path(_msp, generator, image, conversion, _shape):
+    generator._queue.put(convert(image, conversion).tobytes())
+    request = next(generator)
+    request.SerializeToString()
+    return request.sequence_number
+
+
+def in_place_path(msp, generator, image, conversion, shape):
+    view, content_reference = msp.reserve_frame(int(numpy.prod(shape)))
+    destination = numpy.frombuffer(view, dtype=numpy.uint8).reshape(shape)
+    if conversion is not None:
+        cv2.cvtColor(image, conversion, dst=destination)
+    else:
+        numpy.copyto(destination, image)
+    del destination
+    view.release()
+    generator._queue.put(content_reference)
+    request = next(generator)
+    request.SerializeToString()
+    return request.sequence_number
+
+
+def measure(name, args, function, image, conversion, shape, frame_size):
+    msp = MediaStreamProcessor("localhost:5001", True, SLOTS, frame_size, True)
+    generator = MediaStreamProcessor.RequestGenerator(
+        extension_pb2.MediaStreamDescriptor(), msp._shared_memory_manager, queue.Queue())
+    next(generator)
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        seq_no = function(msp, generator, image, conversion, shape)
+        msp._shared_memory_manager.delete_slot(seq_no)
+    cpu = time.process_time() - start_cpu
+    delta = time.perf_counter() - start
+    print("{:<14} {:>8.3f} ms cpu/frame {:>8.3f} ms/frame".format(
+        name, cpu * 1000 / args.iterations, delta * 1000 / args.iterations))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--pixel-format", choices=list(PIXEL_FORMATS), default="bgr24")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    _, conversion, bytes_per_pixel = PIXEL_FORMATS[args.pixel_format]
+    if args.pixel_format == "yuv420p":
+        shape = (args.height * 3 // 2, args.width)
+    else:
+        shape = (args.height, args.width, bytes_per_pixel)
+    frame_size = int(args.width * args.height * bytes_per_pixel)
+    image = numpy.random.randint(0, 255, (args.height, args.width, 3), dtype=numpy.uint8)
+
+    print("Frame size: {} bytes, pixel format: {}, iterations: {}".format(
+        frame_size, args.pixel_format, args.iterations))
+    for name, function in (("content-bytes", content_bytes_path),
+                           ("bytes", bytes_path),
+                           ("in-place", in_place_path)):
+        measure(name, args, function, image, conversion, shape, frame_size)
+
+
+if __name__ == "__main__":
+    main()
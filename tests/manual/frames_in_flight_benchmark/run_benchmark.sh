@@ -0,0 +1,17 @@
+#!/bin/bash
+WINDOW_SIZES=${WINDOW_SIZES:-"1 2 4 8"}
+NIREQ=${NIREQ:-4}
+SAMPLE_FILE=${SAMPLE_FILE:-"https://github.com/intel-iot-devkit/sample-videos/blob/master/person-bicycle-car-detection.mp4?raw=true"}
+
+parent_path=$( cd "$(dirname "${BASH_SOURCE[0]}")" ; pwd -P )
+cd "$parent_path/../../../docker"
+
+for window in $WINDOW_SIZES;
+do
+    echo "frames-in-flight: $window nireq: $NIREQ"
+    ./run_client.sh --pipeline-name object_detection --pipeline-version person_vehicle_bike \
+        --pipeline-parameters "{\\\"nireq\\\":$NIREQ}" \
+        --frames-in-flight $window \
+        --shared-memory \
+        -f "$SAMPLE_FILE" | grep "Start Time"
+done
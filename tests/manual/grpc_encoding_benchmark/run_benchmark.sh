@@ -0,0 +1,22 @@
+#!/bin/bash
+ENCODINGS=${ENCODINGS:-"raw jpeg"}
+SCALE_FACTOR=${SCALE_FACTOR:-1.0}
+SAMPLE_FILE=${SAMPLE_FILE:-"https://github.com/intel-iot-devkit/sample-videos/blob/master/person-bicycle-car-detection.mp4?raw=true"}
+
+parent_path=$( cd "$(dirname "${BASH_SOURCE[0]}")" ; pwd -P )
+cd "$parent_path/../../../docker"
+
+for encoding in $ENCODINGS;
+do
+    for transfer in embedded shared-memory;
+    do
+        SHARED_MEMORY=
+        if [ "$transfer" == "shared-memory" ]; then
+            SHARED_MEMORY="--shared-memory"
+        fi
+        echo "encoding: $encoding transfer: $transfer"
+        ./run_client.sh --grpc-image-encoding $encoding $SHARED_MEMORY \
+            --scale-factor $SCALE_FACTOR \
+            -f "$SAMPLE_FILE" | grep -E "End Time|Frame Bytes Sent"
+    done
+done
@@ -0,0 +1,116 @@
+import os
+import time
+import queue
+import argparse
+import tempfile
+from concurrent import futures
+import grpc
+import numpy
+from common.shared_memory import SharedMemoryManager
+from common.grpc_autogen import extension_pb2
+from common.grpc_autogen import extension_pb2_grpc
+from common.grpc_autogen import media_pb2
+
+PAGE_SIZE = 4096
+
+
+def touch(data):
+    # Read one byte per page, as the pipeline would fault in every page
+    return int(numpy.frombuffer(data, dtype=numpy.uint8)[::PAGE_SIZE].sum())
+
+
+class EchoServicer(extension_pb2_grpc.MediaGraphExtensionServicer):
+    # Acknowledges each frame once it has been read, leaving only the
+    # transport and the frame hand-off in the round trip
+    def ProcessMediaStream(self, request_iterator, context):
+        request = next(request_iterator)
+        properties = request.media_stream_descriptor.shared_memory_buffer_transfer_properties
+        shared_memory = None
+        if properties.handle_name:
+            shared_memory = SharedMemoryManager(name=properties.handle_name,
+                                                size=properties.length_bytes)
+        yield extension_pb2.MediaStreamMessage(sequence_number=1,
+                                               ack_sequence_number=request.sequence_number)
+        for request in request_iterator:
+            sample = request.media_sample
+            if shared_memory:
+                reference = sample.content_reference
+                touch(shared_memory.read_bytes(reference.address_offset, reference.length_bytes))
+            else:
+                touch(sample.content_bytes.bytes)
+            yield extension_pb2.MediaStreamMessage(ack_sequence_number=request.sequence_number)
+
+
+def requests(descriptor, frames):
+    yield extension_pb2.MediaStreamMessage(sequence_number=1,
+                                           media_stream_descriptor=descriptor)
+    while True:
+        request = frames.get()
+        if request is None:
+            return
+        yield request
+
+
+def run(address, frame, use_shared_memory, iterations):
+    descriptor = extension_pb2.MediaStreamDescriptor()
+    shared_memory = None
+    if use_shared_memory:
+        shared_memory = SharedMemoryManager(os.O_RDWR | os.O_CREAT, size=len(frame))
+        shared_memory.write_bytes(0, frame)
+        descriptor.shared_memory_buffer_transfer_properties.handle_name = \
+            shared_memory.shm_file_name
+        descriptor.shared_memory_buffer_transfer_properties.length_bytes = len(frame)
+
+    channel = grpc.insecure_channel(address, options=[
+        ("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)])
+    stub = extension_pb2_grpc.MediaGraphExtensionStub(channel)
+    frames = queue.Queue()
+    responses = stub.ProcessMediaStream(requests(descriptor, frames), wait_for_ready=True)
+    next(responses)
+
+    latencies = []
+    for sequence_number in range(2, iterations + 2):
+        request = extension_pb2.MediaStreamMessage(sequence_number=sequence_number)
+        if shared_memory:
+            request.media_sample.content_reference.length_bytes = len(frame)
+        else:
+            request.media_sample.content_bytes.bytes = frame
+        start = time.perf_counter()
+        frames.put(request)
+        next(responses)
+        latencies.append(time.perf_counter() - start)
+    frames.put(None)
+    channel.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--port", type=int, default=5101)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "grpc.sock")
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), options=[
+            ("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)])
+        extension_pb2_grpc.add_MediaGraphExtensionServicer_to_server(EchoServicer(), server)
+        server.add_insecure_port("[::]:{}".format(args.port))
+        server.add_insecure_port("unix:{}".format(socket_path))
+        server.start()
+
+        frame = os.urandom(args.width * args.height * 3)
+        for transport, address in (("tcp", "localhost:{}".format(args.port)),
+                                   ("unix", "unix:{}".format(socket_path))):
+            for mode, use_shared_memory in (("bytes", False), ("shared-memory", True)):
+                latencies = numpy.array(run(address, frame, use_shared_memory, args.iterations))
+                latencies *= 1e6
+                print("{:<5} {:<14} mean {:>8.1f} us  p50 {:>8.1f} us  p99 {:>8.1f} us".format(
+                    transport, mode, latencies.mean(), numpy.percentile(latencies, 50),
+                    numpy.percentile(latencies, 99)))
+        server.stop(None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+import argparse
+import urllib.request
+
+SAMPLE_FRAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "..", "..", "sampleframes", "sample01.png")
+# Frames of a batch are each preceded by their length, unsigned big endian
+LENGTH_BYTES = 4
+
+
+def post(url, data, content_type):
+    request = urllib.request.Request(url, data=data, method="POST",
+                                     headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def run_single(url, frame, frames, content_type):
+    start = time.perf_counter()
+    for _ in range(frames):
+        post(url, frame, content_type)
+    delta = time.perf_counter() - start
+    # Empty request ends the stream and stops its pipeline
+    post(url, b"", content_type)
+    return frames / delta
+
+
+def run_batch(url, frame, frames, batch_size, content_type):
+    results = 0
+    start = time.perf_counter()
+    for first in range(0, frames, batch_size):
+        count = min(batch_size, frames - first)
+        batch = (len(frame).to_bytes(LENGTH_BYTES, "big") + frame) * count
+        results += len(json.loads(post(url, batch, content_type)))
+    delta = time.perf_counter() - start
+    # Batches need frames, the stream is ended with an empty single frame request
+    post(url.replace("/batch?", "?"), b"", content_type)
+    if results != frames:
+        raise Exception("Expected {} results, received {}".format(frames, results))
+    return frames / delta
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/object_detection/person_vehicle_bike")
+    parser.add_argument("--image", default=SAMPLE_FRAME)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--frames-in-flight", type=int, default=None,
+                        help="Frames in flight for batches, defaults to the server limit")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as image:
+        frame = image.read()
+    content_type = "image/{}".format(os.path.splitext(args.image)[1][1:].replace("jpg", "jpeg"))
+
+    url = "{}?stream-id=benchmark-single".format(args.url)
+    print("single      {:>8.1f} frames/s".format(run_single(url, frame, args.frames, content_type)))
+    for batch_size in args.batch_sizes:
+        url = "{}/batch?stream-id=benchmark-batch-{}".format(args.url, batch_size)
+        if args.frames_in_flight:
+            url += "&frames-in-flight={}".format(args.frames_in_flight)
+        fps = run_batch(url, frame, args.frames, batch_size, content_type)
+        print("batch {:>5} {:>8.1f} frames/s".format(batch_size, fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import os
+import time
+import argparse
+import urllib.request
+from threading import Thread
+
+SAMPLE_FRAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "..", "..", "sampleframes", "sample01.png")
+
+
+def post_frames(url, frame, frames, content_type, results, index):
+    # One camera posting frames in turn, as the HTTP client does
+    for _ in range(frames):
+        request = urllib.request.Request(url, data=frame, method="POST",
+                                         headers={"Content-Type": content_type})
+        with urllib.request.urlopen(request) as response:
+            response.read()
+    # Empty request ends the stream and stops its pipeline
+    request = urllib.request.Request(url, data=b"", method="POST",
+                                     headers={"Content-Type": content_type})
+    urllib.request.urlopen(request).close()
+    results[index] = frames
+
+
+def run(base_url, frame, streams, frames, content_type, run_id):
+    results = [0] * streams
+    threads = []
+    start = time.perf_counter()
+    for index in range(streams):
+        url = "{}?stream-id=benchmark-{}-{}".format(base_url, run_id, index)
+        thread = Thread(target=post_frames,
+                        args=(url, frame, frames, content_type, results, index))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    delta = time.perf_counter() - start
+    return sum(results) / delta
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/object_detection/person_vehicle_bike")
+    parser.add_argument("--image", default=SAMPLE_FRAME)
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as image:
+        frame = image.read()
+    content_type = "image/{}".format(os.path.splitext(args.image)[1][1:].replace("jpg", "jpeg"))
+    for run_id, streams in enumerate(args.streams):
+        fps = run(args.url, frame, streams, args.frames, content_type, run_id)
+        print("{:>3} streams {:>8.1f} frames/s total {:>8.1f} frames/s per stream".format(
+            streams, fps, fps / streams))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import time
+import argparse
+import urllib.request
+import cv2
+
+SAMPLE_FRAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "..", "..", "sampleframes", "sample01.png")
+
+
+def post(url, data, headers):
+    request = urllib.request.Request(url, data=data, method="POST", headers=headers)
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def run(url, image, frames, encoding):
+    # Encodes every frame as the HTTP client does, so the client side cost
+    # is part of the measurement as well as the decode in the pipeline
+    if encoding == "raw":
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Frame-Width": str(image.shape[1]),
+            "X-Frame-Height": str(image.shape[0]),
+            "X-Pixel-Format": "BGR24",
+        }
+    else:
+        headers = {"Content-Type": "image/jpeg"}
+    size = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        if encoding == "raw":
+            data = image.tobytes()
+        else:
+            data = cv2.imencode(".jpeg", image)[1].tobytes()
+        size = len(data)
+        post(url, data, headers)
+    delta = time.perf_counter() - start
+    # Empty request ends the stream and stops its pipeline
+    post(url, b"", headers)
+    return frames / delta, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/object_detection/person_vehicle_bike")
+    parser.add_argument("--image", default=SAMPLE_FRAME)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--encodings", nargs="+", default=["jpeg", "raw"],
+                        choices=["jpeg", "raw"])
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    for encoding in args.encodings:
+        url = "{}?stream-id=benchmark-{}".format(args.url, encoding)
+        fps, size = run(url, image, args.frames, encoding)
+        print("{:>5} {:>10} bytes/frame {:>8.1f} frames/s".format(encoding, size, fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import json
+import time
+import argparse
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.internal import api_implementation
+from common.grpc_autogen import inferencing_pb2
+from common.grpc_autogen import extension_pb2
+
+EXTENSIONS = {"camera-name": "Camera1", "site": "Site1", "zone": "Entrance"}
+
+
+def create_media_sample(entity_count):
+    # Detections as produced by MediaStreamMessageGenerator, with fields
+    # such as subtype and related inferences left at their defaults
+    media_sample = extension_pb2.MediaSample()
+    for index in range(entity_count):
+        inference = media_sample.inferences.add(type=inferencing_pb2.Inference.ENTITY)
+        inference.extensions.update(EXTENSIONS)
+        inference.entity.tag.value = "person"
+        inference.entity.tag.confidence = 0.9
+        inference.entity.box.l = 0.01 * index
+        inference.entity.box.t = 0.2
+        inference.entity.box.w = 0.3
+        inference.entity.box.h = 0.4
+        inference.entity.attributes.add(name="color", value="red", confidence=0.8)
+    return media_sample
+
+
+def serialize_json(media_sample):
+    # MessageToDict with defaults, then JSON encoding by falcon
+    return json.dumps(MessageToDict(media_sample, including_default_value_fields=True)).encode()
+
+
+def serialize_compact_json(media_sample):
+    return json.dumps(MessageToDict(media_sample), separators=(",", ":")).encode()
+
+
+def serialize_protobuf(media_sample):
+    return media_sample.SerializeToString()
+
+
+FORMATS = {
+    "application/json": serialize_json,
+    "application/json; defaults=omit": serialize_compact_json,
+    "application/x-protobuf": serialize_protobuf,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entities", type=int, nargs="+", default=[50])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Serialization cost depends heavily on the protobuf implementation
+    print("protobuf implementation: {}".format(api_implementation.Type()))
+    for entity_count in args.entities:
+        media_sample = create_media_sample(entity_count)
+        for accept, serialize in FORMATS.items():
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                data = serialize(media_sample)
+            delta = time.perf_counter() - start
+            print("{:>5} entities {:<32} {:>10.3f} ms/frame {:>8} bytes".format(
+                entity_count, accept, delta * 1000 / args.iterations, len(data)))
+
+
+if __name__ == "__main__":
+    main()
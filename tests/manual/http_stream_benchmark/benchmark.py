@@ -0,0 +1,85 @@
+import os
+import time
+import socket
+import argparse
+import urllib.parse
+import urllib.request
+from threading import Thread
+
+SAMPLE_FRAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "..", "..", "sampleframes", "sample01.png")
+# Frames of a stream are each preceded by their length, unsigned big endian
+LENGTH_BYTES = 4
+
+
+def post(url, data, content_type):
+    request = urllib.request.Request(url, data=data, method="POST",
+                                     headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def run_requests(url, frame, frames, content_type):
+    start = time.perf_counter()
+    for _ in range(frames):
+        post(url, frame, content_type)
+    delta = time.perf_counter() - start
+    # Empty request ends the stream and stops its pipeline
+    post(url, b"", content_type)
+    return frames / delta
+
+
+def send_frames(connection, frame, frames):
+    chunk = len(frame).to_bytes(LENGTH_BYTES, "big") + frame
+    chunk = b"%x\r\n" % len(chunk) + chunk + b"\r\n"
+    for _ in range(frames):
+        connection.sendall(chunk)
+    # Last chunk ends the upload and the stream
+    connection.sendall(b"0\r\n\r\n")
+
+
+def run_stream(url, frame, frames, content_type):
+    url = urllib.parse.urlsplit(url)
+    connection = socket.create_connection((url.hostname, url.port or 80))
+    start = time.perf_counter()
+    connection.sendall("POST {}?{} HTTP/1.1\r\nHost: {}\r\nContent-Type: {}\r\n"
+                       "Transfer-Encoding: chunked\r\n\r\n".format(
+                           url.path, url.query, url.netloc, content_type).encode())
+    sender = Thread(target=send_frames, args=(connection, frame, frames))
+    sender.start()
+    with connection, connection.makefile("rb") as response:
+        status = response.readline()
+        while response.readline().strip():
+            pass
+        results = sum(1 for _ in response)
+    delta = time.perf_counter() - start
+    sender.join()
+    if results != frames:
+        raise Exception("Expected {} results, received {}: {}".format(frames, results, status))
+    return frames / delta
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/object_detection/person_vehicle_bike")
+    parser.add_argument("--image", default=SAMPLE_FRAME)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--frames-in-flight", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as image:
+        frame = image.read()
+    content_type = "image/{}".format(os.path.splitext(args.image)[1][1:].replace("jpg", "jpeg"))
+
+    url = "{}?stream-id=benchmark-requests".format(args.url)
+    fps = run_requests(url, frame, args.frames, content_type)
+    print("requests                  {:>8.1f} frames/s".format(fps))
+    for frames_in_flight in args.frames_in_flight:
+        url = "{}/stream?stream-id=benchmark-stream-{}&frames-in-flight={}".format(
+            args.url, frames_in_flight, frames_in_flight)
+        fps = run_stream(url, frame, args.frames, content_type)
+        print("stream {:>2} frames in flight {:>8.1f} frames/s".format(frames_in_flight, fps))
+
+
+if __name__ == "__main__":
+    main()
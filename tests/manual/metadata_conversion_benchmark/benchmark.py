@@ -0,0 +1,59 @@
+import json
+import time
+import argparse
+from collections import namedtuple
+import gi
+gi.require_version("Gst", "1.0")
+# pylint: disable=wrong-import-position
+from gi.repository import Gst
+from gstgva import VideoFrame
+from media_stream_message import MediaStreamMessageGenerator
+# pylint: enable=wrong-import-position
+
+WIDTH = 640
+HEIGHT = 480
+
+GvaSample = namedtuple("GvaSample", ["sample", "video_frame"])
+
+
+def create_sample(region_count):
+    caps = Gst.Caps.from_string(
+        "video/x-raw,format=BGR,width={},height={}".format(WIDTH, HEIGHT))
+    buffer = Gst.Buffer.new_allocate(None, WIDTH * HEIGHT * 3, None)
+    video_frame = VideoFrame(buffer, caps=caps)
+    for index in range(region_count):
+        region = video_frame.add_region(
+            index % WIDTH, index % HEIGHT, 32, 64, label="person", confidence=0.9)
+        tensor = region.add_tensor("color")
+        tensor["label"] = "red"
+    video_frame.add_message(json.dumps({"sequence_number": 1, "timestamp": 0}))
+    video_frame.add_message(json.dumps({"events": [{
+        "event-type": "zoneCrossing",
+        "zone-name": "zone",
+        "related-objects": list(range(region_count))
+    }]}))
+    return GvaSample(None, video_frame)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, nargs="+", default=[0, 10, 100])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    Gst.init(None)
+    generator = MediaStreamMessageGenerator({"camera-name": "Camera1"})
+    for region_count in args.regions:
+        # Events are updated in place with inference ids so each
+        # iteration converts a freshly built frame
+        samples = [create_sample(region_count) for _ in range(args.iterations)]
+        start = time.perf_counter()
+        for sample in samples:
+            generator.generate(sample)
+        delta = time.perf_counter() - start
+        print("{:>5} regions {:>10.3f} ms/frame".format(
+            region_count, delta * 1000 / args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+#!/bin/bash
+RUNS=${RUNS:-3}
+
+parent_path=$( cd "$(dirname "${BASH_SOURCE[0]}")" ; pwd -P )
+cd "$parent_path/../../../docker"
+
+for i in $(seq 1 $RUNS);
+do
+    echo "Run $i warm"
+    ./run_client.sh --pipeline-name object_detection --pipeline-version person_vehicle_bike \
+        --max-frames 10 | grep "End Time"
+    echo "Run $i cold"
+    ./run_client.sh --pipeline-name object_detection --pipeline-version person_vehicle_bike \
+        --pipeline-parameters '{\"threshold\":0.51}' \
+        --max-frames 10 | grep "End Time"
+done
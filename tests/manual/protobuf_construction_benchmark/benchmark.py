@@ -0,0 +1,115 @@
+import time
+import argparse
+from collections import namedtuple
+from common.grpc_autogen import inferencing_pb2
+from common.grpc_autogen import extension_pb2
+from media_stream_message import MediaStreamMessageGenerator
+
+EXTENSIONS = {"camera-name": "Camera1", "site": "Site1", "zone": "Entrance"}
+
+GvaSample = namedtuple("GvaSample", ["sample", "video_frame"])
+
+
+class Tensor:
+    def __init__(self, name, detection, label=None):
+        self._name = name
+        self._detection = detection
+        self._label = label
+
+    def name(self):
+        return self._name
+
+    def is_detection(self):
+        return self._detection
+
+    def __getitem__(self, key):
+        return self._label
+
+
+class Region:
+    def __init__(self, index):
+        self._index = index
+        self._tensors = [Tensor("detection", True), Tensor("color", False, "red")]
+
+    def tensors(self):
+        return self._tensors
+
+    def normalized_rect(self):
+        return 0.1, 0.2, 0.3, 0.4
+
+    def label(self):
+        return "person"
+
+    def confidence(self):
+        return 0.9
+
+    def object_id(self):
+        return self._index + 1
+
+
+class VideoFrame:
+    def __init__(self, region_count):
+        self._regions = [Region(index) for index in range(region_count)]
+
+    def regions(self):
+        return self._regions
+
+    def tensors(self):
+        return []
+
+    def messages(self):
+        return ['{"sequence_number": 1, "timestamp": 0}']
+
+
+def copy_path(video_frame):
+    msg = extension_pb2.MediaStreamMessage()
+    inferences = msg.media_sample.inferences
+    for region in video_frame.regions():
+        obj_left, obj_top, obj_width, obj_height = region.normalized_rect()
+        entity = inferencing_pb2.Entity(
+            tag=inferencing_pb2.Tag(value=region.label(), confidence=region.confidence()),
+            box=inferencing_pb2.Rectangle(l=obj_left, t=obj_top, w=obj_width, h=obj_height),
+        )
+        entity.id = str(region.object_id())
+        for tensor in region.tensors():
+            if not tensor.is_detection():
+                entity.attributes.append(inferencing_pb2.Attribute(
+                    name=tensor.name(), value=tensor["label"], confidence=region.confidence()))
+        inference = inferences.add()
+        # pylint: disable=no-member
+        inference.type = inferencing_pb2.Inference.InferenceType.ENTITY
+        for key in EXTENSIONS:
+            inference.extensions[key] = EXTENSIONS[key]
+        inference.entity.CopyFrom(entity)
+    return msg
+
+
+def template_path(generator, sample):
+    return generator.generate(sample)
+
+
+def measure(name, region_count, iterations, function, *args):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(*args)
+    delta = time.perf_counter() - start
+    print("{:<9} {:>5} regions {:>10.3f} ms/frame".format(
+        name, region_count, delta * 1000 / iterations))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, nargs="+", default=[0, 10, 100])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    generator = MediaStreamMessageGenerator(EXTENSIONS)
+    for region_count in args.regions:
+        video_frame = VideoFrame(region_count)
+        measure("copy", region_count, args.iterations, copy_path, video_frame)
+        measure("template", region_count, args.iterations, template_path,
+                generator, GvaSample(None, video_frame))
+
+
+if __name__ == "__main__":
+    main()
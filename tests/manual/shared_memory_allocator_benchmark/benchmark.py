@@ -0,0 +1,90 @@
+import os
+import time
+import argparse
+from collections import deque
+from common.shared_memory import SharedMemoryManager, SharedMemoryRing
+
+SLOT_SIZE = 1024
+
+
+class SortedScanAllocator:
+    # Previous get_empty_slot algorithm, without the lock
+    def __init__(self, size):
+        self.shm_file_size = size
+        self._mem_slots = dict()
+
+    def get_empty_slot(self, seq_no, size_needed):
+        address = None
+        if len(self._mem_slots) < 1:
+            if self.shm_file_size >= size_needed:
+                self._mem_slots[seq_no] = (0, size_needed - 1)
+                address = (0, size_needed - 1)
+        else:
+            self._mem_slots = dict(sorted(self._mem_slots.items(), key=lambda item: item[1]))
+            prev_slot_end = 0
+            for _, memory_slot in self._mem_slots.items():
+                if (memory_slot[0] - prev_slot_end - 1) >= size_needed:
+                    address = (prev_slot_end + 1, prev_slot_end + size_needed)
+                    self._mem_slots[seq_no] = (address[0], address[1])
+                    break
+                prev_slot_end = memory_slot[1]
+            if address is None:
+                if (self.shm_file_size - prev_slot_end + 1) >= size_needed:
+                    address = (prev_slot_end, prev_slot_end + size_needed)
+                    self._mem_slots[seq_no] = (address[0], address[1])
+        return address
+
+    def delete_slot(self, seq_no):
+        try:
+            del self._mem_slots[seq_no]
+            return True
+        except KeyError:
+            return False
+
+
+def run(allocator, slots, iterations):
+    outstanding = deque()
+    held = []
+    for seq_no in range(slots):
+        allocator.get_empty_slot(seq_no, SLOT_SIZE)
+        outstanding.append(seq_no)
+    start = time.perf_counter()
+    for seq_no in range(slots, slots + iterations):
+        oldest = outstanding.popleft()
+        if oldest % 4:
+            allocator.delete_slot(oldest)
+        else:
+            # Acknowledged late, after the next frame
+            held.append(oldest)
+        if len(held) > 1:
+            allocator.delete_slot(held.pop(0))
+        if allocator.get_empty_slot(seq_no, SLOT_SIZE) is None:
+            raise Exception("Allocation failed with {} slots".format(len(outstanding)))
+        outstanding.append(seq_no)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slots", type=int, nargs="+", default=[10, 200, 2000])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    for slots in args.slots:
+        size = (slots + 4) * SLOT_SIZE
+        shared_memory = SharedMemoryManager(os.O_RDWR | os.O_CREAT, size=size)
+        ring = SharedMemoryRing(os.O_RDWR | os.O_CREAT, size=size, slot_size=SLOT_SIZE)
+        for name, allocator in (("sorted-scan", SortedScanAllocator(size)),
+                                ("free-list", shared_memory),
+                                ("ring", ring)):
+            iterations = args.iterations
+            if name == "sorted-scan":
+                # Keep the quadratic case to a bounded run time
+                iterations = max(100, min(iterations, 2000000 // slots ** 2 * 100))
+            delta = run(allocator, slots, iterations)
+            print("{:<12} {:>6} slots {:>10.2f} us/frame".format(
+                name, slots, delta * 1e6 / iterations))
+
+
+if __name__ == "__main__":
+    main()
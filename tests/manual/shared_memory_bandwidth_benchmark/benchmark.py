@@ -0,0 +1,67 @@
+import os
+import time
+import argparse
+import numpy
+from common.shared_memory import SharedMemoryManager
+from common.grpc_autogen import extension_pb2
+from common.grpc_autogen import media_pb2
+
+PAGE_SIZE = 4096
+
+
+def touch(data):
+    # Read one byte per page, as the pipeline would fault in every page
+    return int(numpy.frombuffer(data, dtype=numpy.uint8)[::PAGE_SIZE].sum())
+
+
+def bytes_path(serialized):
+    message = extension_pb2.MediaStreamMessage()
+    message.ParseFromString(serialized)
+    return touch(bytes(memoryview(message.media_sample.content_bytes.bytes)))
+
+
+def shm_copy_path(shm, length):
+    return touch(bytes(shm.read_bytes(0, length)))
+
+
+def shm_zero_copy_path(shm, length):
+    frame = shm.read_frame(0, length)
+    result = touch(frame.data)
+    frame.release()
+    return result
+
+
+def measure(name, iterations, frame_size, function, *args):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(*args)
+    delta = time.perf_counter() - start
+    print("{:<14} {:>10.3f} ms/frame {:>8.2f} GB/s".format(
+        name, delta * 1000 / iterations, frame_size * iterations / delta / 1e9))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    frame = numpy.random.randint(0, 255, (args.height, args.width, 3), dtype=numpy.uint8).tobytes()
+    frame_size = len(frame)
+    serialized = extension_pb2.MediaStreamMessage(
+        sequence_number=2,
+        media_sample=extension_pb2.MediaSample(
+            content_bytes=media_pb2.ContentBytes(bytes=frame))).SerializeToString()
+
+    shm = SharedMemoryManager(os.O_RDWR | os.O_SYNC | os.O_CREAT, size=frame_size)
+    shm.write_bytes(0, frame)
+
+    print("Frame size: {} bytes, iterations: {}".format(frame_size, args.iterations))
+    measure("bytes", args.iterations, frame_size, bytes_path, serialized)
+    measure("shm-copy", args.iterations, frame_size, shm_copy_path, shm, frame_size)
+    measure("shm-zero-copy", args.iterations, frame_size, shm_zero_copy_path, shm, frame_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import numpy
+from common.shared_memory import SharedMemoryManager, PREFAULT, HUGE_PAGES, LOCK
+
+PAGE_SIZE = 4096
+
+OPTION_SETS = [
+    [],
+    [PREFAULT],
+    [HUGE_PAGES],
+    [HUGE_PAGES, PREFAULT],
+    [LOCK],
+    [HUGE_PAGES, PREFAULT, LOCK],
+]
+
+
+def touch(data):
+    # Read one byte per page, as the pipeline would fault in every page
+    return int(numpy.frombuffer(data, dtype=numpy.uint8)[::PAGE_SIZE].sum())
+
+
+def write_pass(shm, frame, frames):
+    # Client writing each frame into its own slot, as on stream start
+    latencies = []
+    for index in range(frames):
+        start = time.perf_counter()
+        shm.write_bytes(index * len(frame), frame)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def read_pass(shm, frame_size, frames):
+    # Server mapping the client region and reading each frame once
+    latencies = []
+    for index in range(frames):
+        start = time.perf_counter()
+        touch(shm.read_bytes(index * frame_size, frame_size))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(memory_options, frame, frames):
+    size = len(frame) * frames
+    start = time.perf_counter()
+    writer = SharedMemoryManager(os.O_RDWR | os.O_CREAT, size=size,
+                                 memory_options=memory_options)
+    map_time = time.perf_counter() - start
+    first_write = write_pass(writer, frame, frames)
+    second_write = write_pass(writer, frame, frames)
+    start = time.perf_counter()
+    reader = SharedMemoryManager(name=writer.shm_file_name, size=size,
+                                 memory_options=memory_options)
+    reader_map_time = time.perf_counter() - start
+    first_read = read_pass(reader, len(frame), frames)
+    return map_time, first_write, second_write, reader_map_time, first_read
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=30)
+    args = parser.parse_args()
+
+    frame = os.urandom(args.width * args.height * 3)
+    print("{:<28} {:>9} {:>11} {:>11} {:>11} {:>9} {:>11} {:>11}".format(
+        "options", "map ms", "write1 avg", "write1 max", "write2 avg",
+        "rmap ms", "read1 avg", "read1 max"))
+    for memory_options in OPTION_SETS:
+        map_time, first_write, second_write, reader_map_time, first_read = run(
+            memory_options, frame, args.frames)
+        print("{:<28} {:>9.2f} {:>11.3f} {:>11.3f} {:>11.3f} {:>9.2f} {:>11.3f} {:>11.3f}".format(
+            ",".join(memory_options) or "none", map_time * 1e3,
+            sum(first_write) * 1e3 / len(first_write), max(first_write) * 1e3,
+            sum(second_write) * 1e3 / len(second_write),
+            reader_map_time * 1e3,
+            sum(first_read) * 1e3 / len(first_read), max(first_read) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
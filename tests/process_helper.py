@@ -17,6 +17,15 @@ class ProcessHelper:
         protocol = params.get("protocol", "grpc")
         server_args = ["python3", "server", "--protocol", protocol]
         server_args.extend(["--max-running-pipelines", str(params.get("max_running_pipelines", 10))])
+        if params.get("grpc_async", False):
+            server_args.append("--grpc-async")
+        if params.get("grpc_unix_socket"):
+            server_args.extend(["--grpc-unix-socket", params["grpc_unix_socket"]])
+        if params.get("pipeline_pool"):
+            server_args.extend(["--pipeline-pool", json.dumps(params["pipeline_pool"])])
+        if "response_shared_memory_threshold" in params:
+            server_args.extend(["--response-shared-memory-threshold",
+                                str(params["response_shared_memory_threshold"])])
         print(' '.join(server_args))
 
         if "ENABLE_RTSP" in os.environ:
@@ -62,16 +71,26 @@ class ProcessHelper:
         if params.get("pipeline"):
             extension_config = json.dumps({"pipeline":params["pipeline"]})
             client_args.extend(["--extension-config", extension_config])
+        if params.get("grpc_server_address"):
+            client_args.extend(["-s", params["grpc_server_address"]])
         if params.get("shared_memory", False):
             client_args.append("-m")
+        if params.get("shared_memory_segments", False):
+            client_args.append("--shared-memory-segments")
         if params.get("output_location"):
             client_args.extend(["-o", params["output_location"]])
         if params.get("max_frames"):
             client_args.extend(["--max-frames", str(params["max_frames"])])
         if params.get("scale_factor"):
             client_args.extend(["--scale-factor", str(params["scale_factor"])])
+        if params.get("grpc_image_encoding"):
+            client_args.extend(["--grpc-image-encoding", params["grpc_image_encoding"]])
+        if params.get("pixel_format"):
+            client_args.extend(["--pixel-format", params["pixel_format"]])
         if params.get("stream_id"):
             client_args.extend(["--http-stream-id", params["stream_id"]])
+        if params.get("http_response_format"):
+            client_args.extend(["--http-response-format", params["http_response_format"]])
 
         print(' '.join(client_args))
         self.client_process = subprocess.Popen(client_args,
@@ -0,0 +1,58 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import time
+from types import SimpleNamespace
+from ack_coalescer import AckCoalescer
+
+
+def response(sequence_number, inferences=False):
+    media_sample = SimpleNamespace(inferences=["inference"] if inferences else [])
+    return SimpleNamespace(ack_sequence_number=sequence_number, media_sample=media_sample)
+
+
+def acks(messages):
+    return [message.ack_sequence_number for message in messages]
+
+
+def test_ack_coalescer_holds_responses_without_inferences():
+    ack_coalescer = AckCoalescer(10)
+    assert not ack_coalescer.add([response(1), response(2)])
+    assert not ack_coalescer.add([response(3)])
+    # Latest held response acknowledges every frame before it
+    assert acks(ack_coalescer.flush()) == [3]
+    assert not ack_coalescer.flush()
+    assert (ack_coalescer.responses, ack_coalescer.messages) == (3, 1)
+
+
+def test_ack_coalescer_sends_inferences_right_away():
+    ack_coalescer = AckCoalescer(10)
+    assert acks(ack_coalescer.add([response(1), response(2, True), response(3)])) == [2]
+    # Held responses before one with inferences are covered by it
+    assert acks(ack_coalescer.add([response(4, True)])) == [4]
+    assert not ack_coalescer.flush()
+
+
+def test_ack_coalescer_interval():
+    ack_coalescer = AckCoalescer(0.05)
+    assert ack_coalescer.timeout(40) == 40
+    assert not ack_coalescer.add([response(1)])
+    assert 0 < ack_coalescer.timeout(40) <= 0.05
+    time.sleep(0.06)
+    assert ack_coalescer.timeout(40) == 0
+    # Due once the interval since the first held response has passed
+    assert acks(ack_coalescer.add([response(2)])) == [2]
+    assert ack_coalescer.timeout(40) == 40
+
+
+def test_ack_coalescer_idle():
+    ack_coalescer = AckCoalescer(10)
+    assert not ack_coalescer.add([response(1)])
+    # Nothing left in the pipeline, the client may be waiting for the ack
+    assert acks(ack_coalescer.add([response(2)], idle=True)) == [2]
+    assert not ack_coalescer.add([], idle=True)
+    assert not ack_coalescer.add([response(3)])
+    assert acks(ack_coalescer.add([], idle=True)) == [3]
@@ -0,0 +1,121 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+from common.grpc_autogen import extension_pb2
+import grpc_async_server
+from grpc_async_server import AsyncGrpcServer
+from grpc_server import State
+
+
+class FakePipelineProcessor:
+    # Stands in for PipelineProcessor, each frame is returned on the output
+    # queue right away unless hold is set
+    hold = False
+
+    def __init__(self, extension_config, max_frames_in_flight=1, output_queue=None):
+        self.extension_config = extension_config
+        self._frames_in_flight = max_frames_in_flight
+        self._output = output_queue
+        self.frames = []
+        self.error = False
+        self.stop_time = None
+
+    def frames_in_flight(self):
+        return self._frames_in_flight
+
+    def submit_frame(self, frame):
+        self.frames.append(frame)
+        if frame is None or not FakePipelineProcessor.hold:
+            self._output.put(frame)
+
+    def generate_response(self, sample):
+        if sample is None:
+            return None
+        return extension_pb2.MediaStreamMessage(ack_sequence_number=sample)
+
+    def stopped(self):
+        return self.stop_time is not None and asyncio.get_event_loop().time() >= self.stop_time
+
+    def idle(self):
+        return True
+
+    def aborted_or_error(self):
+        return self.error
+
+    def set_as_error(self):
+        self.error = True
+
+    def wait_for_completion(self):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(grpc_async_server, "PipelineProcessor", FakePipelineProcessor)
+    FakePipelineProcessor.hold = False
+    extension_server = AsyncGrpcServer(SimpleNamespace(
+        grpc_port=0, grpc_unix_socket=None, max_frames_in_flight=2,
+        response_shared_memory_size=0, response_shared_memory_threshold=0,
+        shared_memory_options=None))
+    extension_server._stopped = False
+    stream_helper = extension_server._stream_helper
+    monkeypatch.setattr(stream_helper, "start_stream", lambda request: (
+        State(request.media_stream_descriptor), None,
+        extension_pb2.MediaStreamMessage(ack_sequence_number=request.sequence_number)))
+    # Frames are tagged with their sequence number instead of a GvaFrameData
+    monkeypatch.setattr(stream_helper, "generate_gva_sample",
+                        lambda client_state, request: request.sequence_number)
+    yield extension_server
+    extension_server._loop.close()
+
+
+async def frames(first, last):
+    for sequence_number in range(first, last + 1):
+        yield extension_pb2.MediaStreamMessage(sequence_number=sequence_number)
+
+
+async def requests(count):
+    yield extension_pb2.MediaStreamMessage(
+        sequence_number=1, media_stream_descriptor=extension_pb2.MediaStreamDescriptor())
+    async for request in frames(2, count + 1):
+        yield request
+
+
+async def collect(responses):
+    return [response.ack_sequence_number async for response in responses]
+
+
+def test_async_server_process_media_stream(server):
+    acks = server._loop.run_until_complete(collect(server.ProcessMediaStream(requests(5), None)))
+    # Descriptor is acknowledged first, then every frame in order
+    assert acks == [1, 2, 3, 4, 5, 6]
+
+
+def test_async_server_empty_stream(server):
+    assert not server._loop.run_until_complete(
+        collect(server.ProcessMediaStream(frames(1, 0), None)))
+
+
+@pytest.mark.parametrize("frames_in_flight", [2, 4])
+def test_async_server_input_ends_when_pipeline_stops(server, frames_in_flight):
+    # Pipeline stops without reporting an error while frames are in flight,
+    # with all credits taken or while waiting for them at end of input
+    FakePipelineProcessor.hold = True
+    pipeline_processor = FakePipelineProcessor(None, frames_in_flight)
+    frame_credits = asyncio.Semaphore(frames_in_flight)
+
+    async def process_input():
+        pipeline_processor.stop_time = asyncio.get_event_loop().time() + 0.1
+        await asyncio.wait_for(server._process_input_request(
+            frames(1, 3), pipeline_processor, State(extension_pb2.MediaStreamDescriptor()),
+            frame_credits), 5)
+
+    server._loop.run_until_complete(process_input())
+    assert pipeline_processor.frames == [1, 2, 3][:frames_in_flight]
+    assert pipeline_processor.error
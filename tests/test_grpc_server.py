@@ -0,0 +1,59 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+from common.grpc_autogen import extension_pb2
+import grpc_server
+from grpc_server import State
+
+
+class Frame:
+    # Shared memory frame referenced by the pipeline until in_use is cleared
+    def __init__(self):
+        self.in_use = True
+
+    def release(self):
+        return not self.in_use
+
+
+def response(sequence_number):
+    return extension_pb2.MediaStreamMessage(ack_sequence_number=sequence_number)
+
+
+def acks(messages):
+    return [message.ack_sequence_number for message in messages]
+
+
+def create_state(frames):
+    client_state = State(extension_pb2.MediaStreamDescriptor())
+    for sequence_number, frame in frames.items():
+        client_state.hold_frame(sequence_number, frame)
+    return client_state
+
+
+def test_state_released_responses_in_order():
+    frames = {sequence_number: Frame() for sequence_number in range(1, 4)}
+    client_state = create_state(frames)
+    frames[1].in_use = False
+    frames[3].in_use = False
+    # Frame 2 is still in use, so its response and the later ones are held
+    assert acks(client_state.released_responses([response(1), response(2), response(3)])) == [1]
+    assert client_state.responses_held()
+    assert not client_state.released_responses()
+    frames[2].in_use = False
+    assert acks(client_state.released_responses([response(4)])) == [2, 3, 4]
+    assert not client_state.responses_held()
+
+
+def test_state_release_held_responses(monkeypatch):
+    monkeypatch.setattr(grpc_server, "FRAME_RELEASE_TIMEOUT", 0.05)
+    frame = Frame()
+    client_state = create_state({1: frame})
+    assert not client_state.released_responses([response(1), response(2)])
+    # At end of stream the responses are sent even if the frame is still in use
+    assert acks(client_state.release_held_responses()) == [1, 2]
+    assert not client_state.responses_held()
+    frame.in_use = False
+    client_state.close()
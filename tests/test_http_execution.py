@@ -9,7 +9,8 @@ from utils import ClientProcess
 def test_http_execution(helpers, test_case, test_filename, generate):
     #Create copy of test case to create the generated file
     _test_case = copy.deepcopy(test_case)
-    helpers.run_server(_test_case["server_params"])
+    expected_messages = _test_case.get("expected_server_log_messages", [])
+    helpers.run_server(_test_case["server_params"], capture_log=bool(expected_messages))
 
     if not "client" in _test_case:
         assert False, "Invalid test"
@@ -32,10 +33,19 @@ def test_http_execution(helpers, test_case, test_filename, generate):
                 rtsp_params, client_params["pipeline"]["frame-destination"])
 
 
+    messages = []
     for client_process in client_processes:
+        # Server log is read while waiting so that its pipe does not fill up
+        while expected_messages and client_process.is_running():
+            messages.extend(helpers.get_server_log_messages())
+            time.sleep(0.25)
         client_process.wait()
         assert client_process.has_correct_return_code()
         utils.validate_output_against_schema(client_process.get_output_location())
+    messages.extend(helpers.get_server_log_messages())
+    for expected_message in expected_messages:
+        assert expected_message in messages, "Missing server log message: {}".format(
+            expected_message)
 
     if test_case.get("golden_results",None):
         utils.golden_results(client_processes, test_case, generate, test_filename)
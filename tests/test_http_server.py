@@ -0,0 +1,419 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+from collections import namedtuple
+from types import SimpleNamespace
+import pytest
+from common.grpc_autogen import extension_pb2
+import http_server
+import sample_factory
+
+FRAME_LATENCY = 0.05
+
+Frame = namedtuple("Frame", ["data", "caps", "message"])
+
+
+class FakePipelineProcessor:
+    # Stands in for PipelineProcessor so the HTTP layer is tested without
+    # a pipeline. Each frame gets one inference tagged with the frame data,
+    # frames starting with b"empty" get none and frames starting with b"wait"
+    # are held until release is set
+    created = []
+    release = threading.Event()
+
+    def __init__(self, extension_config, max_frames_in_flight=1):
+        self.extension_config = extension_config
+        pipeline_config = extension_config["pipeline"]
+        self._frames_in_flight = min(pipeline_config.get("frames-in-flight", 1),
+                                     max_frames_in_flight)
+        self._pooled = pipeline_config.get("parameters", {}).get("pooled", False)
+        # Submit blocks while the pipeline is full, as with PipelineProcessor
+        self._credits = threading.Semaphore(self._frames_in_flight)
+        self._input = queue.Queue()
+        self._output = queue.Queue()
+        self._stopped = False
+        self.frames = []
+        self.stop_calls = 0
+        self.completed = False
+        threading.Thread(target=self._run, daemon=True).start()
+        FakePipelineProcessor.created.append(self)
+
+    def _run(self):
+        while True:
+            frame = self._input.get()
+            if frame is None:
+                self._stopped = not self._pooled
+                self._output.put(None)
+                if self._stopped:
+                    return
+                continue
+            if frame.data.startswith(b"wait"):
+                FakePipelineProcessor.release.wait(10)
+            time.sleep(FRAME_LATENCY)
+            media_sample = extension_pb2.MediaSample()
+            if not frame.data.startswith(b"empty"):
+                inference = media_sample.inferences.add()
+                inference.entity.tag.value = frame.data[:32].decode(errors="replace")
+            self._output.put(extension_pb2.MediaStreamMessage(media_sample=media_sample))
+
+    def compare_extension_config(self, extension_config):
+        return self.extension_config == extension_config
+
+    def frames_in_flight(self):
+        return self._frames_in_flight
+
+    def submit_frame(self, frame):
+        if frame is not None:
+            self._credits.acquire()
+            self.frames.append(frame)
+        self._input.put(frame)
+
+    def get_responses(self, timeout=40):
+        responses = [self._output.get(timeout=timeout)]
+        while not self._output.empty():
+            responses.append(self._output.get())
+        for response in responses:
+            if response is not None:
+                self._credits.release()
+        return responses
+
+    def stopped(self):
+        return self._stopped
+
+    def pooled(self):
+        return self._pooled
+
+    def stop(self):
+        self.stop_calls += 1
+        self._stopped = True
+
+    def wait_for_completion(self):
+        self.completed = True
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(http_server, "PipelineProcessor", FakePipelineProcessor)
+    monkeypatch.setattr(http_server, "GvaFrameData",
+                        lambda data, caps, message=None: Frame(data, caps, message))
+    monkeypatch.setattr(sample_factory, "GvaFrameData",
+                        lambda data, caps, message=None: Frame(data, caps, message))
+    FakePipelineProcessor.created = []
+    FakePipelineProcessor.release.clear()
+    port = _get_free_port()
+    extension_server = http_server.HttpServer(
+        SimpleNamespace(http_port=port, max_frames_in_flight=4))
+    threading.Thread(target=extension_server.start, daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    extension_server.port = port
+    return extension_server
+
+
+def post(server, path, body=b"", headers=None):
+    connection = http.client.HTTPConnection("localhost", server.port, timeout=10)
+    request_headers = {"Content-Type": "image/jpeg"}
+    request_headers.update(headers or {})
+    connection.request("POST", path, body=body, headers=request_headers)
+    response = connection.getresponse()
+    result = (response.status, response.getheader("Content-Type"), response.read())
+    connection.close()
+    return result
+
+
+def test_http_server_pooled_end_of_stream(server):
+    path = "/object_detection/person_vehicle_bike?stream-id=pooled&pooled=true"
+    status, _, _ = post(server, path, b"frame")
+    assert status == 200
+    status, _, _ = post(server, path)
+    assert status == 204
+    pipeline_processor = FakePipelineProcessor.created[0]
+    assert pipeline_processor.completed, "Pooled pipeline not checked back in"
+    assert pipeline_processor.stop_calls == 0
+    assert not server._pipelines
+
+
+
+def test_http_server_streams_in_parallel(server):
+    path = "/object_detection/person_vehicle_bike?stream-id={}"
+    held = {}
+    thread = threading.Thread(target=lambda: held.update(
+        result=post(server, path.format("held"), b"wait")))
+    thread.start()
+    try:
+        # Other streams are served while a request of one stream is in the pipeline
+        for stream in range(3):
+            status, _, _ = post(server, path.format(stream), b"frame")
+            assert status == 200
+        assert thread.is_alive()
+    finally:
+        FakePipelineProcessor.release.set()
+        thread.join(10)
+    assert held["result"][0] == 200
+    assert len(FakePipelineProcessor.created) == 4
+
+
+def test_http_server_stream_locks_removed(server):
+    path = "/object_detection/person_vehicle_bike?stream-id=locks"
+    threads = [threading.Thread(target=post, args=(server, path, b"frame")) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not server._stream_locks
+    status, _, _ = post(server, path)
+    assert status == 204
+    assert not server._stream_locks
+    assert not server._pipelines
+
+
+def raw_headers(width="3", height="2", pixel_format="BGR24", stride=None):
+    headers = {"Content-Type": "application/octet-stream",
+               "X-Frame-Width": width,
+               "X-Frame-Height": height,
+               "X-Pixel-Format": pixel_format}
+    if stride is not None:
+        headers["X-Stride-Bytes"] = stride
+    return headers
+
+
+def test_http_server_raw_frame(server):
+    path = "/object_detection/person_vehicle_bike?stream-id=raw"
+    rows = [bytes(range(9)), bytes(range(9, 18))]
+    status, _, _ = post(server, path, b"".join(rows), raw_headers())
+    assert status == 200
+    frame = FakePipelineProcessor.created[0].frames[0]
+    assert frame.caps == "video/x-raw,format=BGR,width=3,height=2"
+    # Rows are padded to the 4 byte stride GStreamer expects
+    assert frame.data == b"".join(row + bytes(3) for row in rows)
+    # Rows sent with the expected stride are passed through
+    status, _, _ = post(server, path, b"x" * 24, raw_headers(stride="12"))
+    assert status == 200
+    assert FakePipelineProcessor.created[0].frames[1].data == b"x" * 24
+
+
+@pytest.mark.parametrize("headers", [
+    {"X-Frame-Width": "wide"},
+    {"X-Frame-Height": None},
+    {"X-Pixel-Format": "NV12"},
+    {"X-Pixel-Format": "NONE"},
+    {"X-Stride-Bytes": "1.5"},
+], ids=["width", "missing-height", "unknown-format", "unsupported-format", "stride"])
+def test_http_server_raw_frame_bad_headers(server, headers):
+    request_headers = raw_headers()
+    request_headers.update(headers)
+    request_headers = {key: value for key, value in request_headers.items() if value is not None}
+    status, _, body = post(server, "/object_detection/person_vehicle_bike?stream-id=bad-raw",
+                           bytes(18), request_headers)
+    assert status == 400
+    assert "Error" in json.loads(body)
+    assert not FakePipelineProcessor.created
+
+
+def test_http_server_protobuf_response(server):
+    path = "/object_detection/person_vehicle_bike{}?stream-id=protobuf"
+    accept = {"Accept": "application/x-protobuf"}
+    status, content_type, body = post(server, path.format(""), b"frame", accept)
+    assert status == 200
+    assert content_type == "application/x-protobuf"
+    media_sample = extension_pb2.MediaSample.FromString(body)
+    assert media_sample.inferences[0].entity.tag.value == "frame"
+    # Batch results are length prefixed, frames without inferences as length 0
+    frames = [b"frame0", b"empty1", b"frame2"]
+    status, content_type, body = post(server, path.format("/batch"),
+                                      b"".join(frame_bytes(frame) for frame in frames), accept)
+    assert status == 200
+    assert content_type == "application/x-protobuf"
+    tags = []
+    while body:
+        length = int.from_bytes(body[:4], "big")
+        if length:
+            media_sample = extension_pb2.MediaSample.FromString(body[4:4 + length])
+            tags.append(media_sample.inferences[0].entity.tag.value)
+        else:
+            tags.append(None)
+        body = body[4 + length:]
+    assert tags == ["frame0", None, "frame2"]
+
+
+def test_http_server_compact_json_response(server):
+    path = "/object_detection/person_vehicle_bike?stream-id=compact"
+    status, _, body = post(server, path, b"frame")
+    assert status == 200
+    # Full JSON has fields left at their defaults, compact JSON omits them
+    assert "confidence" in json.loads(body)["inferences"][0]["entity"]["tag"]
+    status, content_type, body = post(server, path, b"frame",
+                                      {"Accept": "application/json; defaults=omit"})
+    assert status == 200
+    assert content_type.startswith("application/json")
+    assert b" " not in body
+    assert json.loads(body) == {"inferences": [{"entity": {"tag": {"value": "frame"}}}]}
+    # First supported media range listed wins
+    status, content_type, _ = post(
+        server, path, b"frame",
+        {"Accept": "text/html, application/x-protobuf, application/json"})
+    assert content_type == "application/x-protobuf"
+
+def frame_bytes(data):
+    return len(data).to_bytes(4, "big") + data
+
+
+class StreamUpload:
+    # Chunked upload to the stream endpoint with the response read as it arrives
+
+    def __init__(self, server, path, content_type="image/jpeg", accept="application/x-ndjson"):
+        self._socket = socket.create_connection(("localhost", server.port), timeout=10)
+        self._socket.sendall("POST {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {}\r\n"
+                             "Accept: {}\r\nTransfer-Encoding: chunked\r\n\r\n".format(
+                                 path, content_type, accept).encode())
+        self._response = self._socket.makefile("rb")
+        self.status = None
+
+    def send(self, data):
+        self.send_chunk(frame_bytes(data))
+
+    def send_chunk(self, chunk):
+        self._socket.sendall(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+
+    def end(self):
+        self._socket.sendall(b"0\r\n\r\n")
+
+    def read_line(self):
+        if self.status is None:
+            self.status = int(self._response.readline().split()[1])
+            while self._response.readline().strip():
+                pass
+        return json.loads(self._response.readline())
+
+    def ended(self):
+        return self._response.readline() == b""
+
+    def close(self):
+        self._response.close()
+        self._socket.close()
+
+
+def test_http_server_stream_results_before_next_frame(server):
+    upload = StreamUpload(server, "/object_detection/person_vehicle_bike/stream?stream-id=timing")
+    try:
+        for index in range(3):
+            upload.send("frame{}".format(index).encode())
+            # Result of each frame arrives while the next one is still unsent
+            start = time.time()
+            result = upload.read_line()
+            assert time.time() - start < 2
+            assert result["inferences"][0]["entity"]["tag"]["value"] == "frame{}".format(index)
+        assert upload.status == 200
+        upload.end()
+        assert upload.ended()
+    finally:
+        upload.close()
+    assert FakePipelineProcessor.created[0].completed
+    assert not server._pipelines
+
+
+def test_http_server_stream_holds_stream_lock(server):
+    path = "/object_detection/person_vehicle_bike/stream?stream-id=held"
+    upload = StreamUpload(server, path)
+    try:
+        upload.send(b"frame")
+        upload.read_line()
+        # Requests of the same stream wait until the stream response is done
+        single = {}
+        thread = threading.Thread(target=lambda: single.update(
+            result=post(server, "/object_detection/person_vehicle_bike?stream-id=held",
+                        b"single")))
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        upload.end()
+        thread.join(10)
+        assert single["result"][0] == 200
+    finally:
+        upload.close()
+    assert len(FakePipelineProcessor.created) == 2
+
+
+def test_http_server_stream_error_stops_pipeline(server):
+    upload = StreamUpload(server, "/object_detection/person_vehicle_bike/stream?stream-id=error")
+    try:
+        upload.send(b"frame")
+        assert upload.read_line()["inferences"]
+        # Frame length says more bytes than the upload holds
+        upload.send_chunk(b"\x00\x00\x00\x09ab")
+        upload.end()
+        assert "Error" in upload.read_line()
+    finally:
+        upload.close()
+    assert FakePipelineProcessor.created[0].stop_calls == 1
+    assert not server._pipelines
+
+
+def test_http_server_batch_results_in_frame_order(server):
+    frames = [b"empty0", b"frame1", b"frame2", b"empty3", b"frame4", b"frame5"]
+    status, content_type, body = post(
+        server, "/object_detection/person_vehicle_bike/batch?stream-id=batch",
+        b"".join(frame_bytes(frame) for frame in frames))
+    assert status == 200
+    assert content_type.startswith("application/json")
+    results = json.loads(body)
+    assert len(results) == len(frames)
+    for frame, result in zip(frames, results):
+        if frame.startswith(b"empty"):
+            assert result is None
+        else:
+            assert result["inferences"][0]["entity"]["tag"]["value"] == frame.decode()
+    assert FakePipelineProcessor.created[0].frames_in_flight() == 4
+
+
+@pytest.mark.parametrize("batch_first", [True, False])
+def test_http_server_mixed_batch_and_single_requests(server, batch_first):
+    path = "/object_detection/person_vehicle_bike{}?stream-id=mixed"
+    requests = [(path.format("/batch"), frame_bytes(b"frame0") + frame_bytes(b"frame1")),
+                (path.format(""), b"frame2")]
+    if not batch_first:
+        requests.reverse()
+    for request_path, body in requests:
+        status, _, _ = post(server, request_path, body)
+        assert status == 200
+    assert len(FakePipelineProcessor.created) == 1
+
+
+def test_http_server_empty_batch_rejected(server):
+    path = "/object_detection/person_vehicle_bike/batch?stream-id=empty-batch"
+    status, _, body = post(server, path, frame_bytes(b"frame"))
+    assert status == 200
+    status, _, body = post(server, path)
+    assert status == 400
+    assert "no frames" in json.loads(body)["Error"]
+    assert server._pipelines
+
+
+def test_http_server_stream_compact_json(server):
+    upload = StreamUpload(server, "/object_detection/person_vehicle_bike/stream?stream-id=lines",
+                          accept="application/x-ndjson; defaults=omit")
+    try:
+        upload.send(b"frame")
+        assert upload.read_line() == {"inferences": [{"entity": {"tag": {"value": "frame"}}}]}
+        upload.end()
+    finally:
+        upload.close()
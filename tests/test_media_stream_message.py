@@ -0,0 +1,319 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import json
+import uuid
+from types import SimpleNamespace
+from common.grpc_autogen import inferencing_pb2
+from common.grpc_autogen import extension_pb2
+from media_stream_message import MediaStreamMessageGenerator
+
+EXTENSIONS = {"camera": "entrance", "model": "person-vehicle-bike"}
+
+
+class Tensor:
+    def __init__(self, name, label=None, confidence=None, detection=False):
+        self._name = name
+        self._label = label
+        self._confidence = confidence
+        self._detection = detection
+
+    def name(self):
+        return self._name
+
+    def label(self):
+        return self._label
+
+    def confidence(self):
+        return self._confidence
+
+    def is_detection(self):
+        return self._detection
+
+    def __getitem__(self, key):
+        return {"label": self._label}.get(key)
+
+
+class Region:
+    def __init__(self, label, confidence, rect, object_id=0, tensors=None):
+        self._label = label
+        self._confidence = confidence
+        self._rect = rect
+        self._object_id = object_id
+        self._tensors = tensors or []
+
+    def label(self):
+        return self._label
+
+    def confidence(self):
+        return self._confidence
+
+    def normalized_rect(self):
+        return self._rect
+
+    def object_id(self):
+        return self._object_id
+
+    def tensors(self):
+        return iter(self._tensors)
+
+
+class VideoFrame:
+    def __init__(self, messages, regions=None, tensors=None):
+        self._messages = [json.dumps(message) for message in messages]
+        self._regions = regions or []
+        self._tensors = tensors or []
+        self.tensor_reads = 0
+
+    def messages(self):
+        return iter(self._messages)
+
+    def regions(self):
+        return iter(self._regions)
+
+    def tensors(self):
+        self.tensor_reads += 1
+        return iter(self._tensors)
+
+
+def detection(label, confidence, rect, object_id=0, attributes=()):
+    tensors = [Tensor("detection", detection=True)]
+    tensors.extend(Tensor(name, label=value) for name, value in attributes)
+    return Region(label, confidence, rect, object_id, tensors)
+
+
+def detection_frame():
+    return VideoFrame(
+        [{"sequence_number": 7, "timestamp": 1234},
+         {"events": [
+             {"event-type": "zone-crossing", "zone-name": "door", "direction": "in",
+              "related-objects": [0, 2]},
+             {"event-type": "line-crossing", "line-name": "gate", "count": 3,
+              "related-objects": [2]},
+         ]}],
+        [detection("person", 0.9, (0.1, 0.2, 0.3, 0.4), object_id=5,
+                   attributes=[("color", "red"), ("type", "adult")]),
+         # Region classified but not detected, no entity is reported for it
+         Region("car", 0.5, (0.5, 0.5, 0.1, 0.1), tensors=[Tensor("color", label="blue")]),
+         detection("vehicle", 0.75, (0.6, 0.1, 0.2, 0.2)),
+         detection("bike", 0.6, (0.0, 0.0, 0.5, 0.5))],
+        [Tensor("action", label="walking", confidence=0.8)])
+
+
+def action_frame():
+    return VideoFrame(
+        [{"sequence_number": 8}],
+        tensors=[Tensor("action", label="walking", confidence=0.8),
+                 Tensor("detection", label="none"),
+                 Tensor("action", label="running", confidence=0.2)])
+
+
+# Responses built as the generator did before metadata was decoded once
+# per sample and inferences were built from templates
+class BaselineGenerator: # pylint: disable=too-few-public-methods
+    def __init__(self, extensions):
+        self._extensions = extensions
+
+    def generate(self, video_frame):
+        msg = extension_pb2.MediaStreamMessage()
+        messages = list(video_frame.messages())
+        if messages:
+            message = json.loads(messages[0])
+            if message.get("sequence_number", None):
+                msg.ack_sequence_number = message["sequence_number"]
+            if message.get("timestamp", None):
+                msg.media_sample.timestamp = message["timestamp"]
+        inferences = msg.media_sample.inferences
+        self._add_action_recognition_results(video_frame, inferences)
+        events = []
+        for message in video_frame.messages():
+            message_obj = json.loads(message)
+            if "events" in message_obj.keys():
+                events = message_obj["events"]
+                break
+        self._add_entities(video_frame, inferences, events)
+        for event in events:
+            self._add_event(inferences, event)
+        return msg
+
+    def _add_action_recognition_results(self, video_frame, inferences):
+        if list(video_frame.regions()):
+            return
+        for tensor in video_frame.tensors():
+            if tensor.name() == "action":
+                inference = inferences.add()
+                inference.type = inferencing_pb2.Inference.InferenceType.CLASSIFICATION
+                inference.classification.CopyFrom(inferencing_pb2.Classification(
+                    tag=inferencing_pb2.Tag(value=tensor.label(), confidence=tensor.confidence())))
+                self._add_extensions(inference)
+
+    def _add_extensions(self, inference):
+        if self._extensions:
+            for key in self._extensions:
+                inference.extensions[key] = self._extensions[key]
+
+    @staticmethod
+    def _get_entity_and_attributes(region):
+        attributes = []
+        entity = None
+        for tensor in region.tensors():
+            if tensor.is_detection():
+                obj_left, obj_top, obj_width, obj_height = region.normalized_rect()
+                entity = inferencing_pb2.Entity(
+                    tag=inferencing_pb2.Tag(value=region.label(), confidence=region.confidence()),
+                    box=inferencing_pb2.Rectangle(l=obj_left, t=obj_top, w=obj_width,
+                                                  h=obj_height))
+                if region.object_id():
+                    entity.id = str(region.object_id())
+            elif tensor["label"]:
+                attributes.append([tensor.name(), tensor["label"], region.confidence()])
+        return entity, attributes
+
+    def _add_entities(self, video_frame, inferences, events):
+        for region_index, region in enumerate(video_frame.regions()):
+            entity, attributes = self._get_entity_and_attributes(region)
+            if entity:
+                for attr in attributes:
+                    entity.attributes.append(inferencing_pb2.Attribute(
+                        name=attr[0], value=attr[1], confidence=attr[2]))
+                inference = inferences.add()
+                inference.type = inferencing_pb2.Inference.InferenceType.ENTITY
+                self._add_extensions(inference)
+                inference.entity.CopyFrom(entity)
+                self._update_inference_ids(events, inference, region_index)
+
+    @staticmethod
+    def _update_inference_ids(events, inference, region_index):
+        for event in events:
+            for i in range(len(event['related-objects'])):
+                if region_index == event['related-objects'][i]:
+                    if not inference.inference_id:
+                        inference.inference_id = uuid.uuid4().hex
+                        inference.subtype = "objectDetection"
+                    event['related-objects'][i] = inference.inference_id
+
+    @staticmethod
+    def _add_event(inferences, event):
+        event_name = ""
+        event_properties = {}
+        inference_event = inferences.add()
+        inference_event.type = inferencing_pb2.Inference.InferenceType.EVENT
+        inference_event.inference_id = uuid.uuid4().hex
+        inference_event.subtype = event["event-type"]
+        for inference_id in event['related-objects']:
+            inference_event.related_inferences.append(inference_id)
+        for key, value in event.items():
+            if key in ('event-type', 'related-objects'):
+                continue
+            if "name" in key:
+                event_name = value
+            else:
+                event_properties[key] = str(value)
+        inference_event.event.CopyFrom(inferencing_pb2.Event(
+            name=event_name, properties=event_properties))
+
+
+def normalize_inference_ids(msg):
+    # Ids are random or per stream, numbered in order of first use so
+    # that responses can be compared
+    ids = {}
+    for inference in msg.media_sample.inferences:
+        if inference.inference_id:
+            inference.inference_id = ids.setdefault(inference.inference_id, str(len(ids)))
+        related = [ids.setdefault(inference_id, str(len(ids)))
+                   for inference_id in inference.related_inferences]
+        del inference.related_inferences[:]
+        inference.related_inferences.extend(related)
+    return msg
+
+
+def generate(video_frame, extensions=None, generator=None):
+    generator = generator or MediaStreamMessageGenerator(extensions)
+    return generator.generate(SimpleNamespace(video_frame=video_frame))
+
+
+def test_media_stream_message_matches_baseline():
+    for extensions in (None, EXTENSIONS):
+        for create_frame in (detection_frame, action_frame):
+            expected = normalize_inference_ids(
+                BaselineGenerator(extensions).generate(create_frame()))
+            msg = normalize_inference_ids(generate(create_frame(), extensions))
+            assert msg == expected
+
+
+def test_media_stream_message_entities():
+    msg = generate(detection_frame(), EXTENSIONS)
+    inferences = msg.media_sample.inferences
+    assert (msg.ack_sequence_number, msg.media_sample.timestamp) == (7, 1234)
+    entities = [inference for inference in inferences
+                if inference.type == inferencing_pb2.Inference.InferenceType.ENTITY]
+    assert [entity.entity.tag.value for entity in entities] == ["person", "vehicle", "bike"]
+    person = entities[0]
+    assert person.entity.id == "5"
+    assert [(attribute.name, attribute.value) for attribute in person.entity.attributes] == \
+        [("color", "red"), ("type", "adult")]
+    assert all(attribute.confidence == person.entity.tag.confidence
+               for attribute in person.entity.attributes)
+    assert all(dict(entity.extensions) == EXTENSIONS for entity in entities)
+    # Regions are reported, so the action tensor is not
+    assert not any(inference.type == inferencing_pb2.Inference.InferenceType.CLASSIFICATION
+                   for inference in inferences)
+
+
+def test_media_stream_message_related_objects():
+    msg = generate(detection_frame(), EXTENSIONS)
+    inferences = {inference.inference_id: inference for inference in msg.media_sample.inferences
+                  if inference.inference_id}
+    events = [inference for inference in msg.media_sample.inferences
+              if inference.type == inferencing_pb2.Inference.InferenceType.EVENT]
+    assert [event.subtype for event in events] == ["zone-crossing", "line-crossing"]
+    assert events[0].event.name == "door"
+    assert dict(events[0].event.properties) == {"direction": "in"}
+    assert dict(events[1].event.properties) == {"count": "3"}
+    # Events refer to the entities of the regions they list
+    assert [inferences[inference_id].entity.tag.value
+            for inference_id in events[0].related_inferences] == ["person", "vehicle"]
+    assert [inferences[inference_id].entity.tag.value
+            for inference_id in events[1].related_inferences] == ["vehicle"]
+    assert all(inferences[inference_id].subtype == "objectDetection"
+               for event in events for inference_id in event.related_inferences)
+    # Entities no event refers to have no id, events do not carry extensions
+    bike = [inference for inference in msg.media_sample.inferences
+            if inference.entity.tag.value == "bike"][0]
+    assert not bike.inference_id and not bike.subtype
+    assert not any(event.extensions for event in events)
+
+
+def test_media_stream_message_inference_ids_unique_per_stream():
+    generator = MediaStreamMessageGenerator(None)
+    inference_ids = []
+    for _ in range(3):
+        msg = generate(detection_frame(), generator=generator)
+        inference_ids.extend(inference.inference_id for inference in msg.media_sample.inferences
+                             if inference.inference_id)
+    assert len(inference_ids) == 12
+    assert len(set(inference_ids)) == 12
+    other_stream = generate(detection_frame())
+    assert not set(inference_ids) & {inference.inference_id
+                                     for inference in other_stream.media_sample.inferences}
+
+
+def test_media_stream_message_action_recognition():
+    video_frame = action_frame()
+    msg = generate(video_frame, EXTENSIONS)
+    classifications = [(inference.classification.tag.value,
+                        round(inference.classification.tag.confidence, 3),
+                        dict(inference.extensions))
+                       for inference in msg.media_sample.inferences]
+    assert classifications == [("walking", 0.8, EXTENSIONS), ("running", 0.2, EXTENSIONS)]
+    assert video_frame.tensor_reads == 1
+
+
+def test_media_stream_message_tensors_read_lazily():
+    # Frame tensors are only needed when there are no regions
+    video_frame = detection_frame()
+    generate(video_frame)
+    assert video_frame.tensor_reads == 0
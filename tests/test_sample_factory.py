@@ -0,0 +1,118 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import sys
+from collections import namedtuple
+import pytest
+from common.grpc_autogen import media_pb2
+import sample_factory
+from sample_factory import SampleFactory, PixelFormat, Encoding
+
+Frame = namedtuple("Frame", ["data", "caps", "message"])
+
+
+@pytest.fixture(autouse=True)
+def frame_data(monkeypatch):
+    monkeypatch.setattr(sample_factory, "GvaFrameData",
+                        lambda data, caps, message=None: Frame(data, caps, message))
+
+
+def create_factory(pixel_format, width, height, stride=0, encoding=Encoding.RAW):
+    return SampleFactory(media_pb2.VideoFrameSampleFormat(
+        encoding=encoding,
+        pixel_format=pixel_format,
+        dimensions=media_pb2.Dimensions(width=width, height=height),
+        stride_bytes=stride))
+
+
+def rows(data, row_bytes, stride):
+    # Rows of data laid out with stride, padding filled with 0xff
+    return b"".join(data[begin:begin + row_bytes] + b"\xff" * (stride - row_bytes)
+                    for begin in range(0, len(data), row_bytes))
+
+
+def test_sample_factory_packed_repack():
+    # 3 pixels of BGR24 are 9 bytes, GStreamer expects rows padded to 12
+    factory = create_factory(PixelFormat.BGR24, 3, 2)
+    assert factory.caps == "video/x-raw,format=BGR,width=3,height=2"
+    pixels = bytes(range(18))
+    frame = factory.create_sample(pixels, message={"sequence_number": 1})
+    assert frame.data == bytes(range(9)) + bytes(3) + bytes(range(9, 18)) + bytes(3)
+    assert frame.caps == factory.caps
+    assert frame.message == {"sequence_number": 1}
+
+
+def test_sample_factory_packed_passthrough():
+    # Rows of 4 RGBA pixels are already 4 byte aligned
+    factory = create_factory(PixelFormat.RGBA, 4, 2)
+    pixels = bytes(range(32))
+    assert factory.create_sample(pixels).data is pixels
+
+
+def test_sample_factory_padded_stride():
+    # Client rows padded to 16 bytes are repacked to the 12 bytes GStreamer expects
+    factory = create_factory(PixelFormat.RGB24, 3, 2, stride=16)
+    pixels = bytes(range(18))
+    padded = rows(pixels, 9, 16)
+    assert factory.create_sample(padded).data == rows(pixels, 9, 12).replace(b"\xff", b"\x00")
+    # Last row need not be padded
+    assert factory.create_sample(padded[:-7]).data == factory.create_sample(padded).data
+
+
+def test_sample_factory_i420():
+    factory = create_factory(PixelFormat.YUV420P, 5, 3)
+    assert factory.caps == "video/x-raw,format=I420,width=5,height=3"
+    # Y is 5x3, U and V are 3x2 with rows padded to 8 and 4 bytes
+    luma = bytes(range(15))
+    chroma_u = bytes(range(100, 106))
+    chroma_v = bytes(range(200, 206))
+    frame = factory.create_sample(luma + chroma_u + chroma_v)
+    expected = rows(luma, 5, 8) + rows(chroma_u, 3, 4) + rows(chroma_v, 3, 4)
+    assert frame.data == expected.replace(b"\xff", b"\x00")
+
+
+def test_sample_factory_i420_padded_stride():
+    # Luma stride of 8 gives a chroma stride of 4, as GStreamer expects
+    factory = create_factory(PixelFormat.YUV420P, 6, 4, stride=8)
+    data = bytes(range(8 * 4 + 4 * 2 * 2))
+    assert factory.create_sample(data).data is data
+
+
+@pytest.mark.parametrize("pixel_format, byte_order", [
+    (PixelFormat.RGB565BE, "big"),
+    (PixelFormat.RGB565LE, "little"),
+    (PixelFormat.RGB555BE, "big"),
+    (PixelFormat.RGB555LE, "little"),
+])
+def test_sample_factory_16_bit_byte_order(pixel_format, byte_order):
+    factory = create_factory(pixel_format, 2, 2)
+    pixels = bytes([0x12, 0x34, 0x56, 0x78, 0x9a, 0xbc, 0xde, 0xf0])
+    data = factory.create_sample(pixels).data
+    # GStreamer 16 bit RGB is in host byte order
+    values = [int.from_bytes(pixels[index:index + 2], byte_order) for index in range(0, 8, 2)]
+    assert data == b"".join(value.to_bytes(2, sys.byteorder) for value in values)
+
+
+def test_sample_factory_16_bit_repack():
+    # 3 pixels of RGB565 are 6 bytes, padded to 8 and swapped if needed
+    factory = create_factory(PixelFormat.RGB565BE, 3, 1)
+    data = factory.create_sample(bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])).data
+    assert data == b"".join(value.to_bytes(2, sys.byteorder) for value in (1, 0x203, 0x405, 0))
+
+
+def test_sample_factory_short_sample():
+    factory = create_factory(PixelFormat.BGR24, 3, 2)
+    with pytest.raises(Exception, match="expected at least 18"):
+        factory.create_sample(bytes(17))
+
+
+def test_sample_factory_formats():
+    assert not create_factory(PixelFormat.NONE, 2, 2).supported()
+    encoded = create_factory(PixelFormat.NONE, 2, 2, encoding=Encoding.JPG)
+    assert encoded.supported()
+    assert encoded.caps == "image/jpeg"
+    data = b"jpeg"
+    assert encoded.create_sample(data).data is data
@@ -0,0 +1,303 @@
+'''
+* Copyright (C) 2019-2020 Intel Corporation.
+*
+* SPDX-License-Identifier: BSD-3-Clause
+'''
+
+import os
+import mmap
+import time
+import random
+import pickle
+import threading
+import pytest
+from common.shared_memory import SharedMemoryManager, SharedMemoryRing
+from common.shared_memory import SharedMemorySegments, SharedMemorySegmentCache, SlotWaiter
+from common.shared_memory import SEGMENT_SHIFT, SEGMENT_ALIGNMENT, MEMORY_OPTIONS, LOCK
+from common.memfd import MemfdListener, create_memfd, share_memfd
+
+SHM_SIZE = 4096
+
+
+@pytest.fixture
+def shared_memory():
+    return SharedMemoryManager(os.O_RDWR | os.O_CREAT, size=SHM_SIZE)
+
+
+def check_slots(shared_memory, slots):
+    previous_end = -1
+    for begin, end in sorted(slots.values()):
+        assert 0 <= begin <= end < SHM_SIZE, "Slot out of bounds"
+        assert begin > previous_end, "Slots overlap"
+        previous_end = end
+    # Every byte is either in a slot or free
+    used = sum(end - begin + 1 for begin, end in slots.values())
+    free = sum(end - start for start, end in shared_memory._free_blocks.blocks())
+    assert used + free == SHM_SIZE, "Memory leaked"
+
+
+def test_shared_memory_fill_exactly(shared_memory):
+    slot_size = SHM_SIZE // 4
+    addresses = [shared_memory.get_empty_slot(seq_no, slot_size) for seq_no in range(4)]
+    assert addresses[0] == (0, slot_size - 1)
+    assert addresses[-1] == (SHM_SIZE - slot_size, SHM_SIZE - 1)
+    assert shared_memory.get_empty_slot(4, 1) is None
+    assert shared_memory.delete_slot(1)
+    assert not shared_memory.delete_slot(1)
+    assert shared_memory.get_empty_slot(5, slot_size) == addresses[1]
+
+
+def test_shared_memory_rejects_oversize(shared_memory):
+    assert shared_memory.get_empty_slot(0, 0) is None
+    assert shared_memory.get_empty_slot(0, SHM_SIZE + 1) is None
+    assert shared_memory.get_empty_slot(0, SHM_SIZE) == (0, SHM_SIZE - 1)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_shared_memory_random_allocations(shared_memory, seed):
+    rng = random.Random(seed)
+    slots = {}
+    for seq_no in range(2000):
+        if slots and rng.random() < 0.45:
+            # Mostly in order acknowledgements with some out of order
+            victim = min(slots) if rng.random() < 0.7 else rng.choice(list(slots))
+            assert shared_memory.delete_slot(victim)
+            del slots[victim]
+        else:
+            size = rng.randint(1, SHM_SIZE // 8)
+            address = shared_memory.get_empty_slot(seq_no, size)
+            if address is None:
+                # Only fails when no free block is large enough
+                assert all(end - start < size
+                           for start, end in shared_memory._free_blocks.blocks())
+            else:
+                assert address[1] - address[0] + 1 == size
+                slots[seq_no] = address
+        check_slots(shared_memory, slots)
+
+    for seq_no in list(slots):
+        assert shared_memory.delete_slot(seq_no)
+    # All free space coalesced back into one block
+    assert shared_memory._free_blocks.blocks() == [(0, SHM_SIZE)]
+
+
+def test_shared_memory_ring_in_order():
+    slot_size = SHM_SIZE // 4
+    ring = SharedMemoryRing(os.O_RDWR | os.O_CREAT, size=SHM_SIZE, slot_size=slot_size)
+    assert ring.get_empty_slot(0, slot_size + 1) is None
+    for seq_no in range(100):
+        address = ring.get_empty_slot(seq_no, slot_size - 1)
+        assert address == ((seq_no % 4) * slot_size, (seq_no % 4 + 1) * slot_size - 2)
+        if seq_no >= 3:
+            # Ring is full until the oldest frame is acknowledged
+            assert ring.get_empty_slot(seq_no + 1, slot_size) is None
+            assert ring.delete_slot(seq_no - 3)
+    assert not ring.delete_slot(50)
+
+
+def test_shared_memory_ring_has_no_free_list():
+    ring = SharedMemoryRing(os.O_RDWR | os.O_CREAT, size=SHM_SIZE, slot_size=SHM_SIZE // 4)
+    assert not isinstance(ring, SharedMemoryManager)
+    assert not hasattr(ring, "_free_blocks")
+    assert not hasattr(ring, "_mem_slots")
+
+
+@pytest.mark.parametrize("slot_size", [None, 0, SHM_SIZE + 1])
+def test_shared_memory_ring_invalid_slot_size(slot_size):
+    with pytest.raises(ValueError):
+        SharedMemoryRing(os.O_RDWR | os.O_CREAT, size=SHM_SIZE, slot_size=slot_size)
+
+
+def test_shared_memory_slot_waiter_abstract():
+    with pytest.raises(TypeError):
+        SlotWaiter()  # pylint: disable=abstract-class-instantiated
+
+
+def test_shared_memory_ring_skipped_acknowledgement():
+    slot_size = SHM_SIZE // 4
+    ring = SharedMemoryRing(os.O_RDWR | os.O_CREAT, size=SHM_SIZE, slot_size=slot_size)
+    for seq_no in range(4):
+        assert ring.get_empty_slot(seq_no, slot_size) is not None
+    # Acknowledging frame 2 also returns the slots of frames 0 and 1
+    assert ring.delete_slot(2)
+    for seq_no in range(4, 7):
+        assert ring.get_empty_slot(seq_no, slot_size) is not None
+    assert ring.get_empty_slot(7, slot_size) is None
+
+
+@pytest.mark.parametrize("ring", [False, True])
+def test_shared_memory_wait_for_slot(ring):
+    slot_size = SHM_SIZE // 2
+    if ring:
+        shared_memory = SharedMemoryRing(os.O_RDWR | os.O_CREAT, size=SHM_SIZE,
+                                         slot_size=slot_size)
+    else:
+        shared_memory = SharedMemoryManager(os.O_RDWR | os.O_CREAT, size=SHM_SIZE)
+    assert shared_memory.wait_for_empty_slot(0, slot_size) is not None
+    assert shared_memory.wait_for_empty_slot(1, slot_size) is not None
+    assert shared_memory.wait_for_empty_slot(2, slot_size, timeout=0.05) is None
+    assert shared_memory.wait_for_empty_slot(2, SHM_SIZE + 1) is None
+
+    timer = threading.Timer(0.2, shared_memory.delete_slot, args=(0,))
+    timer.start()
+    start = time.monotonic()
+    assert shared_memory.wait_for_empty_slot(2, slot_size, timeout=10) is not None
+    # Woken by the freed slot rather than by polling
+    assert time.monotonic() - start < 1
+    timer.join()
+    assert shared_memory.wait_count == 2
+    assert shared_memory.wait_time >= 0.2
+
+
+def test_shared_memory_segments_reuse():
+    segments = SharedMemorySegments(2)
+    first = segments.get_empty_slot(0, 100)
+    second = segments.get_empty_slot(1, SEGMENT_ALIGNMENT + 1)
+    assert first == (0, 99)
+    assert second == (1 << SEGMENT_SHIFT, (1 << SEGMENT_SHIFT) + SEGMENT_ALIGNMENT)
+    assert segments.get_empty_slot(2, 100) is None
+    assert segments.shm_file_size == 0
+
+    # Best fit reuses the small segment for a small frame
+    assert segments.delete_slot(0)
+    assert segments.delete_slot(1)
+    assert segments.get_empty_slot(2, 50) == (0, 49)
+    assert segments.get_empty_slot(3, SEGMENT_ALIGNMENT) == (1 << SEGMENT_SHIFT,
+                                                           (1 << SEGMENT_SHIFT) +
+                                                           SEGMENT_ALIGNMENT - 1)
+    assert not segments.delete_slot(0)
+
+
+def test_shared_memory_segments_replace_smallest():
+    segments = SharedMemorySegments(2)
+    assert segments.get_empty_slot(0, 100) is not None
+    assert segments.get_empty_slot(1, 100) is not None
+    assert segments.delete_slot(0)
+    # No free segment fits, so the free one is replaced under a new name
+    address = segments.get_empty_slot(2, 2 * SEGMENT_ALIGNMENT)
+    assert address[0] >> SEGMENT_SHIFT == 2
+    assert sorted(segments._segments) == [1, 2]
+
+
+def test_shared_memory_segments_read_write():
+    segments = SharedMemorySegments(4)
+    cache = SharedMemorySegmentCache(segments.shm_file_name, capacity=1)
+    frames = {}
+    for seq_no in range(8):
+        data = bytes([seq_no]) * (100 * (seq_no + 1))
+        begin, end = segments.get_empty_slot(seq_no, len(data))
+        segments.write_bytes(begin, data)
+        frames[seq_no] = (begin, data)
+        assert bytes(cache.read_frame(begin, end - begin + 1).data) == data
+        if seq_no >= 2:
+            assert segments.delete_slot(seq_no - 2)
+    for seq_no in (6, 7):
+        begin, data = frames[seq_no]
+        assert bytes(cache.read_frame(begin, len(data)).data) == data
+
+
+def test_shared_memory_segment_cache_eviction():
+    segments = SharedMemorySegments(2)
+    cache = SharedMemorySegmentCache(segments.shm_file_name)
+    for seq_no in range(6):
+        # Each frame needs a larger segment, replacing the smallest free one
+        data = bytes([seq_no]) * (SEGMENT_ALIGNMENT * seq_no + 1)
+        begin, end = segments.get_empty_slot(seq_no, len(data))
+        segments.write_bytes(begin, data)
+        frame = cache.read_frame(begin, end - begin + 1)
+        assert bytes(frame.data) == data
+        assert frame.release()
+        assert segments.delete_slot(seq_no)
+        # Segments the client replaced are no longer mapped
+        assert set(cache._segments) <= set(segments._segments)
+    assert len(cache._segments) == 2
+    cache.clear()
+    assert not cache._segments
+
+
+def test_shared_memory_segments_wait_for_slot():
+    segments = SharedMemorySegments(1)
+    assert segments.wait_for_empty_slot(0, 100) is not None
+    assert segments.wait_for_empty_slot(1, 100, timeout=0.05) is None
+    timer = threading.Timer(0.2, segments.delete_slot, args=(0,))
+    timer.start()
+    assert segments.wait_for_empty_slot(1, 100, timeout=10) is not None
+    timer.join()
+    assert segments.wait_count == 2
+
+
+@pytest.mark.parametrize("memory_options", [[option] for option in MEMORY_OPTIONS] +
+                         [MEMORY_OPTIONS])
+def test_shared_memory_options(memory_options):
+    # Options only change how pages are faulted in, never the contents
+    shared_memory = SharedMemoryManager(os.O_RDWR | os.O_CREAT, size=SHM_SIZE * 4,
+                                        memory_options=memory_options)
+    reader = SharedMemoryManager(name=shared_memory.shm_file_name, size=SHM_SIZE * 4,
+                                 memory_options=memory_options)
+    assert shared_memory.locked == (LOCK in memory_options)
+    assert reader.locked == (LOCK in memory_options)
+    data = bytes(range(256)) * 16
+    begin, _ = shared_memory.get_empty_slot(0, len(data))
+    shared_memory.write_bytes(begin, data)
+    assert bytes(reader.read_bytes(begin, len(data))) == data
+
+
+@pytest.fixture
+def memfd_listener(tmp_path):
+    MemfdListener.start(str(tmp_path / "memfd.sock"))
+    yield str(tmp_path / "memfd.sock")
+    MemfdListener.stop()
+
+
+def test_shared_memory_memfd(memfd_listener):
+    fd = create_memfd("test")
+    name = share_memfd(memfd_listener, fd)
+    shared_memory = SharedMemoryManager(os.O_RDWR, name=name, size=SHM_SIZE, fd=fd)
+    reader_fd = MemfdListener.claim(name)
+    assert MemfdListener.claim(name) is None
+    reader = SharedMemoryManager(name=name, size=SHM_SIZE, memory_options=MEMORY_OPTIONS,
+                                 fd=reader_fd)
+    # Locked even though the sealed memory is mapped read only
+    assert reader.locked
+    data = bytes(range(256))
+    begin, _ = shared_memory.get_empty_slot(0, len(data))
+    shared_memory.write_bytes(begin, data)
+    assert bytes(reader.read_bytes(begin, len(data))) == data
+    # Sealed, so the server can only map the memory read only
+    with pytest.raises(PermissionError):
+        mmap.mmap(reader_fd, SHM_SIZE)
+    with pytest.raises(PermissionError):
+        os.ftruncate(reader_fd, SHM_SIZE * 2)
+
+
+def test_shared_memory_frame_release(shared_memory):
+    data = bytes(range(256))
+    begin, _ = shared_memory.get_empty_slot(0, len(data))
+    shared_memory.write_bytes(begin, data)
+    frame = shared_memory.read_frame(begin, len(data))
+    # A consumer exporting the view keeps the frame from being released
+    consumers = [pickle.PickleBuffer(frame.data)]
+    assert not frame.release()
+    assert bytes(consumers[0]) == data
+    consumers.clear()
+    assert frame.release()
+
+
+def test_shared_memory_frame_gst_buffer(shared_memory):
+    # The zero copy path hands the view to the pipeline's app source
+    gi = pytest.importorskip("gi")
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst  # pylint: disable=import-outside-toplevel
+    Gst.init(None)
+    data = bytes(range(256))
+    begin, _ = shared_memory.get_empty_slot(0, len(data))
+    shared_memory.write_bytes(begin, data)
+    frame = shared_memory.read_frame(begin, len(data))
+    buffer = Gst.Buffer.new_wrapped(frame.data)
+    success, map_info = buffer.map(Gst.MapFlags.READ)
+    assert success
+    assert bytes(map_info.data) == data
+    buffer.unmap(map_info)
+    # Released once the pipeline has dropped the buffer
+    del buffer
+    assert frame.release()